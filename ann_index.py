@@ -0,0 +1,347 @@
+# ann_index.py
+
+import argparse
+import json
+import time
+import numpy as np
+
+
+def _sq_distances(queries, points, point_sq_norms=None):
+    """Squared euclidean distances between two row sets, shape (Q, P)."""
+    if point_sq_norms is None:
+        point_sq_norms = np.einsum("ij,ij->i", points, points)
+    query_sq_norms = np.einsum("ij,ij->i", queries, queries)
+    sq_distances = queries @ points.T
+    sq_distances *= -2
+    sq_distances += query_sq_norms[:, None]
+    sq_distances += point_sq_norms[None, :]
+    return np.maximum(sq_distances, 0, out=sq_distances)
+
+
+def kmeans(data, n_clusters, iterations=20, seed=0):
+    """
+    Plain Lloyd's k-means with k-means++ seeding.
+
+    Args:
+        data: (N, D) float32 training rows
+        n_clusters: Number of centroids (clipped to N)
+        iterations: Maximum Lloyd iterations
+        seed: RNG seed so builds are reproducible
+
+    Returns:
+        (n_clusters, D) float32 centroids
+    """
+    data = np.asarray(data, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(data))
+
+    # k-means++ seeding
+    centroids = np.empty((n_clusters, data.shape[1]), dtype=np.float32)
+    centroids[0] = data[rng.integers(len(data))]
+    closest = _sq_distances(data, centroids[:1])[:, 0]
+    for i in range(1, n_clusters):
+        total = closest.sum()
+        if total <= 0:
+            centroids[i:] = data[rng.integers(len(data), size=n_clusters - i)]
+            break
+        centroids[i] = data[rng.choice(len(data), p=closest / total)]
+        np.minimum(closest, _sq_distances(data, centroids[i:i + 1])[:, 0], out=closest)
+
+    for _ in range(iterations):
+        assignment = np.argmin(_sq_distances(data, centroids), axis=1)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+
+        empty = counts == 0
+        updated = centroids.copy()
+        updated[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters from random points
+        if empty.any():
+            updated[empty] = data[rng.integers(len(data), size=int(empty.sum()))]
+
+        shift = float(np.abs(updated - centroids).max())
+        centroids = updated
+        if shift < 1e-6:
+            break
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over a FaceGallery.
+
+    Gallery rows are bucketed by their nearest k-means coarse centroid. A query
+    only scans the `n_probe` closest buckets. With product quantization enabled,
+    the scanned rows are first ranked by compact PQ codes and only the best
+    `rerank` candidates are re-scored exactly against the float32 gallery, so the
+    reported distances are always exact.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, pq_subvectors=0, rerank=64,
+                 min_train_size=2048, retrain_growth=4.0, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.pq_subvectors = pq_subvectors
+        self.rerank = rerank
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+
+        self.centroids = None
+        self.pq_codebooks = None
+        self.trained_size = 0
+        self._lists = []
+        self._codes = np.empty((0, max(pq_subvectors, 1)), dtype=np.uint8)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def needs_training(self, gallery_size):
+        """True when the gallery is large enough to train, or has outgrown the last training."""
+        if gallery_size < self.min_train_size:
+            return False
+        if not self.trained:
+            return True
+        return gallery_size > self.trained_size * self.retrain_growth
+
+    def reset(self):
+        self.centroids = None
+        self.pq_codebooks = None
+        self.trained_size = 0
+        self._lists = []
+        self._codes = np.empty((0, max(self.pq_subvectors, 1)), dtype=np.uint8)
+
+    def train(self, encodings, sample_size=65536):
+        """Fit coarse centroids (and PQ codebooks) and index every row of `encodings`."""
+        self.install(self.fit(encodings, sample_size), encodings)
+
+    def fit(self, encodings, sample_size=65536):
+        """
+        The expensive part of training: k-means for the coarse centroids and PQ codebooks.
+
+        Does not touch the index, so it can run on a copy of the gallery in a
+        background thread while the index keeps serving; apply the result with install().
+
+        Returns:
+            (centroids, pq_codebooks or None)
+        """
+        encodings = np.asarray(encodings, dtype=np.float32)
+        rng = np.random.default_rng(self.seed)
+        if len(encodings) > sample_size:
+            sample = encodings[rng.choice(len(encodings), sample_size, replace=False)]
+        else:
+            sample = encodings
+
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(len(encodings))))
+        centroids = kmeans(sample, n_lists, seed=self.seed)
+
+        pq_codebooks = None
+        if self.pq_subvectors:
+            dimension = encodings.shape[1]
+            if dimension % self.pq_subvectors:
+                raise ValueError("pq_subvectors must divide the encoding dimension")
+            step = dimension // self.pq_subvectors
+            pq_codebooks = np.stack([
+                kmeans(sample[:, j * step:(j + 1) * step], 256, iterations=10, seed=self.seed + j)
+                for j in range(self.pq_subvectors)
+            ])
+        return centroids, pq_codebooks
+
+    def install(self, model, encodings):
+        """Switch to a model from fit() and re-index every row of `encodings` (cheap next to fit)."""
+        self.centroids, self.pq_codebooks = model
+        self._lists = [np.empty(0, dtype=np.intp) for _ in range(len(self.centroids))]
+        self._codes = np.empty((0, max(self.pq_subvectors, 1)), dtype=np.uint8)
+        self.trained_size = len(encodings)
+        self.add(encodings, np.arange(len(encodings)))
+
+    def _encode_pq(self, encodings):
+        step = encodings.shape[1] // self.pq_subvectors
+        codes = np.empty((len(encodings), self.pq_subvectors), dtype=np.uint8)
+        for j, codebook in enumerate(self.pq_codebooks):
+            sub = encodings[:, j * step:(j + 1) * step]
+            codes[:, j] = np.argmin(_sq_distances(sub, codebook), axis=1)
+        return codes
+
+    def add(self, encodings, rows):
+        """Insert gallery rows incrementally (no retraining)."""
+        if not self.trained:
+            return
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        rows = np.asarray(rows, dtype=np.intp)
+
+        assignment = np.argmin(_sq_distances(encodings, self.centroids), axis=1)
+        order = np.argsort(assignment, kind="stable")
+        bucket_ids, starts = np.unique(assignment[order], return_index=True)
+        for bucket, chunk in zip(bucket_ids, np.split(rows[order], starts[1:])):
+            self._lists[bucket] = np.concatenate([self._lists[bucket], chunk])
+
+        if self.pq_codebooks is not None:
+            needed = int(rows.max()) + 1 if len(rows) else 0
+            if needed > len(self._codes):
+                grown = np.zeros((max(needed, 2 * len(self._codes)), self.pq_subvectors), dtype=np.uint8)
+                grown[:len(self._codes)] = self._codes
+                self._codes = grown
+            self._codes[rows] = self._encode_pq(encodings)
+
+    def remove_rows(self, rows):
+        """Drop gallery rows from the inverted lists."""
+        rows = np.asarray(rows, dtype=np.intp)
+        for bucket, members in enumerate(self._lists):
+            self._lists[bucket] = members[~np.isin(members, rows)]
+
+    def move_row(self, old_row, new_row):
+        """Renumber a gallery row (used when the gallery compacts on delete)."""
+        for members in self._lists:
+            members[members == old_row] = new_row
+        if self.pq_codebooks is not None and old_row < len(self._codes):
+            self._codes[new_row] = self._codes[old_row]
+
+    def _candidates(self, query):
+        centroid_distances = _sq_distances(query[None, :], self.centroids)[0]
+        n_probe = min(self.n_probe, len(self.centroids))
+        probe = np.argpartition(centroid_distances, n_probe - 1)[:n_probe]
+        return np.concatenate([self._lists[bucket] for bucket in probe])
+
+    def search(self, queries, gallery_encodings, gallery_sq_norms, k=1):
+        """
+        Approximate top-k search with exact distances for the returned rows.
+
+        Args:
+            queries: (F, D) query encodings
+            gallery_encodings: (N, D) float32 gallery matrix
+            gallery_sq_norms: (N,) squared norms of the gallery rows
+            k: Number of neighbours per query
+
+        Returns:
+            (indices, distances) arrays of shape (F, k); missing slots are -1/inf
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, gallery_encodings.shape[1])
+        indices = np.full((len(queries), k), -1, dtype=np.intp)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+
+        for q, query in enumerate(queries):
+            candidates = self._candidates(query)
+            if len(candidates) == 0:
+                continue
+
+            if self.pq_codebooks is not None and len(candidates) > self.rerank:
+                step = len(query) // self.pq_subvectors
+                tables = np.stack([
+                    _sq_distances(query[None, j * step:(j + 1) * step], codebook)[0]
+                    for j, codebook in enumerate(self.pq_codebooks)
+                ])
+                codes = self._codes[candidates]
+                approx = tables[np.arange(self.pq_subvectors), codes].sum(axis=1)
+                candidates = candidates[np.argpartition(approx, self.rerank - 1)[:self.rerank]]
+
+            # Exact re-ranking of the shortlist
+            exact = _sq_distances(query[None, :], gallery_encodings[candidates],
+                                  gallery_sq_norms[candidates])[0]
+            top = min(k, len(candidates))
+            best = np.argpartition(exact, top - 1)[:top]
+            best = best[np.argsort(exact[best])]
+            indices[q, :top] = candidates[best]
+            distances[q, :top] = np.sqrt(exact[best])
+
+        return indices, distances
+
+
+def synthetic_gallery(size, dimension=128, identities=None, seed=0):
+    """Clustered unit-scale encodings that roughly mimic dlib face embeddings."""
+    rng = np.random.default_rng(seed)
+    identities = identities or size
+    centres = rng.normal(scale=0.09, size=(identities, dimension)).astype(np.float32)
+    owners = np.arange(size) % identities
+    jitter = rng.normal(scale=0.02, size=(size, dimension)).astype(np.float32)
+    return centres[owners] + jitter
+
+
+def recall_report(gallery, queries, n_probes=(1, 2, 4, 8, 16, 32), k=1, tolerance=0.6, **index_options):
+    """
+    Compare an IVFIndex against the exact scan at several operating points.
+
+    For every n_probe the report lists recall@k against the exact top-k, the
+    fraction of queries whose accept/reject decision at `tolerance` (and the
+    accepted identity) is unchanged, and mean per-query latency for both paths.
+
+    Args:
+        gallery: FaceGallery to search
+        queries: (Q, 128) query encodings
+        n_probes: Operating points to evaluate
+        k: Neighbours per query
+        tolerance: Match threshold used by FacialRecognition
+
+    Returns:
+        List of dicts, one per operating point
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    encodings = gallery.encodings
+    sq_norms = np.einsum("ij,ij->i", encodings, encodings)
+
+    start = time.perf_counter()
+    exact_indices, exact_distances = gallery.select_top_k(gallery.distances(queries), k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    exact_accept = exact_distances[:, 0] <= tolerance
+
+    index = IVFIndex(min_train_size=0, **index_options)
+    start = time.perf_counter()
+    index.train(encodings)
+    build_s = time.perf_counter() - start
+
+    report = []
+    for n_probe in n_probes:
+        index.n_probe = n_probe
+        start = time.perf_counter()
+        approx_indices, approx_distances = index.search(queries, encodings, sq_norms, k)
+        approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        hits = sum(len(set(a) & set(e)) for a, e in zip(approx_indices, exact_indices))
+        approx_accept = approx_distances[:, 0] <= tolerance
+        same_decision = (approx_accept == exact_accept) & (
+            ~exact_accept | (approx_indices[:, 0] == exact_indices[:, 0]))
+
+        report.append({
+            "n_probe": n_probe,
+            "n_lists": len(index.centroids),
+            "pq_subvectors": index.pq_subvectors,
+            "recall_at_k": hits / exact_indices.size,
+            "decision_agreement": float(same_decision.mean()),
+            "approx_ms_per_query": approx_ms,
+            "exact_ms_per_query": exact_ms,
+            "build_seconds": build_s,
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of the approximate face index")
+    parser.add_argument("--gallery-size", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--pq-subvectors", type=int, default=0)
+    parser.add_argument("--rerank", type=int, default=64)
+    parser.add_argument("--n-probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    from face_gallery import FaceGallery
+
+    encodings = synthetic_gallery(args.gallery_size)
+    gallery = FaceGallery(capacity=len(encodings))
+    gallery.add_many(encodings, [str(i) for i in range(len(encodings))])
+
+    rng = np.random.default_rng(1)
+    picks = rng.integers(len(encodings), size=args.queries)
+    queries = encodings[picks] + rng.normal(scale=0.02, size=(args.queries, encodings.shape[1])).astype(np.float32)
+
+    report = recall_report(gallery, queries, n_probes=args.n_probes, k=args.k,
+                           pq_subvectors=args.pq_subvectors, rerank=args.rerank)
+    for row in report:
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
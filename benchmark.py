@@ -0,0 +1,272 @@
+# benchmark.py
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+DEFAULT_GALLERY_SIZES = [100, 1000, 10000, 100000, 1000000]
+DEFAULT_LOAD_SIZES = [1000, 10000]
+
+
+def measure(fn, repeat=20, warmup=2, items=1):
+    """
+    Time `fn` and measure its peak Python/NumPy allocation.
+
+    Args:
+        fn: Zero-argument callable to benchmark
+        repeat: Timed calls
+        warmup: Untimed calls first
+        items: Work items per call, for throughput
+
+    Returns:
+        Dict of latency percentiles (ms), throughput (items/s) and peak_mb
+    """
+    for _ in range(warmup):
+        fn()
+
+    gc.collect()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    # Peak memory from one extra call, so tracing overhead does not skew the timings
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples = np.asarray(samples)
+    return {
+        "repeat": repeat,
+        "mean_ms": round(float(samples.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "min_ms": round(float(samples.min()), 4),
+        "throughput_per_s": round(items * 1000 / float(samples.mean()), 2) if samples.mean() > 0 else None,
+        "peak_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def synthetic_frame(width=500, height=350, seed=0):
+    """Noisy BGR frame the same size as the UI feed."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+
+
+def load_images(directory, limit=20):
+    """BGR images from a directory of real face photos, if one was given."""
+    import cv2
+
+    images = []
+    for filename in sorted(os.listdir(directory)):
+        image = cv2.imread(os.path.join(directory, filename))
+        if image is not None:
+            images.append(image)
+        if len(images) >= limit:
+            break
+    return images
+
+
+def bench_detection(frames, repeat):
+    import cv2
+    from facial_recognition import FacialRecognition
+
+    recognition = FacialRecognition()
+    rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+    state = {"i": 0}
+
+    def run():
+        recognition.detect_faces(rgb_frames[state["i"] % len(rgb_frames)])
+        state["i"] += 1
+
+    return {"detection": measure(run, repeat)}
+
+
+def bench_encoding(frames, repeat, faces_per_frame=(1, 4), processes=None):
+    """
+    Encoding cost per frame for a fixed number of face boxes (works on any image).
+
+    With `processes`, crowded frames go through an EncodingEngine pool of that size.
+    """
+    import cv2
+    from facial_recognition import FacialRecognition
+
+    recognition = FacialRecognition()
+    engine = None
+    if processes:
+        from encoding_engine import EncodingEngine
+        engine = EncodingEngine(processes).start()
+        engine.wait_ready()
+        recognition.use_encoding_engine(engine)
+    rgb = cv2.cvtColor(frames[0], cv2.COLOR_BGR2RGB)
+    height, width = rgb.shape[:2]
+    results = {}
+    for count in faces_per_frame:
+        size = min(height, width // count) - 2
+        boxes = [(1, (i + 1) * size, 1 + size, i * size) for i in range(count)]
+        results[f"encoding_{count}_faces"] = measure(lambda: recognition.encode_faces(rgb, boxes), repeat,
+                                                     items=count)
+    if engine is not None:
+        engine.close()
+    return results
+
+
+def bench_matching(gallery_sizes, repeat, faces=4, k=5, with_index=False):
+    from ann_index import IVFIndex, synthetic_gallery
+    from confidence_recognition import ConfidenceRecognition
+
+    results = {}
+    rng = np.random.default_rng(1)
+    for size in gallery_sizes:
+        encodings = synthetic_gallery(size)
+        recognition = ConfidenceRecognition(None, None)
+        recognition.gallery.add_many(encodings, [str(i) for i in range(size)])
+        queries = encodings[rng.integers(size, size=faces)] + rng.normal(scale=0.02, size=(faces, 128))
+        frame = synthetic_frame()
+        boxes = [(10, 60, 60, 10)] * faces
+
+        results[f"match_exact_n{size}"] = measure(
+            lambda: recognition.build_result(frame, boxes, queries), repeat, items=faces)
+        results[f"top{k}_exact_n{size}"] = measure(
+            lambda: recognition.gallery.match(queries, k), repeat, items=faces)
+        results[f"confidence_ensemble_n{size}"] = measure(
+            lambda: recognition._calculate_confidence_ensemble(queries[0]), repeat)
+
+        if with_index and size >= 10000:
+            start = time.perf_counter()
+            recognition.gallery.set_index(IVFIndex(min_train_size=0))
+            recognition.gallery.wait_for_index()
+            build_ms = (time.perf_counter() - start) * 1000
+            stats = measure(lambda: recognition.build_result(frame, boxes, queries), repeat, items=faces)
+            stats["build_ms"] = round(build_ms, 1)
+            results[f"match_ivf_n{size}"] = stats
+
+        del recognition, encodings
+        gc.collect()
+    return results
+
+
+def bench_mongo_load(load_sizes, repeat):
+    """Gallery load from a local Mongo stand-in, list vs Binary encodings."""
+    try:
+        import mongomock
+    except ImportError:
+        return {"mongo_load": {"skipped": "mongomock not installed"}}
+
+    from ann_index import synthetic_gallery
+    from encoding_codec import encoding_to_binary
+    from face_gallery import FaceGallery
+    from gallery_sync import GallerySync
+
+    results = {}
+    for size in load_sizes:
+        encodings = synthetic_gallery(size)
+        for fmt in ("list", "binary"):
+            collection = mongomock.MongoClient()["face_db"][f"known_faces_{fmt}"]
+            collection.insert_many([
+                {"name": str(i),
+                 "encoding": encoding.tolist() if fmt == "list" else encoding_to_binary(encoding),
+                 "image_path": f"images/{i}.jpg"}
+                for i, encoding in enumerate(encodings)
+            ])
+            sync = GallerySync(collection, FaceGallery())
+            results[f"mongo_load_{fmt}_n{size}"] = measure(sync.load_full, max(1, repeat // 5), warmup=1,
+                                                            items=size)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.time(),
+    }
+
+
+def compare(current, baseline, threshold=0.10):
+    """
+    Regressions of p50 latency beyond `threshold` (fractional) against a baseline run.
+
+    Returns:
+        List of (benchmark name, baseline p50, current p50, relative change)
+    """
+    regressions = []
+    for name, stats in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before or "p50_ms" not in stats or "p50_ms" not in before or before["p50_ms"] <= 0:
+            continue
+        change = stats["p50_ms"] / before["p50_ms"] - 1
+        if change > threshold:
+            regressions.append((name, before["p50_ms"], stats["p50_ms"], round(change, 3)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for detection, encoding, matching and loading")
+    parser.add_argument("--stages", nargs="+", default=["detection", "encoding", "matching", "mongo"],
+                        choices=["detection", "encoding", "matching", "mongo"])
+    parser.add_argument("--gallery-sizes", type=int, nargs="+", default=DEFAULT_GALLERY_SIZES)
+    parser.add_argument("--load-sizes", type=int, nargs="+", default=DEFAULT_LOAD_SIZES)
+    parser.add_argument("--images", help="directory of real face photos (default: synthetic frames)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--with-index", action="store_true", help="also benchmark the IVF index")
+    parser.add_argument("--faces", type=int, nargs="+", default=[1, 4], help="face boxes per frame for encoding")
+    parser.add_argument("--encoding-processes", type=int, default=None,
+                        help="benchmark encoding through an EncodingEngine pool of this size")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p50 slowdown (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    frames = load_images(args.images) if args.images else []
+    frames = frames or [synthetic_frame(seed=i) for i in range(4)]
+
+    results = {}
+    if "detection" in args.stages:
+        results.update(bench_detection(frames, args.repeat))
+    if "encoding" in args.stages:
+        results.update(bench_encoding(frames, args.repeat, args.faces, args.encoding_processes))
+    if "matching" in args.stages:
+        results.update(bench_matching(args.gallery_sizes, args.repeat, with_index=args.with_index))
+    if "mongo" in args.stages:
+        results.update(bench_mongo_load(args.load_sizes, args.repeat))
+
+    report = {
+        "environment": environment(),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for name, stats in results.items():
+        print(f"{name:40s} {json.dumps(stats)}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for name, before, after, change in regressions:
+            print(f"[REGRESSION] {name}: p50 {before:.3f} ms -> {after:.3f} ms (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# bulk_enroll.py
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+from datetime import datetime
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+from encoding_codec import encoding_to_binary
+from face_gallery import FaceGallery
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def find_images(root):
+    """
+    Yield (name, image_path) for every image under `root`.
+
+    Images in a sub-directory are enrolled under the sub-directory name
+    (root/Jane Doe/badge.jpg); images directly in `root` use their file stem
+    up to the first underscore (root/Jane Doe_2023.jpg).
+    """
+    for directory, _, files in os.walk(root):
+        for filename in sorted(files):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(directory, filename)
+            if os.path.abspath(directory) != os.path.abspath(root):
+                name = os.path.basename(directory)
+            else:
+                name = os.path.splitext(filename)[0].split("_")[0]
+            yield name, path
+
+
+def read_manifest(manifest_path):
+    """Yield (name, image_path) rows from a CSV with `name` and `image_path` columns."""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline="") as f:
+        for row in csv.DictReader(f):
+            path = row["image_path"]
+            if not os.path.isabs(path):
+                path = os.path.join(base, path)
+            yield row["name"].strip(), path
+
+
+def encode_image(job):
+    """
+    Worker: load one image and return its single face encoding.
+
+    Returns:
+        (name, path, status, encoding bytes or None); status is "ok",
+        "unreadable", "no_face" or "multiple_faces"
+    """
+    import cv2
+    import face_recognition
+
+    name, path = job
+    image = cv2.imread(path)
+    if image is None:
+        return name, path, "unreadable", None
+
+    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    face_locations = face_recognition.face_locations(rgb_image, model="hog")
+    if not face_locations:
+        return name, path, "no_face", None
+    if len(face_locations) > 1:
+        return name, path, "multiple_faces", None
+
+    encoding = face_recognition.face_encodings(rgb_image, face_locations)[0]
+    return name, path, "ok", np.asarray(encoding, dtype=np.float32).tobytes()
+
+
+class Checkpoint:
+    """Append-only log of images already handled, so an interrupted run can resume."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)["path"])
+                    except (ValueError, KeyError):
+                        continue
+
+    def record(self, entries):
+        if not self.path or not entries:
+            return
+        with open(self.path, "a") as f:
+            for path, status in entries:
+                f.write(json.dumps({"path": path, "status": status}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(path for path, _ in entries)
+
+
+class BulkEnroller:
+    """
+    Encode a large set of badge photos in parallel and write them to MongoDB in batches.
+
+    Images with zero or several faces are rejected, and encodings closer than
+    `dedupe_distance` to something already in the gallery (or earlier in this
+    run) are skipped as duplicates. Batches are written with one unordered
+    bulk_write of upserts keyed on image_path, and the checkpoint file is only
+    appended to after its batch is written, so re-running after a crash resumes
+    where it stopped without double inserts.
+    """
+
+    def __init__(self, collection, gallery=None, processes=None, batch_size=500,
+                 dedupe_distance=0.2, checkpoint_path="bulk_enroll.checkpoint", report_every=5.0):
+        self.collection = collection
+        self.gallery = gallery if gallery is not None else FaceGallery()
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.dedupe_distance = dedupe_distance
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.report_every = report_every
+
+        self.counts = {"ok": 0, "duplicate": 0, "no_face": 0, "multiple_faces": 0,
+                       "unreadable": 0, "skipped": 0}
+        self._pending_docs = []
+        self._pending_entries = []
+
+    def _is_duplicate(self, encoding):
+        if len(self.gallery) == 0:
+            return False
+        _, distances = self.gallery.match(encoding[None, :], 1)
+        return distances.shape[1] > 0 and distances[0, 0] <= self.dedupe_distance
+
+    def _flush(self):
+        if self._pending_docs:
+            self.collection.bulk_write(
+                [UpdateOne({"image_path": doc["image_path"]}, {"$setOnInsert": doc}, upsert=True)
+                 for doc in self._pending_docs],
+                ordered=False,
+            )
+        self.checkpoint.record(self._pending_entries)
+        self._pending_docs = []
+        self._pending_entries = []
+
+    def _handle(self, name, path, status, encoding_bytes):
+        if status == "ok":
+            encoding = np.frombuffer(encoding_bytes, dtype=np.float32)
+            if self._is_duplicate(encoding):
+                status = "duplicate"
+            else:
+                doc = {
+                    "_id": ObjectId(),
+                    "name": name,
+                    "encoding": encoding_to_binary(encoding),
+                    "image_path": path,
+                    "timestamp": datetime.utcnow(),
+                    "source": "bulk_enroll",
+                }
+                self._pending_docs.append(doc)
+                # Added now so later duplicates in this run are caught
+                self.gallery.add(encoding, name, doc["_id"])
+        self.counts[status] += 1
+        self._pending_entries.append((path, status))
+
+        if len(self._pending_docs) >= self.batch_size or len(self._pending_entries) >= 4 * self.batch_size:
+            self._flush()
+
+    def run(self, jobs):
+        """
+        Enroll every (name, image_path) job.
+
+        Returns:
+            Summary dict with per-status counts, elapsed seconds and images/second
+        """
+        todo = []
+        for name, path in jobs:
+            if path in self.checkpoint.done:
+                self.counts["skipped"] += 1
+            else:
+                todo.append((name, path))
+
+        start = time.monotonic()
+        last_report = start
+        processed = 0
+        with multiprocessing.get_context("spawn").Pool(self.processes) as pool:
+            for name, path, status, encoding_bytes in pool.imap_unordered(encode_image, todo, chunksize=4):
+                self._handle(name, path, status, encoding_bytes)
+                processed += 1
+
+                now = time.monotonic()
+                if now - last_report >= self.report_every:
+                    rate = processed / (now - start)
+                    print(f"[INFO] {processed}/{len(todo)} images, {rate:.1f} images/s")
+                    last_report = now
+        self._flush()
+
+        elapsed = time.monotonic() - start
+        summary = dict(self.counts)
+        summary["processed"] = processed
+        summary["elapsed_s"] = round(elapsed, 2)
+        summary["images_per_s"] = round(processed / elapsed, 2) if elapsed > 0 else 0.0
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-enroll faces from a directory or CSV manifest")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="directory of images (sub-directory or file stem = name)")
+    source.add_argument("--manifest", help="CSV with name,image_path columns")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dedupe-distance", type=float, default=0.2)
+    parser.add_argument("--checkpoint", default="bulk_enroll.checkpoint")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    from gallery_sync import GallerySync
+
+    load_dotenv()
+    uri = (os.getenv("MONGO_URI") or "").strip('"')
+    if not uri:
+        print("Error: MONGO_URI is not set.")
+        raise SystemExit(1)
+
+    collection = MongoClient(uri)["face_db"]["known_faces"]
+    gallery = FaceGallery()
+    GallerySync(collection, gallery).load_full()
+
+    jobs = find_images(args.dir) if args.dir else read_manifest(args.manifest)
+    enroller = BulkEnroller(collection, gallery, processes=args.processes, batch_size=args.batch_size,
+                            dedupe_distance=args.dedupe_distance, checkpoint_path=args.checkpoint)
+    print(json.dumps(enroller.run(jobs)))
+
+
+if __name__ == "__main__":
+    main()
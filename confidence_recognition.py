@@ -1,9 +1,9 @@
-import face_recognition
 import numpy as np
 import cv2
 import os
 import logging
-from facial_recognition import FacialRecognition
+from facial_recognition import FacialRecognition, load_face_models
+from metrics import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,100 +20,113 @@ class ConfidenceRecognition(FacialRecognition):
     - Low confidence (<50%)
     """
     
-    def __init__(self, capture, name_cap):
+    def __init__(self, capture, name_cap, gallery=None):
         # Initialize parent class FacialRecognition
-        super().__init__()
+        super().__init__(gallery)
         
         # Confidence thresholds
         self.confidence_threshold = 0.6
         self.high_confidence_threshold = 0.7
         self.medium_confidence_threshold = 0.5
     
+    def _confidence_from_distances(self, face_distances):
+        """
+        Vectorized sigmoid mapping from face distance to a 0-100 confidence.
+
+        Args:
+            face_distances: Array of face distances of any shape
+
+        Returns:
+            Array of confidence scores with the same shape
+        """
+        face_distances = np.asarray(face_distances, dtype=np.float64)
+        # Sigmoid function: 1/(1+e^(scale*(x-midpoint)))
+        # Scale = 15 controls steepness, midpoint = 0.5 centers the curve
+        confidence = 100 / (1 + np.exp(15 * (face_distances - 0.5)))
+        # Very poor matches get no confidence at all
+        return np.where(face_distances >= 0.9, 0.0, confidence)
+
     def _calculate_confidence_ensemble(self, unknown_encoding):
         """Calculate confidence based on face distance and mathematical scaling."""
-        if not self.known_face_encodings:
+        if len(self.gallery) == 0:
             return []
-        
-        # Calculate face distances
-        face_distances = face_recognition.face_distance(self.known_face_encodings, unknown_encoding)
-        
-        # Convert distances to confidence scores using a sigmoid function
-      
-        confidence_scores = []
-        for distance in face_distances:
-            # Standard sigmoid function scaling for more realistic distribution
-            if distance >= 0.9:  # Very poor match
-                confidence = 0
-            else:
-                # Sigmoid function: 1/(1+e^(scale*(x-midpoint)))
-                # Scale = 15 controls steepness, midpoint = 0.5 centers the curve
-                confidence = 100 * (1 / (1 + np.exp(15 * (distance - 0.5))))
-            
-            confidence_scores.append(confidence)
-        
-        return confidence_scores
-    
-    def calculate_confidence_for_face(self, frame, face_location):
+
+        face_distances = self.face_distance_matrix([unknown_encoding])[0]
+        return self._confidence_from_distances(face_distances).tolist()
+
+    def _size_factors(self, frame, face_locations):
+        """Down-weight confidence for small (distant) faces, one factor per location."""
+        if not face_locations:
+            return np.empty(0)
+
+        # mathematical proportion
+        boxes = np.asarray(face_locations, dtype=np.float64).reshape(-1, 4)
+        face_width = boxes[:, 1] - boxes[:, 3]
+        face_height = boxes[:, 2] - boxes[:, 0]
+
+        # Calculate relative face size percentage of frame
+        frame_height, frame_width = frame.shape[:2]
+        face_area_ratio = (face_width * face_height) / (frame_width * frame_height)
+
+        # logarithmic scaling for distance estimation (faces >15% of frame get 1.0)
+        # Log scale gives  returns as you get farther
+        scaled = np.log(np.maximum(face_area_ratio + 0.01, 1e-12)) / np.log(0.15)
+        return np.where(face_area_ratio > 0.15, 1.0, np.clip(scaled, 0.5, 1.0))
+
+    def _confidence_level(self, confidence):
+        """Map a 0-100 confidence to its HIGH/MEDIUM/LOW level."""
+        if confidence >= self.high_confidence_threshold * 100:
+            return "HIGH"
+        elif confidence >= self.medium_confidence_threshold * 100:
+            return "MEDIUM"
+        return "LOW"
+
+    def build_result(self, frame, face_locations, face_encodings):
+        """Match faces once and attach confidence scores derived from the same distances."""
+        result = super().build_result(frame, face_locations, face_encodings)
+
+        if len(result) == 0:
+            return result
+        if not np.isfinite(result.best_distances).any():
+            # Nothing to match against (empty gallery)
+            result.confidence_scores = [0.0] * len(result)
+            result.confidence_levels = ["LOW"] * len(result)
+            return result
+
+        with metrics.timer("confidence"):
+            confidences = self._confidence_from_distances(result.best_distances)
+            confidences = confidences * self._size_factors(frame, result.face_locations)
+
+            result.confidence_scores = confidences.tolist()
+            result.confidence_levels = [self._confidence_level(c) for c in result.confidence_scores]
+        return result
+
+    def calculate_confidence_for_face(self, frame, face_location, face_encoding=None):
         """
         Calculate confidence score for a single face.
         
         Args:
             frame: Video frame containing the face
             face_location: (top, right, bottom, left) tuple for the face
+            face_encoding: Optional precomputed encoding; computed from the frame if omitted
             
         Returns:
             Tuple of (confidence_score, confidence_level)
         """
         try:
-            # Convert to RGB for face_recognition library
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            # Extract face encoding
-            encoding_list = face_recognition.face_encodings(rgb_frame, [face_location], num_jitters=0)
-            
-            if not encoding_list or not self.known_face_encodings:
-                return 0.0, "LOW"
-                
-            face_encoding = encoding_list[0]
-            
-            # Calculate confidence based on face encoding
-            confidence_values = self._calculate_confidence_ensemble(face_encoding)
-            
-            if not confidence_values:
+            if face_encoding is None:
+                # Convert to RGB for face_recognition library
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                encoding_list = load_face_models().face_encodings(rgb_frame, [face_location], num_jitters=0)
+                if not encoding_list:
+                    return 0.0, "LOW"
+                face_encoding = encoding_list[0]
+
+            if len(self.gallery) == 0:
                 return 0.0, "LOW"
-                
-            # Find best match
-            best_match_index = np.argmax(confidence_values)
-            base_confidence = confidence_values[best_match_index]
-            
-            # mathematical proportion
-            top, right, bottom, left = face_location
-            face_width = right - left
-            face_height = bottom - top
-            
-            # Calculate relative face size percentage of frame
-            frame_height, frame_width = frame.shape[:2]
-            face_area_ratio = (face_width * face_height) / (frame_width * frame_height)
-            
-            # logarithmic scaling for distance estimation
-            if face_area_ratio > 0.15:  # Very close to camera
-                size_factor = 1.0
-            else:
-                # Log scale gives  returns as you get farther
-                size_factor = max(0.5, min(1.0, np.log(face_area_ratio + 0.01) / np.log(0.15)))
-            
-            # Apply size factor to confidence
-            confidence = base_confidence * size_factor
-            
-            # Determine confidence level
-            if confidence >= self.high_confidence_threshold * 100:
-                level = "HIGH"
-            elif confidence >= self.medium_confidence_threshold * 100:
-                level = "MEDIUM"
-            else:
-                level = "LOW"
-                
-            return confidence, level
+
+            result = self.build_result(frame, [face_location], [face_encoding])
+            return result.confidence_scores[0], result.confidence_levels[0]
             
         except Exception as e:
             logger.error(f"Error calculating confidence: {e}")
@@ -122,6 +135,9 @@ class ConfidenceRecognition(FacialRecognition):
     def get_confidence_scores(self, frame, face_locations):
         """
         Get confidence scores for all faces in the frame.
+
+        Reuses the encodings of the last analyzed frame when the locations match,
+        otherwise encodes all faces in a single batch.
         
         Args:
             frame: Video frame containing faces
@@ -130,34 +146,32 @@ class ConfidenceRecognition(FacialRecognition):
         Returns:
             List of confidence scores
         """
-        confidence_scores = []
-        
-        for face_location in face_locations:
-            score, _ = self.calculate_confidence_for_face(frame, face_location)
-            confidence_scores.append(score)
-            
-        return confidence_scores
+        face_locations = list(face_locations)
+        if self.last_result is not None and self.last_result.face_locations == face_locations:
+            return list(self.last_result.confidence_scores)
+
+        try:
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            face_encodings = load_face_models().face_encodings(rgb_frame, face_locations, num_jitters=0)
+            return list(self.build_result(frame, face_locations, face_encodings).confidence_scores)
+        except Exception as e:
+            logger.error(f"Error calculating confidence: {e}")
+            return [0.0] * len(face_locations)
     
     def recognize_faces(self, frame):
         """
-         parent method to add confidence calculation.
+        Detect, encode and match each face once, with confidences from the same pass.
         
         Returns:
             face_locations: List of face locations
             face_names: List of names
         """
-        # Get face locations and encodings using parent method first
-        face_locations, face_names = super().recognize_faces(frame)
-        
-        # Calculate the confidence scores for each face 
-       
-        self.current_confidence_scores = self.get_confidence_scores(frame, face_locations)
-        
-     
-        return face_locations, face_names
+        result = self.analyze_frame(frame)
+        self.current_confidence_scores = result.confidence_scores
+        return result.face_locations, result.face_names
     
     def get_last_confidence_scores(self):
         """Get the most recently calculated confidence scores."""
         if hasattr(self, 'current_confidence_scores'):
             return self.current_confidence_scores
-        return []
\ No newline at end of file
+        return []
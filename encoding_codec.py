@@ -0,0 +1,56 @@
+# encoding_codec.py
+
+import numpy as np
+from bson.binary import Binary
+
+# Little-endian float32, 128 values -> 512 bytes per face
+ENCODING_DTYPE = np.dtype("<f4")
+ENCODING_DIMENSION = 128
+
+# Only the fields needed to build the gallery
+GALLERY_PROJECTION = {"_id": 1, "name": 1, "encoding": 1}
+LOAD_BATCH_SIZE = 2000
+
+
+def encoding_to_binary(encoding):
+    """Pack a face encoding as a compact BSON Binary float32 blob."""
+    return Binary(np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes())
+
+
+def encoding_from_document(doc):
+    """
+    Read the encoding of a `known_faces` document as float32.
+
+    Handles both the compact Binary format and the legacy list of doubles.
+    """
+    encoding = doc["encoding"]
+    if isinstance(encoding, (bytes, bytearray)):
+        return np.frombuffer(encoding, dtype=ENCODING_DTYPE)
+    return np.asarray(encoding, dtype=np.float32)
+
+
+def load_gallery_arrays(cursor, expected_count=0):
+    """
+    Stream a cursor of gallery documents straight into one float32 matrix.
+
+    Args:
+        cursor: Iterable of documents with `_id`, `name` and `encoding`
+        expected_count: Size hint used to preallocate the matrix
+
+    Returns:
+        (encodings, names, ids) with encodings shaped (N, 128)
+    """
+    encodings = np.empty((max(expected_count, 16), ENCODING_DIMENSION), dtype=np.float32)
+    names = []
+    ids = []
+
+    for row, doc in enumerate(cursor):
+        if row == len(encodings):
+            grown = np.empty((2 * len(encodings), ENCODING_DIMENSION), dtype=np.float32)
+            grown[:row] = encodings[:row]
+            encodings = grown
+        encodings[row] = encoding_from_document(doc)
+        names.append(doc["name"])
+        ids.append(doc["_id"])
+
+    return encodings[:len(ids)], names, ids
@@ -0,0 +1,223 @@
+# encoding_engine.py
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from facial_recognition import load_face_models
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Worker-side cache of attached shared-memory segments, by name
+_worker_segments = {}
+_WORKER_SEGMENT_CACHE = 8
+
+
+def _init_worker():
+    # Load the dlib models once per worker, before the first task arrives
+    load_face_models()
+
+
+def _ping(_):
+    return os.getpid()
+
+
+def _attach(name):
+    segment = _worker_segments.get(name)
+    if segment is None:
+        if len(_worker_segments) >= _WORKER_SEGMENT_CACHE:
+            stale_name = next(iter(_worker_segments))
+            _worker_segments.pop(stale_name).close()
+        segment = _worker_segments[name] = shared_memory.SharedMemory(name=name)
+    return segment
+
+
+def _encode_crops(task):
+    """Worker: encode a group of face crops read straight out of shared memory."""
+    segment_name, crops = task
+    segment = _attach(segment_name)
+    face_recognition = load_face_models()
+    encodings = []
+    for offset, shape, box in crops:
+        crop = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf, offset=offset)
+        encodings.append(face_recognition.face_encodings(crop, [box])[0])
+    return encodings
+
+
+def crop_face(rgb_frame, box, margin=0.5):
+    """
+    Cut a face out of a frame with `margin` (fraction of the box size) on every side.
+
+    The landmark model only looks at the box and its immediate surroundings, so
+    encoding the crop gives the same result as encoding the full frame.
+
+    Returns:
+        (crop view, box in crop coordinates)
+    """
+    top, right, bottom, left = (int(v) for v in box)
+    height, width = rgb_frame.shape[:2]
+    pad = int(margin * max(bottom - top, right - left))
+    crop_top, crop_left = max(0, top - pad), max(0, left - pad)
+    crop_bottom, crop_right = min(height, bottom + pad), min(width, right + pad)
+    crop = rgb_frame[crop_top:crop_bottom, crop_left:crop_right]
+    return crop, (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+
+
+class EncodingEngine:
+    """
+    Encodes the faces of crowded frames on a pool of worker processes.
+
+    Only face crops (with a margin) are sent, and they travel through a
+    shared-memory segment, so each task pickles a few offsets instead of an
+    image. Faces are split into at most one group per worker (the group size
+    adapts to the face count), so a frame with 10 faces on 4 cores costs
+    about 3 sequential encodings. Frames with `inline_max_faces` faces or fewer
+    are encoded in-process, where IPC would cost more than it saves; so is
+    everything until the workers have loaded their models.
+
+    A batch that misses `timeout` is encoded in-process instead. Its segment is
+    retired (the stale tasks may still be reading it) and unlinked once they
+    finish; until then new frames are encoded in-process rather than queued
+    behind them, and if they never finish the pool is restarted.
+
+    Plug it in with FacialRecognition.use_encoding_engine().
+    """
+
+    def __init__(self, processes=None, inline_max_faces=2, crop_margin=0.5, timeout=10.0):
+        self.processes = processes or max(1, (os.cpu_count() or 1) - 1)
+        self.inline_max_faces = inline_max_faces
+        self.crop_margin = crop_margin
+        self.timeout = timeout
+
+        self._pool = None
+        self._warmup = None
+        self._local = threading.local()
+        self._segments = []
+        # (segment, stale AsyncResult, retired at) for batches that timed out
+        self._retired = []
+        self._segments_lock = threading.Lock()
+
+    def start(self):
+        """Start the workers; they load the models in the background."""
+        if self._pool is None:
+            self._pool = multiprocessing.get_context("spawn").Pool(self.processes, _init_worker)
+            self._warmup = self._pool.map_async(_ping, range(self.processes), chunksize=1)
+        return self
+
+    @property
+    def ready(self):
+        return self._warmup is not None and self._warmup.ready()
+
+    def wait_ready(self, timeout=None):
+        """Block until every worker has loaded its models; True if they have."""
+        if self._warmup is None:
+            return False
+        self._warmup.wait(timeout)
+        return self._warmup.ready()
+
+    def _unlink(self, segment):
+        # Caller holds _segments_lock
+        self._segments.remove(segment)
+        segment.close()
+        segment.unlink()
+
+    def _retire(self, segment, stale):
+        """Stop using a segment whose tasks timed out; it is unlinked once they are done."""
+        self._local.segment = None
+        with self._segments_lock:
+            self._retired.append((segment, stale, time.monotonic()))
+
+    def _stalled(self):
+        """
+        True while timed-out tasks still occupy the workers.
+
+        Unlinks the segments of stale batches that have finished, and restarts
+        the pool if one has been stuck for three timeouts.
+        """
+        with self._segments_lock:
+            if not self._retired:
+                return False
+            still_running = []
+            for segment, stale, retired_at in self._retired:
+                if stale.ready():
+                    self._unlink(segment)
+                else:
+                    still_running.append((segment, stale, retired_at))
+            self._retired = still_running
+            if not still_running:
+                return False
+            if time.monotonic() - still_running[0][2] < 3 * self.timeout:
+                return True
+
+            logger.warning("Encoding workers are stuck; restarting the pool")
+            self._pool.terminate()
+            self._pool.join()
+            for segment, _, _ in still_running:
+                self._unlink(segment)
+            self._retired = []
+            self._pool = None
+            self.start()
+        return True
+
+    def _segment(self, size):
+        """This thread's shared-memory segment, grown to at least `size` bytes."""
+        segment = getattr(self._local, "segment", None)
+        if segment is None or segment.size < size:
+            new_segment = shared_memory.SharedMemory(create=True, size=max(size, 2 ** 20))
+            with self._segments_lock:
+                if segment is not None:
+                    self._unlink(segment)
+                self._segments.append(new_segment)
+            segment = self._local.segment = new_segment
+        return segment
+
+    def encode(self, rgb_frame, face_locations):
+        """128-d encodings for the given boxes of an RGB frame, in order (same contract as encode_faces)."""
+        face_locations = list(face_locations)
+        if not face_locations:
+            return []
+        if len(face_locations) <= self.inline_max_faces or not self.ready or self._stalled():
+            return load_face_models().face_encodings(rgb_frame, face_locations)
+
+        with metrics.timer("encoding_ipc"):
+            crops = [crop_face(rgb_frame, box, self.crop_margin) for box in face_locations]
+            segment = self._segment(sum(crop.nbytes for crop, _ in crops))
+
+            placed = []
+            offset = 0
+            for crop, box in crops:
+                np.ndarray(crop.shape, dtype=np.uint8, buffer=segment.buf, offset=offset)[...] = crop
+                placed.append((offset, crop.shape, box))
+                offset += crop.nbytes
+
+            # One group per worker at most; fewer, larger groups when there are only a few faces
+            group_size = -(-len(placed) // self.processes)
+            tasks = [(segment.name, placed[i:i + group_size]) for i in range(0, len(placed), group_size)]
+        metrics.observe("encoding_group_size", group_size)
+
+        pending = self._pool.map_async(_encode_crops, tasks, chunksize=1)
+        try:
+            groups = pending.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            logger.warning("Encoding workers did not answer within %.1fs; encoding in-process", self.timeout)
+            metrics.increment("encoding_pool_timeouts")
+            self._retire(segment, pending)
+            return load_face_models().face_encodings(rgb_frame, face_locations)
+        return [encoding for group in groups for encoding in group]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        with self._segments_lock:
+            for segment in self._segments:
+                segment.close()
+                segment.unlink()
+            self._segments = []
+            self._retired = []
+        self._local = threading.local()
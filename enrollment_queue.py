@@ -0,0 +1,264 @@
+# enrollment_queue.py
+
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+import cv2
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from encoding_codec import encoding_to_binary
+
+logger = logging.getLogger(__name__)
+
+
+class EnrollmentJob:
+    """
+    One "Capture Image" request and its outcome.
+
+    status is "pending" until the worker finishes, then one of:
+    "saved" (in MongoDB), "buffered" (recognizable locally, waiting in the
+    write-behind backlog for MongoDB), "no_face" or "failed".
+    """
+
+    def __init__(self, name, frame, encoding=None, image_dir="images"):
+        # Also the MongoDB _id, so retried inserts are idempotent. A document that
+        # goes through the backlog gets a fresh _id when it is finally written.
+        self.doc_id = ObjectId()
+        self.name = name
+        self.frame = frame
+        self.encoding = encoding
+        # True when the caller supplied the encoding computed for the live frame
+        self.reused_encoding = encoding is not None
+        self.image_path = os.path.join(image_dir, f"{name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg")
+        self.status = "pending"
+        self.error = None
+        self.submitted = time.monotonic()
+        self.finished = None
+
+
+class EnrollmentQueue:
+    """
+    Background worker that turns enrollment requests into gallery entries and MongoDB documents.
+
+    submit() returns immediately. The worker encodes the frame (unless the caller
+    passed an encoding it already had), writes the JPEG, adds the face to the
+    in-memory gallery so it is recognized right away, and inserts the document
+    with a few quick retries. If MongoDB is unreachable the document goes to an
+    append-only backlog file that is replayed every `replay_interval` seconds
+    (and on the next start), so enrollments are never lost while offline.
+    Replayed documents get a fresh ObjectId at insert time, so other nodes'
+    watermark polls still see them after a long outage; the original id is kept
+    in `enrollment_id` to make replays idempotent.
+
+    Finished jobs are collected with completed(), which the UI polls from its
+    own thread.
+    """
+
+    def __init__(self, collection, sync, recognition, image_dir="images",
+                 backlog_path="enrollment_backlog.ndjson", retries=3, retry_delay=0.5, replay_interval=30.0):
+        self.collection = collection
+        self.sync = sync
+        self.recognition = recognition
+        self.image_dir = image_dir
+        self.backlog_path = backlog_path
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.replay_interval = replay_interval
+
+        self._jobs = queue.Queue()
+        self._completed = collections.deque()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # While MongoDB is known to be down, new documents go straight to the backlog
+        self._offline_until = 0.0
+
+    def submit(self, name, frame, encoding=None):
+        """Queue an enrollment; returns the EnrollmentJob to watch."""
+        job = EnrollmentJob(name, frame, encoding, self.image_dir)
+        self._jobs.put(job)
+        return job
+
+    def completed(self):
+        """Jobs finished since the last call (safe to call from the UI thread)."""
+        jobs = []
+        while self._completed:
+            jobs.append(self._completed.popleft())
+        return jobs
+
+    def pending(self):
+        return self._jobs.qsize()
+
+    def _insert(self, doc):
+        """Insert with quick retries; False once MongoDB looks unreachable."""
+        if time.monotonic() < self._offline_until:
+            return False
+        for attempt in range(self.retries):
+            try:
+                self.collection.insert_one(doc)
+                return True
+            except DuplicateKeyError:
+                # An earlier attempt reached the server after all
+                return True
+            except PyMongoError as e:
+                logger.warning(f"Enrollment insert failed (attempt {attempt + 1}/{self.retries}): {e}")
+                if attempt + 1 < self.retries:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+        self._offline_until = time.monotonic() + self.replay_interval
+        return False
+
+    def _buffer(self, doc, encoding):
+        record = dict(doc, _id=str(doc["_id"]), encoding=np.asarray(encoding, dtype=np.float32).tolist(),
+                      timestamp=doc["timestamp"].isoformat())
+        with open(self.backlog_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_backlog(self):
+        if not os.path.exists(self.backlog_path):
+            return []
+        records = []
+        with open(self.backlog_path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    @staticmethod
+    def _document_from_backlog(record):
+        encoding = np.asarray(record["encoding"], dtype=np.float32)
+        doc = dict(record, _id=ObjectId(record["_id"]), encoding=encoding_to_binary(encoding),
+                   timestamp=datetime.fromisoformat(record["timestamp"]))
+        return doc, encoding
+
+    def load_backlog(self):
+        """Add buffered enrollments from a previous run to the gallery. Returns how many are waiting."""
+        records = self._read_backlog()
+        for record in records:
+            doc, encoding = self._document_from_backlog(record)
+            self.sync.record_local_insert(doc["_id"], encoding, doc["name"], pending=True)
+        return len(records)
+
+    def _already_inserted(self, original_ids):
+        """Backlog ids that reached MongoDB earlier (e.g. before a crash), mapped to their _id there."""
+        query = {"$or": [{"_id": {"$in": original_ids}}, {"enrollment_id": {"$in": original_ids}}]}
+        return {doc.get("enrollment_id", doc["_id"]): doc["_id"]
+                for doc in self.collection.find(query, {"_id": 1, "enrollment_id": 1})}
+
+    def replay_backlog(self):
+        """Try to insert buffered documents; keeps whatever still fails. Returns the number inserted."""
+        records = self._read_backlog()
+        if not records:
+            return 0
+
+        self._offline_until = 0.0
+        existing = self._already_inserted([ObjectId(record["_id"]) for record in records])
+        remaining = []
+        for record in records:
+            if remaining:
+                # MongoDB went away again; keep the rest in order
+                remaining.append(record)
+                continue
+            doc, encoding = self._document_from_backlog(record)
+            original_id = doc["_id"]
+            doc_id = existing.get(original_id)
+            if doc_id is None:
+                # A fresh id sorts after other nodes' watermarks, so their polls pick it up
+                doc["_id"] = doc_id = ObjectId()
+                doc["enrollment_id"] = original_id
+                if not self._insert(doc):
+                    remaining.append(record)
+                    continue
+            self.sync.rekey_local_insert(original_id, doc_id, encoding, doc["name"])
+
+        tmp_path = f"{self.backlog_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in remaining))
+        os.replace(tmp_path, self.backlog_path)
+
+        inserted = len(records) - len(remaining)
+        if inserted:
+            logger.info(f"Wrote {inserted} buffered enrollments to MongoDB, {len(remaining)} still waiting.")
+        return inserted
+
+    def _process(self, job):
+        encoding = job.encoding
+        if encoding is None:
+            encoding = self.recognition.get_face_encoding_from_image(job.frame)
+            if encoding is None:
+                job.status = "no_face"
+                return
+
+        os.makedirs(os.path.dirname(job.image_path) or ".", exist_ok=True)
+        if not cv2.imwrite(job.image_path, job.frame):
+            job.status = "failed"
+            job.error = f"could not write {job.image_path}"
+            return
+
+        # Recognizable immediately, whatever happens with MongoDB
+        self.sync.record_local_insert(job.doc_id, encoding, job.name)
+
+        doc = {
+            "_id": job.doc_id,
+            "name": job.name,
+            "encoding": encoding_to_binary(encoding),
+            "image_path": job.image_path,
+            "timestamp": datetime.utcnow(),
+        }
+        if self._insert(doc):
+            job.status = "saved"
+        else:
+            self.sync.mark_pending(job.doc_id)
+            self._buffer(doc, encoding)
+            job.status = "buffered"
+
+    def _run(self):
+        # Replay anything left over from an earlier run straight away
+        last_replay = 0.0
+        while True:
+            try:
+                job = self._jobs.get(timeout=1.0)
+            except queue.Empty:
+                job = None
+
+            if job is not None:
+                try:
+                    self._process(job)
+                except Exception as e:
+                    job.status = "failed"
+                    job.error = str(e)
+                    logger.error(f"Enrollment of {job.name} failed: {e}")
+                job.frame = None
+                job.finished = time.monotonic()
+                self._completed.append(job)
+            elif self._stop_event.is_set():
+                break
+
+            if time.monotonic() - last_replay >= self.replay_interval:
+                try:
+                    self.replay_backlog()
+                except (OSError, PyMongoError) as e:
+                    logger.warning(f"Replaying the enrollment backlog failed: {e}")
+                last_replay = time.monotonic()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="enrollment", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Finish queued jobs (up to `timeout` seconds) and stop the worker."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
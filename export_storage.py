@@ -3,10 +3,21 @@ import csv
 import os
 import datetime
 
+SIGHTING_FIELDS = ["timestamp", "name", "confidence", "level", "camera", "track_id"]
+
+
 class ExportStorage:
-    def __init__(self, recognition_instance, choice):
+    """
+    Export sightings to txt/csv/json.
+
+    `records` is any iterable of sighting dicts (SightingLog.iter_records() or
+    sighting_log.iter_collection()); it is consumed one record at a time and
+    written straight to disk, so exports never hold the whole log in memory.
+    """
+
+    def __init__(self, records, choice):
         self.choice = choice
-        self.names = recognition_instance.known_face_names
+        self.records = records
         self.export_dir = "exported_data"
 
         # Ensure the export directory exists
@@ -14,23 +25,39 @@ class ExportStorage:
 
     def _generate_filename(self, extension):
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        return os.path.join(self.export_dir, f"names_{timestamp}.{extension}")
+        return os.path.join(self.export_dir, f"sightings_{timestamp}.{extension}")
+
+    def export(self, filename=None):
+        """Export in the format chosen at construction; returns the path or None for an unknown format."""
+        exporters = {"txt": self.export_to_txt, "csv": self.export_to_csv, "json": self.export_to_json}
+        if self.choice not in exporters:
+            return None
+        return exporters[self.choice](filename)
 
     def export_to_txt(self, filename=None):
         path = filename or self._generate_filename("txt")
         with open(path, 'w') as f:
-            for name in self.names:
-                f.write(str(name) + '\n')
+            for record in self.records:
+                f.write(f"{record.get('timestamp')}  {record.get('name')}  "
+                        f"{record.get('confidence')}% ({record.get('level')})  {record.get('camera')}\n")
+        return path
 
     def export_to_csv(self, filename=None):
         path = filename or self._generate_filename("csv")
         with open(path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            #writer.writerow(["Name"])
-            for name in self.names:
-                writer.writerow([name])
+            writer = csv.DictWriter(f, fieldnames=SIGHTING_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for record in self.records:
+                writer.writerow(record)
+        return path
 
     def export_to_json(self, filename=None):
         path = filename or self._generate_filename("json")
         with open(path, 'w') as f:
-            json.dump(self.names, f, indent=4)
+            # Written element by element so the array never has to exist in memory
+            f.write("[")
+            for i, record in enumerate(self.records):
+                f.write(",\n    " if i else "\n    ")
+                f.write(json.dumps(record, default=str))
+            f.write("\n]\n")
+        return path
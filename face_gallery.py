@@ -0,0 +1,336 @@
+# face_gallery.py
+
+import threading
+import time
+import numpy as np
+
+
+class FaceGallery:
+    """
+    All known face encodings in one contiguous, growable (N, 128) float32 matrix.
+
+    Squared norms are kept alongside the matrix so a whole frame of faces can be
+    matched with a single matrix product:
+        |q - g|^2 = |q|^2 + |g|^2 - 2 q.g
+    Names and ids are stored in parallel arrays indexed by gallery row.
+
+    An optional approximate index (see ann_index.IVFIndex) can be attached with
+    set_index(); match() then searches it instead of scanning every row.
+
+    All mutating and searching methods take `lock`, so a background sync thread
+    can add, rename or remove faces while frames are being matched. Index
+    training (k-means) runs in a background thread on a copy of the matrix,
+    outside the lock; until it finishes, match() keeps using the previous index
+    or the exact scan.
+    """
+
+    def __init__(self, dimension=128, capacity=1024):
+        self.dimension = dimension
+        self._size = 0
+        self._encodings = np.zeros((capacity, dimension), dtype=np.float32)
+        self._sq_norms = np.zeros(capacity, dtype=np.float32)
+        self._names = np.empty(capacity, dtype=object)
+        self._ids = np.empty(capacity, dtype=object)
+        self._rows_by_id = {}
+        self.index = None
+        self.lock = threading.RLock()
+        self._training = None
+        # Bumped whenever the index is swapped or reset, so a stale training result is dropped
+        self._index_epoch = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._encodings)
+
+    @property
+    def encodings(self):
+        """View of the live (N, 128) float32 encoding matrix."""
+        return self._encodings[:self._size]
+
+    @property
+    def names(self):
+        with self.lock:
+            return list(self._names[:self._size])
+
+    @property
+    def ids(self):
+        with self.lock:
+            return list(self._ids[:self._size])
+
+    @property
+    def uses_index(self):
+        """True when match() is served by a trained approximate index."""
+        return self.index is not None and self.index.trained
+
+    def set_index(self, index):
+        """Attach (or detach with None) an approximate index and train it if the gallery is big enough."""
+        with self.lock:
+            self.index = index
+            self._index_epoch += 1
+            if index is not None:
+                index.reset()
+                self._maybe_train_index()
+
+    def _maybe_train_index(self):
+        """Start background training if the index needs it (caller holds the lock)."""
+        if self.index is None or self._training is not None or not self.index.needs_training(self._size):
+            return
+        self._training = threading.Thread(target=self._train_index,
+                                          args=(self.index, self._index_epoch, self.encodings.copy()),
+                                          name="index-training", daemon=True)
+        self._training.start()
+
+    def _train_index(self, index, epoch, encodings):
+        model = None
+        try:
+            model = index.fit(encodings)
+        finally:
+            with self.lock:
+                self._training = None
+                if model is not None:
+                    # Rows may have been added, moved or removed meanwhile; install() indexes the current ones
+                    if self.index is index and self._index_epoch == epoch:
+                        index.install(model, self.encodings)
+                    # The gallery may have outgrown this training already (a failed fit is not retried)
+                    self._maybe_train_index()
+
+    def wait_for_index(self, timeout=None):
+        """Block until background index training has finished; True if nothing is training."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                training = self._training
+            if training is None:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            training.join(remaining)
+
+    def names_at(self, indices):
+        """Names for the given row indices without copying the whole name array."""
+        with self.lock:
+            return list(self._names[np.asarray(indices, dtype=np.intp)])
+
+    def ids_at(self, indices):
+        """Ids for the given row indices without copying the whole id array."""
+        with self.lock:
+            return list(self._ids[np.asarray(indices, dtype=np.intp)])
+
+    def __contains__(self, face_id):
+        return face_id in self._rows_by_id
+
+    def row_of(self, face_id):
+        """Gallery row holding `face_id`, or None."""
+        return self._rows_by_id.get(face_id)
+
+    @property
+    def sq_norms(self):
+        return self._sq_norms[:self._size]
+
+    def adopt(self, encodings, sq_norms, names, ids):
+        """
+        Take over existing arrays (e.g. a read-only np.memmap snapshot) without copying.
+
+        The encoding matrix is only copied into private memory on the first write,
+        so several processes can map the same snapshot and share its pages.
+        """
+        with self.lock:
+            self.clear()
+            self._encodings = encodings
+            self._sq_norms = sq_norms
+            self._names = np.empty(len(names), dtype=object)
+            self._names[:] = list(names)
+            self._ids = np.empty(len(ids), dtype=object)
+            self._ids[:] = list(ids)
+            self._size = len(encodings)
+            self._rows_by_id = {face_id: row for row, face_id in enumerate(ids) if face_id is not None}
+            self._maybe_train_index()
+
+    def _reserve(self, capacity):
+        """Grow the preallocated buffers geometrically to hold at least `capacity` rows."""
+        if capacity <= self.capacity and self._encodings.flags.writeable:
+            return
+
+        new_capacity = max(capacity, 2 * self.capacity, 16) if capacity > self.capacity else self.capacity
+        encodings = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        sq_norms = np.zeros(new_capacity, dtype=np.float32)
+        names = np.empty(new_capacity, dtype=object)
+        ids = np.empty(new_capacity, dtype=object)
+
+        encodings[:self._size] = self._encodings[:self._size]
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        names[:self._size] = self._names[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+
+        self._encodings, self._sq_norms, self._names, self._ids = encodings, sq_norms, names, ids
+
+    def add(self, encoding, name, face_id=None):
+        """Append one encoding and return its row index."""
+        return self.add_many([encoding], [name], [face_id])[0]
+
+    def add_many(self, encodings, names, ids=None):
+        """Append a batch of encodings and return their row indices."""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        count = len(encodings)
+        if len(names) != count:
+            raise ValueError("encodings and names must have the same length")
+        if ids is None:
+            ids = [None] * count
+
+        with self.lock:
+            start = self._size
+            self._reserve(start + count)
+            end = start + count
+
+            self._encodings[start:end] = encodings
+            self._sq_norms[start:end] = np.einsum("ij,ij->i", encodings, encodings)
+            self._names[start:end] = list(names)
+            self._ids[start:end] = list(ids)
+            self._size = end
+            for row, face_id in enumerate(ids, start):
+                if face_id is not None:
+                    self._rows_by_id[face_id] = row
+
+            if self.index is not None:
+                self.index.add(encodings, np.arange(start, end))
+                self._maybe_train_index()
+
+            return list(range(start, end))
+
+    def replace(self, encodings, names, ids=None):
+        """Replace the whole gallery contents."""
+        with self.lock:
+            self.clear()
+            if len(names):
+                self.add_many(encodings, names, ids)
+
+    def clear(self):
+        with self.lock:
+            self._names[:self._size] = None
+            self._ids[:self._size] = None
+            self._rows_by_id = {}
+            self._size = 0
+            if self.index is not None:
+                self._index_epoch += 1
+                self.index.reset()
+
+    def rename(self, face_id, name):
+        """Change the name attached to `face_id`. Returns False if the id is unknown."""
+        with self.lock:
+            row = self._rows_by_id.get(face_id)
+            if row is None:
+                return False
+            self._names[row] = name
+            return True
+
+    def remove(self, face_id):
+        """
+        Delete `face_id` from the gallery, keeping the matrix contiguous.
+
+        The last row is moved into the freed slot, so row indices of other faces
+        may change; look them up again with row_of() if they were cached.
+        """
+        with self.lock:
+            row = self._rows_by_id.pop(face_id, None)
+            if row is None:
+                return False
+
+            last = self._size - 1
+            # Copy-on-write for read-only (memory-mapped) matrices
+            self._reserve(self._size)
+            if self.index is not None:
+                self.index.remove_rows([row])
+            if row != last:
+                self._encodings[row] = self._encodings[last]
+                self._sq_norms[row] = self._sq_norms[last]
+                self._names[row] = self._names[last]
+                self._ids[row] = self._ids[last]
+                if self._ids[row] is not None:
+                    self._rows_by_id[self._ids[row]] = row
+                if self.index is not None:
+                    self.index.move_row(last, row)
+
+            self._names[last] = None
+            self._ids[last] = None
+            self._size = last
+            return True
+
+    def upsert(self, face_id, encoding, name):
+        """Insert `face_id`, or replace its encoding and name if it is already present."""
+        with self.lock:
+            self.remove(face_id)
+            return self.add(encoding, name, face_id)
+
+    def distances(self, face_encodings):
+        """
+        Euclidean distance from each query to every gallery row in one matrix operation.
+
+        Args:
+            face_encodings: (F, 128) array-like of query encodings
+
+        Returns:
+            (F, N) float32 distance matrix
+        """
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.dimension)
+        with self.lock:
+            if self._size == 0 or len(queries) == 0:
+                return np.empty((len(queries), self._size), dtype=np.float32)
+
+            query_sq_norms = np.einsum("ij,ij->i", queries, queries)
+            sq_distances = queries @ self.encodings.T
+            sq_distances *= -2
+            sq_distances += query_sq_norms[:, None]
+            sq_distances += self._sq_norms[None, :self._size]
+        np.maximum(sq_distances, 0, out=sq_distances)
+        return np.sqrt(sq_distances, out=sq_distances)
+
+    @staticmethod
+    def select_top_k(distances, k=1):
+        """
+        Pick the k smallest distances of every row, sorted ascending.
+
+        Returns:
+            (indices, distances) arrays of shape (F, min(k, N))
+        """
+        distances = np.asarray(distances)
+        k = min(k, distances.shape[1])
+        if k == 0:
+            empty = np.empty((distances.shape[0], 0))
+            return empty.astype(np.intp), empty.astype(distances.dtype)
+
+        if k < distances.shape[1]:
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+        candidate_distances = np.take_along_axis(distances, candidates, axis=1)
+        order = np.argsort(candidate_distances, axis=1)
+        return (np.take_along_axis(candidates, order, axis=1),
+                np.take_along_axis(candidate_distances, order, axis=1))
+
+    def match(self, face_encodings, k=1):
+        """Top-k gallery rows and distances for every query encoding."""
+        with self.lock:
+            if self.uses_index:
+                indices, distances = self.index.search(face_encodings, self.encodings,
+                                                       self._sq_norms[:self._size], k)
+                keep = min(k, self._size)
+                return indices[:, :keep], distances[:, :keep]
+            return self.select_top_k(self.distances(face_encodings), k)
+
+    def top_k(self, face_encodings, k=5):
+        """
+        Top-k candidates for each query as (name, id, distance) tuples.
+
+        Returns:
+            One list of candidates per query encoding, closest first
+        """
+        with self.lock:
+            indices, distances = self.match(face_encodings, k)
+            return [
+                [(self._names[i], self._ids[i], float(d)) for i, d in zip(row_indices, row_distances) if i >= 0]
+                for row_indices, row_distances in zip(indices, distances)
+            ]
@@ -0,0 +1,320 @@
+# face_tracker.py
+
+import logging
+import time
+import cv2
+import numpy as np
+from facial_recognition import RecognitionResult
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def box_iou(box_a, box_b):
+    """Intersection-over-union of two (top, right, bottom, left) boxes."""
+    top = max(box_a[0], box_b[0])
+    right = min(box_a[1], box_b[1])
+    bottom = min(box_a[2], box_b[2])
+    left = max(box_a[3], box_b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    if intersection == 0:
+        return 0.0
+    area_a = (box_a[1] - box_a[3]) * (box_a[2] - box_a[0])
+    area_b = (box_b[1] - box_b[3]) * (box_b[2] - box_b[0])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def box_center(box):
+    top, right, bottom, left = box
+    return (left + right) / 2.0, (top + bottom) / 2.0
+
+
+class Track:
+    """One face followed across frames, with its identity smoothed over time."""
+
+    def __init__(self, track_id, box, frame_index):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.encoding = None
+        self.best_match_index = -1
+        self.best_distance = np.inf
+        self.hits = 1
+        self.misses = 0
+        self.lost = False
+        self.last_encoded = None
+        self.created = frame_index
+        # Exponentially smoothed confidence per candidate name
+        self.name_scores = {}
+        self.recent_names = []
+
+    @property
+    def name(self):
+        if not self.name_scores:
+            return "Unknown"
+        return max(self.name_scores, key=self.name_scores.get)
+
+    @property
+    def confidence(self):
+        return self.name_scores.get(self.name, 0.0)
+
+    def observe(self, name, confidence, encoding, best_match_index, best_distance,
+                frame_index, smoothing, history, forget_below):
+        """
+        Fold a fresh recognition of this face into the smoothed identity.
+
+        Candidate names whose smoothed confidence (0-100) falls below
+        `forget_below` are dropped, except the one just observed.
+        """
+        for known in list(self.name_scores):
+            self.name_scores[known] *= smoothing
+        if not self.name_scores:
+            # A new track takes its first confidence directly
+            self.name_scores[name] = confidence
+        else:
+            # Later names build up like any other, so one outlier frame cannot flip the identity
+            self.name_scores[name] = self.name_scores.get(name, 0.0) + (1 - smoothing) * confidence
+        # Forget candidates that have faded out
+        self.name_scores = {n: c for n, c in self.name_scores.items() if c >= forget_below or n == name}
+
+        self.encoding = encoding
+        self.best_match_index = best_match_index
+        self.best_distance = best_distance
+        self.last_encoded = frame_index
+        self.recent_names = (self.recent_names + [name])[-history:]
+
+    def is_confirmed(self, confirm_hits):
+        """Confirmed once the last `confirm_hits` recognitions agreed on one name."""
+        return len(self.recent_names) >= confirm_hits and len(set(self.recent_names[-confirm_hits:])) == 1
+
+
+class FaceTracker:
+    """
+    Tracking layer around a (Confidence)Recognition instance.
+
+    Full HOG detection runs only every `detect_every` frames, or sooner when a
+    track is lost. In between, boxes are carried forward with Lucas-Kanade
+    optical flow. Detections are linked to existing tracks by IoU (falling back
+    to centroid distance), and dlib encodings are only computed for new or
+    unconfirmed tracks, plus a periodic re-check of confirmed ones. Names and
+    confidences are smoothed per track, which also stops labels flickering.
+
+    Exposes analyze_frame()/recognize_faces() so it can stand in for the
+    recognition object in RecognitionPipeline or the UI.
+    """
+
+    def __init__(self, recognition, detect_every=5, iou_threshold=0.3, max_misses=2,
+                 confirm_hits=3, reencode_every=30, smoothing=0.7, use_optical_flow=True):
+        self.recognition = recognition
+        self.detect_every = detect_every
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.confirm_hits = confirm_hits
+        self.reencode_every = reencode_every
+        self.smoothing = smoothing
+        self.use_optical_flow = use_optical_flow
+        # Same 0-100 scale as the recognizer's confidence scores; below MEDIUM a candidate is forgotten
+        self.forget_below = getattr(recognition, "medium_confidence_threshold", 0.5) * 100
+
+        self.tracks = []
+        self.frame_index = 0
+        self.last_result = None
+        self.current_confidence_scores = []
+        self._next_track_id = 0
+        self._previous_gray = None
+        self.detections_run = 0
+        self.encodings_computed = 0
+
+    @property
+    def gallery(self):
+        return self.recognition.gallery
+
+    def reset(self):
+        self.tracks = []
+        self._previous_gray = None
+
+    def _needs_detection(self):
+        if not self.tracks:
+            return True
+        if any(track.lost for track in self.tracks):
+            return True
+        return self.frame_index % self.detect_every == 0
+
+    def _associate(self, detections):
+        """Greedy IoU matching, then centroid matching for what is left. Returns (pairs, new_boxes)."""
+        pairs = []
+        free_tracks = set(range(len(self.tracks)))
+        free_detections = set(range(len(detections)))
+
+        candidates = []
+        for t, track in enumerate(self.tracks):
+            for d, box in enumerate(detections):
+                iou = box_iou(track.box, box)
+                if iou >= self.iou_threshold:
+                    candidates.append((iou, t, d))
+        for _, t, d in sorted(candidates, reverse=True):
+            if t in free_tracks and d in free_detections:
+                pairs.append((t, d))
+                free_tracks.discard(t)
+                free_detections.discard(d)
+
+        # Fast movers can drop below the IoU threshold; accept a nearby centroid instead
+        candidates = []
+        for t in free_tracks:
+            track = self.tracks[t]
+            tx, ty = box_center(track.box)
+            size = max(track.box[1] - track.box[3], track.box[2] - track.box[0])
+            for d in free_detections:
+                dx, dy = box_center(detections[d])
+                distance = np.hypot(tx - dx, ty - dy)
+                if distance <= 0.5 * size:
+                    candidates.append((distance, t, d))
+        for _, t, d in sorted(candidates):
+            if t in free_tracks and d in free_detections:
+                pairs.append((t, d))
+                free_tracks.discard(t)
+                free_detections.discard(d)
+
+        return pairs, [detections[d] for d in sorted(free_detections)]
+
+    def _propagate(self, gray):
+        """Shift every track box by the median optical flow of points inside it."""
+        if self._previous_gray is None or self._previous_gray.shape != gray.shape:
+            return
+        height, width = gray.shape[:2]
+
+        for track in self.tracks:
+            top, right, bottom, left = track.box
+            mask = np.zeros_like(gray)
+            mask[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = 255
+            points = cv2.goodFeaturesToTrack(self._previous_gray, maxCorners=30, qualityLevel=0.01,
+                                             minDistance=3, mask=mask)
+            if points is None or len(points) < 4:
+                track.lost = True
+                continue
+
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(self._previous_gray, gray, points, None)
+            good = status.reshape(-1) == 1
+            if good.sum() < 4:
+                track.lost = True
+                continue
+
+            shift = np.median((moved - points).reshape(-1, 2)[good], axis=0)
+            dx, dy = int(round(shift[0])), int(round(shift[1]))
+            box = (top + dy, right + dx, bottom + dy, left + dx)
+            if box[2] <= 0 or box[0] >= height or box[1] <= 0 or box[3] >= width:
+                track.lost = True
+                continue
+            track.box = box
+
+    def _encode_tracks(self, frame, rgb_frame, tracks):
+        if not tracks:
+            return
+        locations = [track.box for track in tracks]
+        encodings = self.recognition.encode_faces(rgb_frame, locations)
+        self.encodings_computed += len(encodings)
+        result = self.recognition.build_result(frame, locations, encodings)
+
+        scores = result.confidence_scores or [0.0] * len(result)
+        for i, track in enumerate(tracks):
+            track.observe(result.face_names[i], scores[i], result.face_encodings[i],
+                          int(result.best_match_indices[i]), float(result.best_distances[i]), self.frame_index,
+                          self.smoothing, max(self.confirm_hits, 5), self.forget_below)
+
+    def analyze_frame(self, frame):
+        """Track faces in `frame` and return a RecognitionResult built from the tracks."""
+        self.frame_index += 1
+        gray = None
+        start = time.perf_counter()
+        if self.use_optical_flow:
+            with metrics.timer("optical_flow"):
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                self._propagate(gray)
+
+        if self._needs_detection():
+            detection_start = time.perf_counter()
+            with metrics.timer("color_conversion"):
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            detections = [tuple(int(v) for v in box) for box in self.recognition.detect_faces(rgb_frame)]
+            self.detections_run += 1
+
+            pairs, new_boxes = self._associate(detections)
+            matched = set()
+            for t, d in pairs:
+                track = self.tracks[t]
+                track.box = detections[d]
+                track.hits += 1
+                track.misses = 0
+                track.lost = False
+                matched.add(t)
+
+            survivors = []
+            for t, track in enumerate(self.tracks):
+                if t not in matched:
+                    track.misses += 1
+                    if track.misses > self.max_misses:
+                        continue
+                    # Keep it for a few detections in case the face reappears
+                    track.lost = False
+                survivors.append(track)
+            self.tracks = survivors
+
+            for box in new_boxes:
+                self.tracks.append(Track(self._next_track_id, box, self.frame_index))
+                self._next_track_id += 1
+
+            # Only new, unconfirmed or stale tracks that were actually detected are re-encoded
+            visible = [track for track in self.tracks if track.misses == 0]
+            to_encode = [
+                track for track in visible
+                if track.last_encoded is None
+                or not track.is_confirmed(self.confirm_hits)
+                or self.frame_index - track.last_encoded >= self.reencode_every
+            ]
+            self._encode_tracks(frame, rgb_frame, to_encode)
+            self.recognition.report_frame_latency((time.perf_counter() - detection_start) * 1000)
+            metrics.increment("tracker_detections")
+
+        self._previous_gray = gray
+        result = self._build_result()
+        metrics.record_time("recognition_total", (time.perf_counter() - start) * 1000)
+        metrics.observe("faces_per_frame", len(result))
+        metrics.increment("frames_recognized")
+        metrics.set_gauge("gallery_size", len(self.gallery))
+        metrics.set_gauge("active_tracks", len(self.tracks))
+        return result
+
+    def _build_result(self):
+        visible = [track for track in self.tracks if track.misses == 0 and track.encoding is not None]
+        if visible:
+            encodings = np.stack([track.encoding for track in visible])
+        else:
+            encodings = np.empty((0, 128))
+
+        result = RecognitionResult(
+            [track.box for track in visible],
+            encodings,
+            None,
+            np.array([track.best_match_index for track in visible], dtype=np.intp),
+            np.array([track.best_distance for track in visible], dtype=np.float64),
+            [track.name for track in visible],
+        )
+        result.confidence_scores = [track.confidence for track in visible]
+        result.confidence_levels = [self._confidence_level(score) for score in result.confidence_scores]
+        result.track_ids = [track.track_id for track in visible]
+
+        self.last_result = result
+        self.current_confidence_scores = result.confidence_scores
+        return result
+
+    def _confidence_level(self, score):
+        if hasattr(self.recognition, "_confidence_level"):
+            return self.recognition._confidence_level(score)
+        return "LOW"
+
+    def recognize_faces(self, frame):
+        """Same contract as FacialRecognition.recognize_faces."""
+        result = self.analyze_frame(frame)
+        return result.face_locations, result.face_names
+
+    def get_last_confidence_scores(self):
+        return self.current_confidence_scores
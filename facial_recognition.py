@@ -1,46 +1,300 @@
 # facial_recognition.py
 
-import face_recognition
+import time
 import cv2
 import numpy as np
+from face_gallery import FaceGallery
+from ann_index import IVFIndex
+from metrics import metrics
+
+# face_recognition loads the dlib models on import, which takes seconds; see load_face_models()
+_face_recognition = None
+
+
+def load_face_models():
+    """
+    Import face_recognition (loading the dlib detector and encoder models) on first use.
+
+    Call it from a background thread at startup to keep the window responsive;
+    every detection/encoding call goes through it, so it is safe to skip.
+    """
+    global _face_recognition
+    if _face_recognition is None:
+        import face_recognition
+        _face_recognition = face_recognition
+    return _face_recognition
+
+
+class RecognitionResult:
+    """
+    Everything computed for one frame, so later stages never re-encode a face.
+
+    Attributes:
+        face_locations: List of (top, right, bottom, left) tuples
+        face_encodings: (F, 128) array of encodings, one row per face
+        face_distances: (F, N) distance matrix against the known faces
+            (None when an approximate index served the lookup)
+        best_distances: Distance to the closest known face per row (inf if none)
+        best_match_indices: Row of the closest known face in the local gallery
+            (-1 if none, or when a shared match service served the lookup)
+        face_names: Best-match name per face, "Unknown" above tolerance
+        confidence_scores: Confidence per face (filled by ConfidenceRecognition)
+        confidence_levels: "HIGH"/"MEDIUM"/"LOW" per face
+    """
+
+    def __init__(self, face_locations, face_encodings, face_distances,
+                 best_match_indices, best_distances, face_names):
+        self.face_locations = face_locations
+        self.face_encodings = face_encodings
+        self.face_distances = face_distances
+        self.best_match_indices = best_match_indices
+        self.best_distances = best_distances
+        self.face_names = face_names
+        self.confidence_scores = []
+        self.confidence_levels = []
+
+    def __len__(self):
+        return len(self.face_locations)
+
+
+class AdaptiveDetectionScale:
+    """
+    Picks the downscale factor for HOG detection from measured frame latency.
+
+    HOG cost grows with pixel count, so detection runs on a resized copy. The
+    scale shrinks while smoothed latency is above `target_ms` and grows back when
+    there is headroom. It also grows when nothing was found (faces may just be
+    too small at this resolution) or when the smallest face would fall below
+    `min_face_pixels` after scaling.
+    """
+
+    def __init__(self, target_ms=60.0, min_scale=0.25, max_scale=1.0, step=0.1,
+                 smoothing=0.8, min_face_pixels=60):
+        self.target_ms = target_ms
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.step = step
+        self.smoothing = smoothing
+        self.min_face_pixels = min_face_pixels
+
+        self.scale = max_scale
+        self.latency_ms = None
+        self._faces_found = True
+        self._smallest_face = None
+
+    def observe_detections(self, face_locations):
+        """Record what the last detection found, in full-resolution pixels."""
+        self._faces_found = bool(face_locations)
+        if face_locations:
+            self._smallest_face = min(min(bottom - top, right - left)
+                                      for top, right, bottom, left in face_locations)
+        else:
+            self._smallest_face = None
+
+    def observe_latency(self, elapsed_ms):
+        """Fold one frame's latency in and adjust the scale for the next frame."""
+        if self.latency_ms is None:
+            self.latency_ms = elapsed_ms
+        else:
+            self.latency_ms = self.smoothing * self.latency_ms + (1 - self.smoothing) * elapsed_ms
+
+        scale = self.scale
+        if not self._faces_found:
+            # Nothing found: look harder at a higher resolution
+            scale += self.step
+        elif self._smallest_face and self._smallest_face * scale < self.min_face_pixels:
+            # Small faces would vanish at this scale
+            scale = max(scale + self.step, self.min_face_pixels / self._smallest_face)
+        elif self.latency_ms > self.target_ms:
+            scale -= self.step
+        elif self.latency_ms < 0.7 * self.target_ms:
+            scale += self.step
+
+        self.scale = float(min(self.max_scale, max(self.min_scale, scale)))
+        return self.scale
+
 
 class FacialRecognition:
-    def __init__(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
+    def __init__(self, gallery=None):
+        # Several recognizers (e.g. one per stream) may share one gallery
+        self.gallery = gallery if gallery is not None else FaceGallery()
+        self.tolerance = 0.6
+        self.last_result = None
+        self.detection_scale = None
+        self.match_client = None
+        self.encoding_engine = None
+
+    @property
+    def known_face_encodings(self):
+        """(N, 128) float32 view of the gallery matrix."""
+        return self.gallery.encodings
 
-    def set_known_faces(self, encodings, names):
+    @property
+    def known_face_names(self):
+        return self.gallery.names
+
+    def set_known_faces(self, encodings, names, ids=None):
         """Manually set known faces from storage (e.g. MongoDB)."""
-        self.known_face_encodings = encodings
-        self.known_face_names = names
+        self.gallery.replace(encodings, names, ids)
 
-    def recognize_faces(self, frame):
-        """Detect and recognize faces in a video frame."""
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_frame, model="hog")
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+    def add_known_face(self, encoding, name, face_id=None):
+        """Append a single known face to the gallery without a full reload."""
+        return self.gallery.add(encoding, name, face_id)
+
+    def enable_approximate_index(self, **index_options):
+        """
+        Switch matching from the exact scan to an IVFIndex.
+
+        The index only takes over once the gallery reaches its min_train_size;
+        smaller galleries keep using the exact scan.
+        """
+        self.gallery.set_index(IVFIndex(**index_options))
+
+    def disable_approximate_index(self):
+        self.gallery.set_index(None)
+
+    def use_match_service(self, client):
+        """
+        Match through a shared MatchServer (match_service.MatchClient) instead of the local gallery.
+
+        While the service is unreachable, matching falls back to the local gallery.
+        Pass None to go back to in-process matching.
+        """
+        self.match_client = client
+
+    def use_encoding_engine(self, engine):
+        """
+        Encode crowded frames on an encoding_engine.EncodingEngine worker pool.
+
+        Frames with only a few faces are still encoded in-process.
+        Pass None to go back to in-process encoding.
+        """
+        self.encoding_engine = engine
+
+    def face_distance_matrix(self, face_encodings):
+        """Distances from every face encoding to every known encoding, shape (F, N)."""
+        return self.gallery.distances(face_encodings)
+
+    def build_result(self, frame, face_locations, face_encodings):
+        """Match already-computed encodings and package them as a RecognitionResult."""
+        face_encodings = np.asarray(face_encodings, dtype=np.float64).reshape(-1, 128)
+        match_start = time.perf_counter()
+        remote = None
+        if self.match_client is not None and len(face_encodings):
+            remote = self.match_client.match(face_encodings)
+        if remote is not None:
+            # The service's row indices refer to its own gallery, not self.gallery
+            _, best_distances, nearest_names = remote
+            best_match_indices = np.full(len(face_encodings), -1, dtype=np.intp)
+            face_names = [name if distance <= self.tolerance else "Unknown"
+                          for name, distance in zip(nearest_names, best_distances)]
+            metrics.record_time("matching", (time.perf_counter() - match_start) * 1000)
+            return RecognitionResult(list(face_locations), face_encodings, None,
+                                     best_match_indices, best_distances, face_names)
+
+        # Hold the gallery lock so a background sync cannot shift rows between match and lookup
+        with self.gallery.lock:
+            if self.gallery.uses_index:
+                face_distances = None
+                best_indices, best_distances = self.gallery.match(face_encodings, 1)
+            else:
+                face_distances = self.face_distance_matrix(face_encodings)
+                best_indices, best_distances = self.gallery.select_top_k(face_distances, 1)
 
-        face_names = []
+            if best_indices.shape[1] > 0:
+                best_match_indices = best_indices[:, 0]
+                best_distances = best_distances[:, 0]
+            else:
+                best_match_indices = np.full(len(face_encodings), -1, dtype=np.intp)
+                best_distances = np.full(len(face_encodings), np.inf)
 
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-            name = "Unknown"
+            matched = (best_match_indices >= 0) & (best_distances <= self.tolerance)
+            face_names = ["Unknown"] * len(matched)
+            for i, name in zip(np.flatnonzero(matched), self.gallery.names_at(best_match_indices[matched])):
+                face_names[i] = name
 
-            face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                if matches[best_match_index]:
-                    name = self.known_face_names[best_match_index]
+        metrics.record_time("matching", (time.perf_counter() - match_start) * 1000)
+        return RecognitionResult(list(face_locations), face_encodings, face_distances,
+                                 best_match_indices, best_distances, face_names)
 
-            face_names.append(name)
+    def top_k_matches(self, face_encodings, k=5):
+        """Top-k (name, id, distance) candidates for each encoding."""
+        return self.gallery.top_k(face_encodings, k)
 
-        return face_locations, face_names
+    def enable_adaptive_detection(self, target_ms=60.0, **options):
+        """Run detection on a downscaled copy whose size follows a per-frame latency budget."""
+        self.detection_scale = AdaptiveDetectionScale(target_ms=target_ms, **options)
+
+    def report_frame_latency(self, elapsed_ms):
+        """Feed a measured per-frame latency to the adaptive detection scale, if enabled."""
+        if self.detection_scale is not None:
+            self.detection_scale.observe_latency(elapsed_ms)
+
+    def detect_faces(self, rgb_frame):
+        """
+        HOG face detection on an RGB frame; returns (top, right, bottom, left) boxes.
+
+        With adaptive detection enabled, HOG runs on a downscaled copy and the boxes
+        are mapped back to full-resolution coordinates for encoding.
+        """
+        scale = self.detection_scale.scale if self.detection_scale is not None else 1.0
+        detect_start = time.perf_counter()
+        if scale >= 1.0:
+            face_locations = load_face_models().face_locations(rgb_frame, model="hog")
+        else:
+            height, width = rgb_frame.shape[:2]
+            small = cv2.resize(rgb_frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+            face_locations = [
+                (max(0, int(top / scale)), min(width, int(right / scale)),
+                 min(height, int(bottom / scale)), max(0, int(left / scale)))
+                for top, right, bottom, left in load_face_models().face_locations(small, model="hog")
+            ]
+
+        metrics.record_time("detection", (time.perf_counter() - detect_start) * 1000)
+        if self.detection_scale is not None:
+            self.detection_scale.observe_detections(face_locations)
+            metrics.set_gauge("detection_scale", self.detection_scale.scale)
+        return face_locations
+
+    def encode_faces(self, rgb_frame, face_locations):
+        """128-d encodings for the given boxes of an RGB frame."""
+        if not face_locations:
+            return []
+        with metrics.timer("encoding"):
+            if self.encoding_engine is not None:
+                return self.encoding_engine.encode(rgb_frame, face_locations)
+            return load_face_models().face_encodings(rgb_frame, face_locations)
+
+    def analyze_frame(self, frame):
+        """Detect, encode and match every face in a frame exactly once."""
+        start = time.perf_counter()
+        with metrics.timer("color_conversion"):
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        face_locations = self.detect_faces(rgb_frame)
+        face_encodings = self.encode_faces(rgb_frame, face_locations)
+
+        result = self.build_result(frame, face_locations, face_encodings)
+        self.last_result = result
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.report_frame_latency(elapsed_ms)
+        metrics.record_time("recognition_total", elapsed_ms)
+        metrics.observe("faces_per_frame", len(result))
+        metrics.increment("frames_recognized")
+        metrics.set_gauge("gallery_size", len(self.gallery))
+        return result
+
+    def recognize_faces(self, frame):
+        """Detect and recognize faces in a video frame."""
+        result = self.analyze_frame(frame)
+        return result.face_locations, result.face_names
 
     def get_face_encoding_from_image(self, image):
         """Extract a single face encoding from an image (used for new users)."""
         rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_image)
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        face_locations = load_face_models().face_locations(rgb_image)
+        face_encodings = load_face_models().face_encodings(rgb_image, face_locations)
 
         if face_encodings:
             return face_encodings[0]  # Return first face only
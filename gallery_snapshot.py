@@ -0,0 +1,137 @@
+# gallery_snapshot.py
+
+import json
+import logging
+import os
+import time
+import numpy as np
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+class GallerySnapshot:
+    """
+    On-disk copy of the gallery for fast cold starts.
+
+    Each save writes a new generation of files into `directory`:
+        encodings-<gen>.npy   (N, 128) float32 matrix, opened with np.memmap
+        sq_norms-<gen>.npy    (N,) float32 squared norms
+        meta-<gen>.json       names and ids sidecar
+    and then atomically replaces manifest.json, which names the current
+    generation and records the Mongo watermark the snapshot is current to.
+    Readers that already mapped an older generation keep working, because the
+    old files are only unlinked, never overwritten.
+    """
+
+    def __init__(self, directory="gallery_snapshot"):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _encode_id(face_id):
+        if isinstance(face_id, ObjectId):
+            return {"$oid": str(face_id)}
+        return face_id
+
+    @staticmethod
+    def _decode_id(face_id):
+        if isinstance(face_id, dict) and "$oid" in face_id:
+            return ObjectId(face_id["$oid"])
+        return face_id
+
+    def read_manifest(self):
+        try:
+            with open(self._path(MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            return None
+        return manifest
+
+    def save(self, gallery, watermark=None):
+        """Write the gallery as a new snapshot generation. Returns the manifest."""
+        os.makedirs(self.directory, exist_ok=True)
+        generation = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{time.monotonic_ns()}"
+
+        with gallery.lock:
+            encodings = np.array(gallery.encodings, dtype=np.float32)
+            sq_norms = np.array(gallery.sq_norms, dtype=np.float32)
+            names = gallery.names
+            ids = gallery.ids
+
+        files = {
+            "encodings": f"encodings-{generation}.npy",
+            "sq_norms": f"sq_norms-{generation}.npy",
+            "meta": f"meta-{generation}.json",
+        }
+        np.save(self._path(files["encodings"]), encodings)
+        np.save(self._path(files["sq_norms"]), sq_norms)
+        with open(self._path(files["meta"]), "w") as f:
+            json.dump({"names": names, "ids": [self._encode_id(i) for i in ids]}, f)
+
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "generation": generation,
+            "count": len(encodings),
+            "dimension": encodings.shape[1],
+            "watermark": str(watermark) if watermark is not None else None,
+            "created": time.time(),
+            "files": files,
+        }
+        tmp_path = self._path(f"{MANIFEST_NAME}.{generation}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(MANIFEST_NAME))
+
+        self._remove_stale(files.values())
+        return manifest
+
+    def _remove_stale(self, keep):
+        keep = set(keep) | {MANIFEST_NAME}
+        for name in os.listdir(self.directory):
+            if name in keep or name.endswith(".tmp"):
+                continue
+            if name.startswith(("encodings-", "sq_norms-", "meta-")):
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+    def load_into(self, gallery):
+        """
+        Map the current snapshot into `gallery` without reading the matrix.
+
+        Returns:
+            The snapshot's Mongo watermark (ObjectId or None), or False if there
+            is no usable snapshot.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            return False
+
+        files = manifest["files"]
+        try:
+            encodings = np.load(self._path(files["encodings"]), mmap_mode="r")
+            sq_norms = np.load(self._path(files["sq_norms"]), mmap_mode="r")
+            with open(self._path(files["meta"])) as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable gallery snapshot: {e}")
+            return False
+
+        if encodings.shape != (manifest["count"], manifest["dimension"]) or len(meta["names"]) != len(encodings):
+            logger.warning("Ignoring gallery snapshot with inconsistent sizes")
+            return False
+
+        gallery.adopt(encodings, sq_norms, meta["names"], [self._decode_id(i) for i in meta["ids"]])
+        watermark = manifest.get("watermark")
+        return ObjectId(watermark) if watermark else None
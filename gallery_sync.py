@@ -0,0 +1,281 @@
+# gallery_sync.py
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from encoding_codec import GALLERY_PROJECTION, LOAD_BATCH_SIZE, encoding_from_document, load_gallery_arrays
+
+logger = logging.getLogger(__name__)
+
+
+class GallerySync:
+    """
+    Keeps a FaceGallery in step with the `known_faces` collection without full reloads.
+
+    Local enrollments are appended to the gallery directly. Changes made by other
+    nodes are picked up in the background, either from a change stream (replica
+    sets / Atlas) or, when that is unavailable, by polling for documents whose
+    ObjectId is newer than a watermark. Deletions, renames and any inserts the
+    poll missed are caught by a periodic reconciliation that only projects `_id`
+    and `name` (plus the encodings of the missing documents).
+    """
+
+    def __init__(self, collection, gallery, poll_interval=5.0, reconcile_interval=60.0,
+                 watermark_overlap=60.0, use_change_streams=True):
+        self.collection = collection
+        self.gallery = gallery
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        # ObjectIds from different clients are only roughly ordered, so each poll
+        # looks back this many seconds past the watermark and skips known ids.
+        self.watermark_overlap = watermark_overlap
+        self.use_change_streams = use_change_streams
+
+        self.watermark = None
+        # Local enrollments reconcile must not delete: ids still waiting in the
+        # enrollment backlog, and ids inserted too recently to be visible in MongoDB
+        self._pending_ids = set()
+        self._recent_local = {}
+        self._local_lock = threading.Lock()
+        self._reconcile_pending = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _document_fields(doc):
+        return encoding_from_document(doc), doc["name"]
+
+    @property
+    def reconcile_pending(self):
+        """True after load_snapshot() until the first reconcile() has run."""
+        return self._reconcile_pending
+
+    def _advance_watermark(self, doc_id):
+        if isinstance(doc_id, ObjectId) and (self.watermark is None or doc_id > self.watermark):
+            self.watermark = doc_id
+
+    def load_full(self):
+        """Replace the gallery with every document in the collection and reset the watermark."""
+        cursor = self.collection.find({}, GALLERY_PROJECTION, batch_size=LOAD_BATCH_SIZE)
+        encodings, names, ids = load_gallery_arrays(cursor, self.collection.estimated_document_count())
+
+        self.gallery.replace(encodings, names, ids)
+        self.watermark = None
+        for doc_id in ids:
+            self._advance_watermark(doc_id)
+        return len(ids)
+
+    def load_snapshot(self, snapshot):
+        """
+        Start from a GallerySnapshot and fetch only what was inserted since it was taken.
+
+        Deletions and renames since the snapshot are applied by the first
+        background reconciliation. Returns False if there was no usable snapshot.
+        """
+        watermark = snapshot.load_into(self.gallery)
+        if watermark is False:
+            return False
+
+        self.watermark = watermark
+        self.poll_new()
+        self._reconcile_pending = True
+        return True
+
+    def record_local_insert(self, doc_id, encoding, name, pending=False):
+        """
+        Add a face this process just inserted, so the next poll does not fetch it again.
+
+        With `pending`, the document is not in MongoDB yet (see mark_pending()).
+        """
+        with self._local_lock:
+            self._recent_local[doc_id] = time.monotonic()
+            if pending:
+                self._pending_ids.add(doc_id)
+        if doc_id not in self.gallery:
+            self.gallery.add(encoding, name, doc_id)
+        self._advance_watermark(doc_id)
+
+    def mark_pending(self, doc_id):
+        """Keep a local face that is waiting to be written to MongoDB out of reconcile's deletions."""
+        with self._local_lock:
+            self._pending_ids.add(doc_id)
+
+    def rekey_local_insert(self, old_id, new_id, encoding, name):
+        """
+        A pending face was finally written to MongoDB as `new_id`; move its gallery row over.
+
+        The new row is added before the old one is removed, so the face stays
+        recognizable throughout.
+        """
+        with self._local_lock:
+            self._recent_local[new_id] = time.monotonic()
+        if new_id != old_id:
+            self.gallery.upsert(new_id, encoding, name)
+            self.gallery.remove(old_id)
+        with self._local_lock:
+            self._pending_ids.discard(old_id)
+            if new_id != old_id:
+                self._recent_local.pop(old_id, None)
+        self._advance_watermark(new_id)
+
+    def _protected_ids(self):
+        """Pending ids plus ids inserted locally within the last `watermark_overlap` seconds."""
+        cutoff = time.monotonic() - self.watermark_overlap
+        with self._local_lock:
+            self._recent_local = {doc_id: t for doc_id, t in self._recent_local.items() if t >= cutoff}
+            return self._pending_ids | set(self._recent_local)
+
+    def poll_new(self):
+        """Fetch documents inserted since the watermark. Returns the number added."""
+        query = {}
+        if self.watermark is not None:
+            lookback = self.watermark.generation_time - timedelta(seconds=self.watermark_overlap)
+            query = {"_id": {"$gt": ObjectId.from_datetime(lookback)}}
+
+        added = 0
+        cursor = self.collection.find(query, GALLERY_PROJECTION, batch_size=LOAD_BATCH_SIZE).sort("_id", 1)
+        for doc in cursor:
+            if doc["_id"] not in self.gallery:
+                encoding, name = self._document_fields(doc)
+                self.gallery.add(encoding, name, doc["_id"])
+                added += 1
+            self._advance_watermark(doc["_id"])
+        return added
+
+    def _fetch_missing(self, face_ids):
+        """Add documents by id in batches, for inserts the watermark poll never saw."""
+        added = 0
+        for start in range(0, len(face_ids), LOAD_BATCH_SIZE):
+            chunk = face_ids[start:start + LOAD_BATCH_SIZE]
+            for doc in self.collection.find({"_id": {"$in": chunk}}, GALLERY_PROJECTION):
+                if doc["_id"] not in self.gallery:
+                    encoding, name = self._document_fields(doc)
+                    self.gallery.add(encoding, name, doc["_id"])
+                    added += 1
+                self._advance_watermark(doc["_id"])
+        return added
+
+    def reconcile(self):
+        """
+        Apply deletions and renames made elsewhere, and add inserts the poll missed.
+
+        Only `_id` and `name` are read for the whole collection; encodings are
+        fetched just for the ids missing locally (inserted with an old ObjectId,
+        beyond the watermark lookback, or while a poll was failing). Local
+        enrollments not yet visible in MongoDB are left alone.
+        Returns (added, removed, renamed) counts.
+        """
+        remote = {doc["_id"]: doc["name"] for doc in self.collection.find({}, {"_id": 1, "name": 1})}
+        local = dict(zip(self.gallery.ids, self.gallery.names))
+        # Read after `local`, so anything added since the remote read is covered
+        protected = self._protected_ids()
+
+        self._reconcile_pending = False
+        removed = 0
+        renamed = 0
+        for face_id, name in local.items():
+            if face_id is None:
+                continue
+            if face_id not in remote:
+                if face_id in protected:
+                    continue
+                removed += self.gallery.remove(face_id)
+            elif remote[face_id] != name:
+                renamed += self.gallery.rename(face_id, remote[face_id])
+        added = self._fetch_missing([face_id for face_id in remote if face_id not in local])
+        return added, removed, renamed
+
+    def apply_change(self, change):
+        """Apply a single change stream event to the gallery."""
+        operation = change.get("operationType")
+        doc_id = change.get("documentKey", {}).get("_id")
+
+        if operation == "delete":
+            self.gallery.remove(doc_id)
+        elif operation in ("insert", "replace", "update"):
+            doc = change.get("fullDocument")
+            if doc is None:
+                # Document was deleted before the lookup happened
+                self.gallery.remove(doc_id)
+                return
+            updated = change.get("updateDescription", {}).get("updatedFields", {})
+            if operation == "update" and doc_id in self.gallery and set(updated) <= {"name"}:
+                self.gallery.rename(doc_id, doc["name"])
+            else:
+                encoding, name = self._document_fields(doc)
+                self.gallery.upsert(doc_id, encoding, name)
+            self._advance_watermark(doc_id)
+        elif operation in ("drop", "invalidate"):
+            self.gallery.clear()
+
+    def _open_change_stream(self):
+        if not self.use_change_streams:
+            return None
+        try:
+            return self.collection.watch(full_document="updateLookup")
+        except (PyMongoError, NotImplementedError, TypeError) as e:
+            # Standalone servers and local stand-ins have no change streams
+            logger.info(f"Change streams unavailable, polling instead: {e}")
+            return None
+
+    def _run_change_stream(self, stream):
+        with stream:
+            while not self._stop_event.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    self.apply_change(change)
+                elif self._stop_event.wait(0.5):
+                    break
+
+    def _run_polling(self):
+        since_reconcile = 0.0
+        while True:
+            try:
+                if self._reconcile_pending:
+                    self.reconcile()
+            except PyMongoError as e:
+                logger.error(f"Gallery sync reconcile failed: {e}")
+            if self._stop_event.wait(self.poll_interval):
+                break
+            try:
+                self.poll_new()
+                since_reconcile += self.poll_interval
+                if since_reconcile >= self.reconcile_interval:
+                    self.reconcile()
+                    since_reconcile = 0.0
+            except PyMongoError as e:
+                logger.error(f"Gallery sync poll failed: {e}")
+
+    def _run(self):
+        stream = self._open_change_stream()
+        if stream is not None:
+            try:
+                # Anything changed between the initial load and opening the stream
+                self.poll_new()
+                if self._reconcile_pending:
+                    self.reconcile()
+                self._run_change_stream(stream)
+                return
+            except PyMongoError as e:
+                logger.error(f"Change stream failed, falling back to polling: {e}")
+                # Catch up on anything missed while the stream was down. The polling loop
+                # does it, so a server that is still unreachable cannot end the thread.
+                self._reconcile_pending = True
+        self._run_polling()
+
+    def start(self):
+        """Start syncing in a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="gallery-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
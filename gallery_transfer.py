@@ -0,0 +1,243 @@
+# gallery_transfer.py
+
+import argparse
+import base64
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+from encoding_codec import ENCODING_DIMENSION, ENCODING_DTYPE, LOAD_BATCH_SIZE, encoding_from_document, \
+    encoding_to_binary
+
+logger = logging.getLogger(__name__)
+
+EXPORT_PROJECTION = {"_id": 1, "source_id": 1, "name": 1, "encoding": 1, "image_path": 1, "timestamp": 1}
+MATRIX_FILE = "encodings.f32"
+METADATA_FILE = "metadata.ndjson.gz"
+MANIFEST_FILE = "manifest.json"
+
+
+def _metadata(doc):
+    timestamp = doc.get("timestamp")
+    metadata = {
+        "_id": str(doc["_id"]),
+        "name": doc["name"],
+        "image_path": doc.get("image_path"),
+        "timestamp": timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+    }
+    if doc.get("source_id") is not None:
+        # Faces imported from elsewhere keep their original identity across further moves
+        metadata["source_id"] = str(doc["source_id"])
+    return metadata
+
+
+def _parse_id(value):
+    return ObjectId(value) if isinstance(value, str) and ObjectId.is_valid(value) else value
+
+
+def _export_cursor(collection, chunk_size):
+    return collection.find({}, EXPORT_PROJECTION, batch_size=chunk_size).sort("_id", 1)
+
+
+def export_ndjson(collection, path, chunk_size=LOAD_BATCH_SIZE):
+    """
+    Stream the whole gallery to gzip'd NDJSON, one face per line.
+
+    Encodings are base64 of the little-endian float32 bytes (~700 bytes a face
+    before compression). Only one cursor batch is held in memory.
+
+    Returns:
+        Number of faces written
+    """
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for doc in _export_cursor(collection, chunk_size):
+            record = _metadata(doc)
+            record["encoding"] = base64.b64encode(encoding_from_document(doc).astype(ENCODING_DTYPE).tobytes()).decode()
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+
+def export_matrix(collection, directory, chunk_size=LOAD_BATCH_SIZE):
+    """
+    Stream the gallery to a raw (N, 128) float32 matrix plus gzip'd NDJSON metadata.
+
+    Row i of `encodings.f32` belongs to line i of `metadata.ndjson.gz`; the
+    matrix can be opened with np.memmap for offline analysis. manifest.json is
+    written last, so a directory without one is an incomplete export.
+
+    Returns:
+        Number of faces written
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    count = 0
+    chunk = []
+    with open(os.path.join(directory, MATRIX_FILE), "wb") as matrix, \
+            gzip.open(os.path.join(directory, METADATA_FILE), "wt", encoding="utf-8") as metadata:
+        for doc in _export_cursor(collection, chunk_size):
+            chunk.append(encoding_from_document(doc))
+            metadata.write(json.dumps(_metadata(doc), separators=(",", ":")) + "\n")
+            if len(chunk) >= chunk_size:
+                matrix.write(np.asarray(chunk, dtype=ENCODING_DTYPE).tobytes())
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            matrix.write(np.asarray(chunk, dtype=ENCODING_DTYPE).tobytes())
+            count += len(chunk)
+
+    with open(manifest_path, "w") as f:
+        json.dump({"count": count, "dimension": ENCODING_DIMENSION, "dtype": ENCODING_DTYPE.str,
+                   "created": datetime.utcnow().isoformat()}, f)
+    return count
+
+
+def read_ndjson(path):
+    """Yield (metadata dict, float32 encoding) from a gzip'd NDJSON export."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            encoding = np.frombuffer(base64.b64decode(record.pop("encoding")), dtype=ENCODING_DTYPE)
+            yield record, encoding
+
+
+def read_matrix(directory):
+    """Yield (metadata dict, float32 encoding) from a matrix export, memory-mapping the encodings."""
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    count = manifest["count"]
+    if count == 0:
+        return
+    matrix = np.memmap(os.path.join(directory, MATRIX_FILE), dtype=np.dtype(manifest["dtype"]), mode="r",
+                       shape=(count, manifest["dimension"]))
+    with gzip.open(os.path.join(directory, METADATA_FILE), "rt", encoding="utf-8") as f:
+        for row, line in enumerate(f):
+            if row >= count:
+                break
+            yield json.loads(line), np.array(matrix[row])
+
+
+def read_export(path):
+    """Records of either export format (a directory is a matrix export)."""
+    return read_matrix(path) if os.path.isdir(path) else read_ndjson(path)
+
+
+def _stored_ids(collection, source_ids):
+    """Map source ids to the _id of the document holding them (the face itself, or its import)."""
+    query = {"$or": [{"_id": {"$in": source_ids}}, {"source_id": {"$in": source_ids}}]}
+    return {doc.get("source_id", doc["_id"]): doc["_id"]
+            for doc in collection.find(query, {"_id": 1, "source_id": 1})}
+
+
+def import_records(records, collection=None, gallery=None, batch_size=1000):
+    """
+    Bulk-load exported faces into MongoDB and/or a FaceGallery.
+
+    Every imported face gets a fresh ObjectId, so running nodes pick it up
+    with their next watermark poll (exported ids are usually older than any
+    watermark). The exported id is kept in `source_id`. MongoDB writes are
+    unordered upserts keyed on it with $setOnInsert, so re-importing the same
+    file (or resuming an interrupted import) never duplicates or overwrites
+    faces, and a face exported from this very collection is not copied again.
+    Gallery rows use the ids stored in MongoDB; faces already in the gallery
+    are skipped.
+
+    Returns:
+        Number of records read
+    """
+    count = 0
+    batch = []
+
+    def flush():
+        ids = [doc["_id"] for doc, _ in batch]
+        if collection is not None:
+            source_ids = [doc["source_id"] for doc, _ in batch]
+            collection.bulk_write(
+                [UpdateOne({"$or": [{"_id": doc["source_id"]}, {"source_id": doc["source_id"]}]},
+                           {"$setOnInsert": doc}, upsert=True) for doc, _ in batch],
+                ordered=False,
+            )
+            stored = _stored_ids(collection, source_ids)
+            ids = [stored.get(source_id) for source_id in source_ids]
+        if gallery is not None:
+            fresh = [(face_id, doc, encoding) for face_id, (doc, encoding) in zip(ids, batch)
+                     if face_id is not None and face_id not in gallery]
+            if fresh:
+                gallery.add_many(np.stack([encoding for _, _, encoding in fresh]),
+                                 [doc["name"] for _, doc, _ in fresh], [face_id for face_id, _, _ in fresh])
+
+    for record, encoding in records:
+        doc = {
+            "_id": ObjectId(),
+            "source_id": _parse_id(record.get("source_id") or record["_id"]),
+            "name": record["name"],
+            "encoding": encoding_to_binary(encoding),
+            "image_path": record.get("image_path"),
+            "timestamp": datetime.fromisoformat(record["timestamp"]) if record.get("timestamp") else None,
+        }
+        batch.append(({key: value for key, value in doc.items() if value is not None}, encoding))
+        count += 1
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    return count
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export or import a whole face gallery")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="stream the MongoDB gallery to a file")
+    export_parser.add_argument("output", help="file (.ndjson.gz) or directory (--format matrix)")
+    export_parser.add_argument("--format", choices=["ndjson", "matrix"], default="ndjson")
+    export_parser.add_argument("--chunk-size", type=int, default=LOAD_BATCH_SIZE)
+
+    import_parser = subparsers.add_parser("import", help="bulk-load an export into MongoDB")
+    import_parser.add_argument("input", help=".ndjson.gz file or matrix export directory")
+    import_parser.add_argument("--batch-size", type=int, default=1000)
+    import_parser.add_argument("--snapshot-dir", default=None,
+                               help="also write the imported faces into this local gallery snapshot")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    uri = (os.getenv("MONGO_URI") or "").strip('"')
+    if not uri:
+        print("Error: MONGO_URI is not set.")
+        raise SystemExit(1)
+    collection = MongoClient(uri)["face_db"]["known_faces"]
+
+    if args.command == "export":
+        exporter = export_matrix if args.format == "matrix" else export_ndjson
+        count = exporter(collection, args.output, args.chunk_size)
+        print(f"[INFO] Exported {count} faces to {args.output}.")
+    else:
+        count = import_records(read_export(args.input), collection, batch_size=args.batch_size)
+        if args.snapshot_dir:
+            from face_gallery import FaceGallery
+            from gallery_snapshot import GallerySnapshot
+            from gallery_sync import GallerySync
+            gallery = FaceGallery()
+            gallery_sync = GallerySync(collection, gallery)
+            # The imported faces have fresh ids, so the snapshot's delta load picks them up
+            if not gallery_sync.load_snapshot(GallerySnapshot(args.snapshot_dir)):
+                gallery_sync.load_full()
+            GallerySnapshot(args.snapshot_dir).save(gallery, gallery_sync.watermark)
+        print(f"[INFO] Imported {count} faces from {args.input}.")
+
+
+if __name__ == "__main__":
+    main()
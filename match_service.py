@@ -0,0 +1,445 @@
+# match_service.py
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from encoding_codec import ENCODING_DIMENSION, ENCODING_DTYPE
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+
+class _MatchRequest:
+    def __init__(self, encodings):
+        self.encodings = encodings
+        self.done = threading.Event()
+        self.faces = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent match requests into one gallery matrix operation.
+
+    The first waiting request opens a batch; further requests join it until
+    `max_batch` faces are queued or `max_wait_ms` has passed, then the whole
+    batch is matched with a single gallery.match() call and split back.
+    """
+
+    def __init__(self, gallery, tolerance=0.6, max_batch=256, max_wait_ms=1.0):
+        from confidence_recognition import ConfidenceRecognition
+
+        self.gallery = gallery
+        self.tolerance = tolerance
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        # Only used for its distance -> confidence mapping, so scores match the in-process ones
+        self._confidence = ConfidenceRecognition(None, None, gallery=gallery)
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def match(self, encodings, timeout=5.0):
+        """
+        Nearest gallery face for each encoding.
+
+        Returns:
+            One dict per encoding with row, id, match (nearest name), name
+            ("Unknown" beyond the tolerance), distance and confidence
+        """
+        request = _MatchRequest(np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIMENSION))
+        if len(request.encodings) == 0:
+            return []
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify()
+        if not request.done.wait(timeout):
+            raise TimeoutError("match request timed out")
+        if request.error is not None:
+            raise request.error
+        return request.faces
+
+    def _take_batch(self):
+        with self._condition:
+            while not self._pending:
+                if self._stop_event.is_set():
+                    return []
+                self._condition.wait(0.5)
+
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while sum(len(r.encodings) for r in self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch, faces = [], 0
+            while self._pending and (not batch or faces + len(self._pending[0].encodings) <= self.max_batch):
+                request = self._pending.pop(0)
+                batch.append(request)
+                faces += len(request.encodings)
+            return batch
+
+    def _match_batch(self, batch):
+        queries = np.concatenate([request.encodings for request in batch])
+        with metrics.timer("service_match"), self.gallery.lock:
+            indices, distances = self.gallery.match(queries, 1)
+            if indices.shape[1] > 0:
+                rows, best = indices[:, 0], distances[:, 0]
+            else:
+                rows, best = np.full(len(queries), -1, dtype=np.intp), np.full(len(queries), np.inf)
+            found = rows >= 0
+            names = ["Unknown"] * len(queries)
+            ids = [None] * len(queries)
+            matched_rows = rows[found]
+            for i, name, face_id in zip(np.flatnonzero(found), self.gallery.names_at(matched_rows),
+                                        self.gallery.ids_at(matched_rows)):
+                names[i] = name
+                ids[i] = face_id
+        confidences = self._confidence._confidence_from_distances(np.where(found, best, 1.0))
+        metrics.observe("service_batch_faces", len(queries))
+        metrics.increment("service_requests", len(batch))
+
+        start = 0
+        for request in batch:
+            end = start + len(request.encodings)
+            request.faces = [
+                {
+                    "row": int(rows[i]),
+                    "id": str(ids[i]) if ids[i] is not None else None,
+                    "match": names[i],
+                    "name": names[i] if found[i] and best[i] <= self.tolerance else "Unknown",
+                    "distance": float(best[i]) if found[i] else None,
+                    "confidence": round(float(confidences[i]), 2),
+                }
+                for i in range(start, end)
+            ]
+            start = end
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                self._match_batch(batch)
+            except Exception as e:
+                logger.error(f"Matching a batch of {len(batch)} requests failed: {e}")
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="match-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(2.0)
+
+
+def _make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so clients reuse one connection per thread
+        protocol_version = "HTTP/1.1"
+        # Small request/response pairs: Nagle + delayed ACK would add ~40 ms each
+        disable_nagle_algorithm = True
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/health":
+                self._reply(200, {"status": "ok", "gallery_size": len(batcher.gallery)})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/match":
+                self._reply(404, {"error": "not found"})
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                if self.headers.get("Content-Type") == "application/json":
+                    encodings = np.asarray(json.loads(body)["encodings"], dtype=np.float32)
+                else:
+                    # Raw little-endian float32, 128 values per face
+                    encodings = np.frombuffer(body, dtype=ENCODING_DTYPE)
+                encodings = encodings.reshape(-1, ENCODING_DIMENSION)
+            except (ValueError, KeyError) as e:
+                self._reply(400, {"error": f"bad encodings: {e}"})
+                return
+            try:
+                self._reply(200, {"faces": batcher.match(encodings)})
+            except Exception as e:
+                self._reply(503, {"error": str(e)})
+
+        def address_string(self):
+            # Unix socket peers have no (host, port)
+            return str(self.client_address[0]) if self.client_address else "unix"
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class _TCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class MatchServer:
+    """
+    Local matching service that owns the gallery.
+
+    POST /match with raw float32 encodings (or JSON {"encodings": [[...]]})
+    returns {"faces": [...]}; GET /health reports the gallery size. Listens on
+    localhost TCP, or on a Unix socket when `unix_path` is given.
+    """
+
+    def __init__(self, gallery, port=DEFAULT_PORT, host="127.0.0.1", unix_path=None, **batch_options):
+        self.batcher = MicroBatcher(gallery, **batch_options)
+        handler = _make_handler(self.batcher)
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            self.server = _UnixHTTPServer(unix_path, handler)
+            self.address = f"unix:{unix_path}"
+        else:
+            self.server = _TCPHTTPServer((host, port), handler)
+            self.address = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self.batcher.start()
+        self._thread = threading.Thread(target=self.server.serve_forever, name="match-http", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.batcher.stop()
+
+
+class _TCPHTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class MatchClient:
+    """
+    Client for MatchServer, with one keep-alive connection per thread.
+
+    match() returns None instead of raising when the service cannot be reached,
+    and then stays away for `retry_after` seconds, so callers fall back to
+    in-process matching without paying a timeout on every frame.
+    """
+
+    def __init__(self, address, timeout=1.0, retry_after=5.0):
+        self.address = address
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.address.startswith("unix:"):
+                connection = _UnixHTTPConnection(self.address[len("unix:"):], self.timeout)
+            else:
+                host_port = self.address.split("://", 1)[-1].rstrip("/")
+                connection = _TCPHTTPConnection(host_port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @property
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def match_faces(self, encodings):
+        """Raw per-face dicts from the service, or None if it is unavailable."""
+        if not self.available:
+            return None
+        body = np.ascontiguousarray(encodings, dtype=ENCODING_DTYPE).tobytes()
+        try:
+            connection = self._connection()
+            connection.request("POST", "/match", body, {"Content-Type": "application/octet-stream"})
+            response = connection.getresponse()
+            payload = json.loads(response.read())
+            if response.status != 200:
+                raise IOError(payload.get("error", f"HTTP {response.status}"))
+            return payload["faces"]
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            self._close()
+            self._down_until = time.monotonic() + self.retry_after
+            logger.warning(f"Match service {self.address} unavailable ({e}); matching in-process "
+                           f"for {self.retry_after:.0f}s")
+            return None
+
+    def match(self, encodings):
+        """
+        (rows, distances, nearest names) arrays for FacialRecognition.build_result, or None.
+
+        Names are the nearest gallery name regardless of tolerance; the caller
+        applies its own tolerance. Rows index the service's gallery, so they
+        must not be looked up in a local one.
+        """
+        faces = self.match_faces(encodings)
+        if faces is None:
+            return None
+        rows = np.array([face["row"] for face in faces], dtype=np.intp)
+        distances = np.array([np.inf if face["distance"] is None else face["distance"] for face in faces])
+        return rows, distances, [face["match"] for face in faces]
+
+
+def load_test(address, clients=8, duration=10.0, faces_per_request=2, seed=0):
+    """
+    Hammer a match service from `clients` threads and report throughput and latency.
+
+    Returns:
+        Dict with requests, faces/s, requests/s, error count and latency percentiles (ms)
+    """
+    client = MatchClient(address, timeout=5.0, retry_after=0.0)
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    stop_at = time.monotonic() + duration
+
+    def worker(i):
+        rng = np.random.default_rng(seed + i)
+        while time.monotonic() < stop_at:
+            queries = rng.normal(scale=0.1, size=(faces_per_request, ENCODING_DIMENSION))
+            start = time.perf_counter()
+            if client.match_faces(queries) is None:
+                errors[i] += 1
+                continue
+            latencies[i].append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    samples = np.concatenate([np.asarray(l) for l in latencies]) if any(latencies) else np.zeros(0)
+    report = {
+        "clients": clients,
+        "faces_per_request": faces_per_request,
+        "requests": int(len(samples)),
+        "errors": int(sum(errors)),
+        "requests_per_s": round(len(samples) / elapsed, 1),
+        "faces_per_s": round(len(samples) * faces_per_request / elapsed, 1),
+    }
+    if len(samples):
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        report.update({"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+                       "p99_ms": round(float(p99), 3), "max_ms": round(float(samples.max()), 3)})
+    return report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Shared local face-matching service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="run the service")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    serve.add_argument("--snapshot-dir", default="gallery_snapshot")
+    serve.add_argument("--no-mongo", action="store_true", help="use only the local gallery snapshot")
+    serve.add_argument("--synthetic", type=int, default=0, help="serve N random faces (for load tests)")
+    serve.add_argument("--max-batch", type=int, default=256)
+    serve.add_argument("--max-wait-ms", type=float, default=1.0)
+
+    bench = subparsers.add_parser("loadtest", help="measure throughput and tail latency of a service")
+    bench.add_argument("--address", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    bench.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    bench.add_argument("--duration", type=float, default=10.0)
+    bench.add_argument("--faces", type=int, default=2, help="faces per request")
+    args = parser.parse_args()
+
+    if args.command == "loadtest":
+        for clients in args.clients:
+            print(json.dumps(load_test(args.address, clients, args.duration, args.faces)))
+        return
+
+    gallery_sync = None
+    if args.synthetic:
+        from ann_index import synthetic_gallery
+        from face_gallery import FaceGallery
+        gallery = FaceGallery()
+        gallery.add_many(synthetic_gallery(args.synthetic), [str(i) for i in range(args.synthetic)])
+    else:
+        from stream_runner import load_gallery
+        mongo_uri = None
+        if not args.no_mongo:
+            from dotenv import load_dotenv
+            load_dotenv()
+            mongo_uri = (os.getenv("MONGO_URI") or "").strip('"') or None
+        # The service's GallerySync keeps it current with every node's enrollments
+        gallery, gallery_sync = load_gallery(mongo_uri, args.snapshot_dir)
+
+    server = MatchServer(gallery, port=args.port, unix_path=args.unix, max_batch=args.max_batch,
+                         max_wait_ms=args.max_wait_ms)
+    server.start()
+    print(f"[INFO] Matching {len(gallery)} faces on {server.address}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if gallery_sync is not None:
+            gallery_sync.stop()
+
+
+if __name__ == "__main__":
+    main()
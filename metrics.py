@@ -0,0 +1,214 @@
+# metrics.py
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+class RollingStat:
+    """Fixed-size ring buffer of recent samples with percentile summaries."""
+
+    def __init__(self, window=512):
+        self._samples = np.zeros(window, dtype=np.float64)
+        self._next = 0
+        self.count = 0
+        self.last = 0.0
+
+    def add(self, value):
+        self._samples[self._next] = value
+        self._next = (self._next + 1) % len(self._samples)
+        self.count += 1
+        self.last = value
+
+    def summary(self):
+        filled = self._samples[:min(self.count, len(self._samples))]
+        if len(filled) == 0:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(filled, [50, 95, 99])
+        return {
+            "count": self.count,
+            "last": round(self.last, 3),
+            "mean": round(float(filled.mean()), 3),
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe registry of stage timings, counters and gauges.
+
+    Stage timings (milliseconds) and other per-frame samples such as
+    faces_per_frame are kept as rolling windows so p50/p95/p99 reflect recent
+    behaviour, counters only go up, and gauges hold the latest value of things
+    like gallery size.
+    """
+
+    def __init__(self, window=512):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._counters = {}
+        self._gauges = {}
+        self._timed = set()
+        self.started = time.time()
+
+    def observe(self, name, value):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = RollingStat(self.window)
+            stat.add(value)
+
+    def record_time(self, stage, elapsed_ms):
+        """Record a stage duration measured by the caller."""
+        with self._lock:
+            self._timed.add(stage)
+        self.observe(stage, elapsed_ms)
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the enclosed block and record it under `stage` in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(stage, (time.perf_counter() - start) * 1000)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._counters.clear()
+            self._gauges.clear()
+            self._timed.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_s": round(time.time() - self.started, 1),
+                "rolling": {name: stat.summary() for name, stat in sorted(self._stats.items())},
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+            }
+
+    def overlay_lines(self, stages=None):
+        """Short 'stage p50/p95' lines for drawing on the video feed (timed stages by default)."""
+        snapshot = self.snapshot()["rolling"]
+        if not stages:
+            with self._lock:
+                stages = sorted(self._timed)
+        lines = []
+        for name in stages:
+            summary = snapshot.get(name)
+            if summary and summary.get("count"):
+                lines.append(f"{name}: {summary['p50']:.1f}/{summary['p95']:.1f} ms")
+        return lines
+
+
+# Process-wide registry used by the recognition and UI code
+metrics = Metrics()
+
+
+class MetricsFileWriter:
+    """Periodically write the registry snapshot to a JSON file (atomically replaced)."""
+
+    def __init__(self, registry, path, interval=5.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                continue
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-file", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+
+
+class MetricsServer:
+    """Serve the registry snapshot as JSON on http://host:port/metrics (localhost by default)."""
+
+    def __init__(self, registry, port=9108, host="127.0.0.1"):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = json.dumps(registry_ref.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_exporters(registry=None):
+    """
+    Start exporters configured through the environment.
+
+    METRICS_PORT enables the local HTTP endpoint, METRICS_FILE the periodic
+    JSON file (METRICS_INTERVAL seconds, default 5). Returns the started exporters.
+    """
+    registry = registry or metrics
+    exporters = []
+    port = os.getenv("METRICS_PORT")
+    if port:
+        exporters.append(MetricsServer(registry, int(port)))
+    path = os.getenv("METRICS_FILE")
+    if path:
+        exporters.append(MetricsFileWriter(registry, path, float(os.getenv("METRICS_INTERVAL", "5"))))
+    for exporter in exporters:
+        exporter.start()
+    return exporters
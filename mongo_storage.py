@@ -1,11 +1,13 @@
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne
 import numpy as np
-import cv2
 import os
+from gallery_sync import GallerySync
+from gallery_snapshot import GallerySnapshot
+from encoding_codec import encoding_to_binary
+from enrollment_queue import EnrollmentQueue
 
 class MongoStorage:
-    def __init__(self, uri, cap, name_cap, recognition):
+    def __init__(self, uri, cap, name_cap, recognition, snapshot_dir="gallery_snapshot"):
         self.client = MongoClient(uri)
         self.db = self.client["face_db"]
         self.collection = self.db["known_faces"]
@@ -13,45 +15,123 @@ class MongoStorage:
         self.cap = cap
         self.name_cap = name_cap
         self.recognition = recognition
+        self.sync = GallerySync(self.collection, recognition.gallery)
+        self.snapshot = GallerySnapshot(snapshot_dir) if snapshot_dir else None
+        self.enrollment = EnrollmentQueue(self.collection, self.sync, recognition)
 
         self.load_known_faces()
+        # Enrollments buffered while MongoDB was unreachable are recognizable again right away
+        waiting = self.enrollment.load_backlog()
+        if waiting:
+            print(f"[INFO] {waiting} enrollments are waiting to be written to MongoDB.")
+        self.enrollment.start()
+
+    def _current_face(self):
+        """
+        Frame to enroll, plus its encoding when the recognizer already computed one.
+
+        With a RecognitionPipeline as `cap`, the newest analyzed frame is used and
+        its encoding reused if it shows exactly one face; otherwise the newest
+        frame is read and encoded by the enrollment worker.
+        """
+        latest_analyzed = getattr(self.cap, "latest_analyzed", None)
+        if latest_analyzed is not None:
+            frame, result = latest_analyzed()
+            if frame is not None and result is not None and len(result) == 1:
+                return frame.copy(), np.array(result.face_encodings[0])
 
-    def take_picture(self):
         ret, frame = self.cap.read()
-        if not ret:
-            print("Error: Failed to capture image.")
-            return None, None
+        return (frame, None) if ret else (None, None)
 
+    def take_picture(self):
+        """Queue an enrollment of the current frame; returns the EnrollmentJob, or None."""
         name = self.name_cap.get("1.0", "end-1c").strip()
         if not name:
             print("Error: Name field is empty.")
-            return None, None
+            return None
 
-        os.makedirs("images", exist_ok=True)
-        img_path = f"images/{name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-        cv2.imwrite(img_path, frame)
+        frame, face_encoding = self._current_face()
+        if frame is None:
+            print("Error: Failed to capture image.")
+            return None
 
-        face_encoding = self.recognition.get_face_encoding_from_image(frame)
-        if face_encoding is None:
-            print("Error: No face found.")
-            return None, None
+        job = self.enrollment.submit(name, frame, face_encoding)
+        print(f"[INFO] Queued enrollment for {name}.")
+        return job
 
-        self.collection.insert_one({
-            "name": name,
-            "encoding": face_encoding.tolist(),
-            "image_path": img_path,
-            "timestamp": datetime.utcnow()
-        })
+    def load_known_faces(self):
+        """
+        Load the gallery at startup.
 
-        print(f"[INFO] Saved face for {name} to MongoDB.")
-        return name, img_path
+        Maps the local snapshot and fetches only the delta from MongoDB when one
+        exists; otherwise does a full load and writes a snapshot for next time.
+        """
+        if self.snapshot is not None and self.sync.load_snapshot(self.snapshot):
+            print(f"[INFO] Mapped {len(self.recognition.gallery)} known faces from local snapshot.")
+            return
 
-    def load_known_faces(self):
-        known_encodings = []
-        known_names = []
+        self.sync.load_full()
+        self.save_snapshot()
+
+    def save_snapshot(self):
+        """Write the current gallery and watermark to the local snapshot."""
+        if self.snapshot is not None:
+            self.snapshot.save(self.recognition.gallery, self.sync.watermark)
+
+    def start_sync(self):
+        """Pick up other nodes' enrollments, renames and deletions in the background."""
+        self.sync.start()
+
+    def stop_sync(self):
+        self.sync.stop()
+        self.save_snapshot()
+
+    def close(self):
+        """Finish queued enrollments, stop syncing and persist the snapshot."""
+        self.enrollment.stop()
+        self.stop_sync()
+
+
+def migrate_encodings(collection, batch_size=1000):
+    """
+    Convert legacy list-of-doubles encodings to compact float32 Binary blobs.
+
+    Safe to re-run: only documents whose encoding is still an array are touched.
+    Returns the number of documents converted.
+    """
+    converted = 0
+    requests = []
+    cursor = collection.find({"encoding": {"$type": "array"}}, {"encoding": 1}, batch_size=batch_size)
+
+    for doc in cursor:
+        requests.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"encoding": encoding_to_binary(doc["encoding"])}}))
+        if len(requests) >= batch_size:
+            converted += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+
+    if requests:
+        converted += collection.bulk_write(requests, ordered=False).modified_count
+    return converted
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="MongoDB face storage maintenance")
+    parser.add_argument("--migrate", action="store_true", help="convert list encodings to float32 Binary")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
 
-        for doc in self.collection.find():
-            known_encodings.append(np.array(doc["encoding"]))
-            known_names.append(doc["name"])
+    load_dotenv()
+    uri = (os.getenv("MONGO_URI") or "").strip('"')
+    if not uri:
+        print("Error: MONGO_URI is not set.")
+        raise SystemExit(1)
 
-        self.recognition.set_known_faces(known_encodings, known_names)
+    if args.migrate:
+        collection = MongoClient(uri)["face_db"]["known_faces"]
+        count = migrate_encodings(collection, args.batch_size)
+        print(f"[INFO] Migrated {count} face encodings to float32 Binary.")
+    else:
+        parser.print_help()
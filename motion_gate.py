@@ -0,0 +1,114 @@
+# motion_gate.py
+
+import time
+import cv2
+import numpy as np
+from metrics import metrics
+
+
+class MotionGate:
+    """
+    Cheap scene-change detector working on a tiny blurred grayscale thumbnail.
+
+    Each frame is compared with a slowly updated background (running average),
+    so gradual lighting changes are absorbed while someone walking in is not.
+    `sensitivity` (0-1, higher = more sensitive) sets both the per-pixel change
+    threshold and the fraction of thumbnail pixels that must change.
+    """
+
+    def __init__(self, sensitivity=0.5, thumbnail_size=(64, 48), background_rate=0.05):
+        sensitivity = min(max(sensitivity, 0.0), 1.0)
+        self.sensitivity = sensitivity
+        self.thumbnail_size = thumbnail_size
+        self.background_rate = background_rate
+        self.pixel_threshold = 40 - 30 * sensitivity
+        self.min_changed_fraction = 0.002 + 0.05 * (1 - sensitivity)
+
+        self._background = None
+        self.last_score = 0.0
+
+    def reset(self):
+        self._background = None
+
+    def _thumbnail(self, frame):
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (3, 3), 0).astype(np.float32)
+
+    def update(self, frame):
+        """
+        Feed one frame; True if the scene changed.
+
+        The first frame always counts as motion.
+        """
+        thumbnail = self._thumbnail(frame)
+        if self._background is None:
+            self._background = thumbnail
+            self.last_score = 1.0
+            return True
+
+        changed = np.count_nonzero(cv2.absdiff(thumbnail, self._background) > self.pixel_threshold)
+        self.last_score = changed / thumbnail.size
+        cv2.accumulateWeighted(thumbnail, self._background, self.background_rate)
+        return self.last_score >= self.min_changed_fraction
+
+
+class MotionGatedRecognizer:
+    """
+    Skips recognition while the scene is static and reuses the last result.
+
+    Recognition runs at full rate while there is motion and for `hold_s`
+    seconds after it stops (people standing still still get refreshed), and
+    at least every `heartbeat_s` seconds otherwise, so a static scene is still
+    re-checked now and then.
+
+    Wraps a recognizer or FaceTracker and exposes analyze_frame()/recognize_faces(),
+    so it can stand in for either in RecognitionPipeline or MultiStreamRunner.
+    """
+
+    def __init__(self, recognizer, gate=None, heartbeat_s=5.0, hold_s=2.0):
+        self.recognizer = recognizer
+        self.gate = gate or MotionGate()
+        self.heartbeat_s = heartbeat_s
+        self.hold_s = hold_s
+        self.enabled = True
+
+        self.last_result = None
+        self._active_until = 0.0
+        self._last_run = 0.0
+        self.frames_seen = 0
+        self.frames_gated = 0
+
+    @property
+    def gallery(self):
+        return self.recognizer.gallery
+
+    def _should_run(self, frame, now):
+        with metrics.timer("motion_gate"):
+            motion = self.gate.update(frame)
+        metrics.set_gauge("motion_score", round(self.gate.last_score, 4))
+        if motion:
+            self._active_until = now + self.hold_s
+        return (not self.enabled or self.last_result is None or now < self._active_until
+                or now - self._last_run >= self.heartbeat_s)
+
+    def analyze_frame(self, frame):
+        now = time.monotonic()
+        self.frames_seen += 1
+        if not self._should_run(frame, now):
+            self.frames_gated += 1
+            metrics.increment("frames_gated")
+            return self.last_result
+
+        self._last_run = now
+        self.last_result = self.recognizer.analyze_frame(frame)
+        return self.last_result
+
+    def recognize_faces(self, frame):
+        """Same contract as FacialRecognition.recognize_faces."""
+        result = self.analyze_frame(frame)
+        return result.face_locations, result.face_names
+
+    def get_last_confidence_scores(self):
+        return self.last_result.confidence_scores if self.last_result is not None else []
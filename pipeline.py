@@ -0,0 +1,342 @@
+# pipeline.py
+
+import argparse
+import collections
+import json
+import logging
+import threading
+import time
+import cv2
+import numpy as np
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DropOldestQueue:
+    """
+    Bounded queue that never blocks the producer.
+
+    When full, put() discards the oldest item so consumers always see the
+    freshest frames instead of a growing backlog.
+    """
+
+    def __init__(self, maxsize=1):
+        self._items = collections.deque(maxlen=maxsize)
+        self._condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """Oldest queued item, or None if nothing arrives within `timeout`."""
+        with self._condition:
+            if not self._items and not self._condition.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def get_latest(self, timeout=None):
+        """Newest queued item, discarding anything older."""
+        with self._condition:
+            if not self._items and not self._condition.wait_for(lambda: self._items, timeout):
+                return None
+            item = self._items.pop()
+            self.dropped += len(self._items)
+            self._items.clear()
+            return item
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SyntheticFrameSource:
+    """
+    cv2.VideoCapture-compatible source of generated frames, for headless runs and tests.
+
+    Draws a bright moving rectangle on a noisy background at the requested FPS.
+    """
+
+    def __init__(self, width=500, height=350, fps=30.0, frame_count=None, seed=0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_count = frame_count
+        self._rng = np.random.default_rng(seed)
+        self._index = 0
+        self._opened = True
+        self._next_time = time.monotonic()
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        if not self._opened or (self.frame_count is not None and self._index >= self.frame_count):
+            return False, None
+
+        if self.fps:
+            delay = self._next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time = max(self._next_time, time.monotonic() - 1.0) + 1.0 / self.fps
+
+        frame = self._rng.integers(0, 40, size=(self.height, self.width, 3), dtype=np.uint8)
+        x = int((self._index * 4) % max(1, self.width - 100))
+        cv2.rectangle(frame, (x, 100), (x + 100, 220), (200, 180, 160), -1)
+        self._index += 1
+        return True, frame
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self._opened = False
+
+
+class FramePacket:
+    """A captured frame with its sequence number and capture time."""
+
+    def __init__(self, frame_id, frame, timestamp):
+        self.frame_id = frame_id
+        self.frame = frame
+        self.timestamp = timestamp
+
+
+def draw_recognition_overlay(frame, result):
+    """Draw boxes, names and confidence percentages from a RecognitionResult onto `frame`."""
+    if result is None:
+        return frame
+
+    for (top, right, bottom, left), name, score in zip(result.face_locations, result.face_names,
+                                                        result.confidence_scores):
+        cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+        cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
+
+        if score >= 70:
+            conf_color = (0, 255, 0)
+        elif score >= 50:
+            conf_color = (0, 255, 255)
+        else:
+            conf_color = (0, 0, 255)
+
+        confidence_text = f"{score:.1f}%"
+        cv2.putText(frame, confidence_text, (left, top - 30), cv2.FONT_HERSHEY_SIMPLEX, 0.75, conf_color, 2)
+    return frame
+
+
+class RateMeter:
+    """Exponentially smoothed events-per-second counter."""
+
+    def __init__(self, smoothing=0.9):
+        self.smoothing = smoothing
+        self.rate = 0.0
+        self._last = None
+
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self._last is not None and now > self._last:
+            instant = 1.0 / (now - self._last)
+            self.rate = instant if self.rate == 0 else self.smoothing * self.rate + (1 - self.smoothing) * instant
+        self._last = now
+
+
+class RecognitionPipeline:
+    """
+    Capture -> inference -> render pipeline that keeps recognition off the UI thread.
+
+    A capture thread reads the source as fast as it delivers and feeds two bounded
+    drop-oldest queues: one for display and one (size 1) for inference. An
+    inference thread always works on the newest frame and publishes the latest
+    RecognitionResult. The render stage (Tk's main loop, or run_headless) pulls
+    the newest frame and pairs it with the newest result, so the display runs at
+    camera FPS while recognition runs at whatever rate it can sustain.
+
+    `recognition` may be None (frames are shown but not analyzed) and set later,
+    so video can start before the face models and gallery have loaded.
+    """
+
+    def __init__(self, recognition, frame_size=(500, 350), display_queue_size=2, on_result=None):
+        self.recognition = recognition
+        # Called on the inference thread with every finished RecognitionResult; must not block
+        self.on_result = on_result
+        self.frame_size = frame_size
+        self.display_queue = DropOldestQueue(display_queue_size)
+        self.inference_queue = DropOldestQueue(1)
+
+        self.source = None
+        self.capture_rate = RateMeter()
+        self.inference_rate = RateMeter()
+        self.render_rate = RateMeter()
+        self.source_failed = False
+
+        self._result_lock = threading.Lock()
+        self._latest_result = None
+        self._latest_result_frame_id = -1
+        self._latest_result_packet = None
+        self._latest_raw = None
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self, source):
+        """Start capture and inference threads reading from a cv2.VideoCapture-like source."""
+        self.stop()
+        self.source = source
+        self.source_failed = False
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name="capture", daemon=True),
+            threading.Thread(target=self._inference_loop, name="inference", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _capture_loop(self):
+        frame_id = 0
+        while not self._stop_event.is_set():
+            ret, raw = self.source.read()
+            if not ret:
+                logger.info("Frame source ended or failed.")
+                self.source_failed = True
+                break
+
+            self._latest_raw = raw
+            frame = cv2.resize(raw, self.frame_size) if self.frame_size else raw
+            packet = FramePacket(frame_id, frame, time.monotonic())
+            self.display_queue.put(packet)
+            self.inference_queue.put(packet)
+            self.capture_rate.tick(packet.timestamp)
+            frame_id += 1
+
+    def _inference_loop(self):
+        while not self._stop_event.is_set():
+            packet = self.inference_queue.get_latest(timeout=0.1)
+            recognition = self.recognition
+            if packet is None or recognition is None:
+                continue
+            try:
+                result = recognition.analyze_frame(packet.frame)
+            except Exception as e:
+                logger.error(f"Recognition failed: {e}")
+                continue
+            if result is self._latest_result:
+                # A motion gate skipped this frame and handed back the previous result
+                continue
+            with self._result_lock:
+                self._latest_result = result
+                self._latest_result_frame_id = packet.frame_id
+                self._latest_result_packet = packet
+            self.inference_rate.tick()
+            if self.on_result is not None:
+                self.on_result(result)
+
+    def latest_result(self):
+        """(frame_id, RecognitionResult) of the newest finished inference."""
+        with self._result_lock:
+            return self._latest_result_frame_id, self._latest_result
+
+    def latest_analyzed(self):
+        """(frame, RecognitionResult) of the newest finished inference, so enrollment can reuse its encoding."""
+        with self._result_lock:
+            if self._latest_result_packet is None:
+                return None, None
+            return self._latest_result_packet.frame, self._latest_result
+
+    def next_frame(self, timeout=0.0):
+        """
+        Render-stage pull: the newest captured frame plus the newest result.
+
+        Returns:
+            (FramePacket, RecognitionResult) or (None, None) when no new frame is ready
+        """
+        packet = self.display_queue.get_latest(timeout=timeout)
+        if packet is None:
+            return None, None
+        self.render_rate.tick()
+        return packet, self.latest_result()[1]
+
+    def read(self):
+        """cv2.VideoCapture-style read of the newest raw frame (used for enrollment)."""
+        raw = self._latest_raw
+        if raw is None:
+            return False, None
+        return True, raw.copy()
+
+    def stats(self):
+        stats = {
+            "capture_fps": self.capture_rate.rate,
+            "inference_fps": self.inference_rate.rate,
+            "render_fps": self.render_rate.rate,
+            "display_dropped": self.display_queue.dropped,
+            "inference_dropped": self.inference_queue.dropped,
+        }
+        for name, value in stats.items():
+            metrics.set_gauge(name, round(value, 2))
+        return stats
+
+    def run_headless(self, source, max_frames=None, on_frame=None):
+        """
+        Drive the pipeline without a GUI until the source ends or `max_frames` are rendered.
+
+        Args:
+            source: cv2.VideoCapture-like frame source (video file, synthetic, camera)
+            max_frames: Stop after this many rendered frames
+            on_frame: Optional callback(packet, result) for every rendered frame
+
+        Returns:
+            Pipeline stats dict
+        """
+        self.start(source)
+        rendered = 0
+        try:
+            while max_frames is None or rendered < max_frames:
+                packet, result = self.next_frame(timeout=0.5)
+                if packet is None:
+                    if self.source_failed and len(self.display_queue) == 0:
+                        break
+                    continue
+                if on_frame is not None:
+                    on_frame(packet, result)
+                rendered += 1
+        finally:
+            self.stop()
+        stats = self.stats()
+        stats["rendered_frames"] = rendered
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the recognition pipeline without a GUI")
+    parser.add_argument("--video", help="video file to read (default: synthetic frames)")
+    parser.add_argument("--frames", type=int, default=300, help="frames to render before stopping")
+    args = parser.parse_args()
+
+    from confidence_recognition import ConfidenceRecognition
+
+    source = cv2.VideoCapture(args.video) if args.video else SyntheticFrameSource(frame_count=args.frames)
+    pipeline = RecognitionPipeline(ConfidenceRecognition(None, None))
+
+    def report(packet, result):
+        if result is not None and len(result):
+            print(json.dumps({"frame": packet.frame_id, "names": result.face_names,
+                              "confidence": [round(c, 1) for c in result.confidence_scores]}))
+
+    print(json.dumps(pipeline.run_headless(source, args.frames, report)))
+    source.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# sighting_log.py
+
+import collections
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RotatingNdjsonFile:
+    """
+    Append-only NDJSON file that rotates to path.1 ... path.N once it exceeds `max_bytes`.
+
+    Only one writer thread may use an instance.
+    """
+
+    def __init__(self, path, max_bytes=10 * 2 ** 20, backups=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def append(self, records):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def files(self):
+        """Existing log files, oldest first."""
+        rotated = sorted(glob.glob(f"{self.path}.[0-9]*"), key=lambda p: int(p.rsplit(".", 1)[1]), reverse=True)
+        return rotated + ([self.path] if os.path.exists(self.path) else [])
+
+
+def iter_ndjson(paths):
+    """Stream records from NDJSON files one line at a time, skipping torn lines."""
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+class SightingLog:
+    """
+    Audit trail of who was recognized, when, how confidently and on which camera.
+
+    record() only deduplicates and appends to an in-memory buffer, so it never
+    blocks the recognition loop. A background writer drains the buffer every
+    `flush_interval` seconds (or as soon as `batch_size` sightings are waiting)
+    to a rotating NDJSON file and, if a collection is given, to MongoDB with
+    one insert_many per batch.
+
+    A face is logged once per track (or per name when tracking is off) and again
+    only when its name changes or it has not been logged for `dedup_window` seconds.
+    """
+
+    def __init__(self, path="sightings/sightings.ndjson", collection=None, camera="camera0",
+                 dedup_window=30.0, flush_interval=2.0, batch_size=200, max_pending=10000,
+                 max_bytes=10 * 2 ** 20, backups=5):
+        self.file = RotatingNdjsonFile(path, max_bytes, backups) if path else None
+        self.collection = collection
+        self.camera = camera
+        self.dedup_window = dedup_window
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._pending = collections.deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_logged = {}
+        self._last_pruned = time.monotonic()
+        self._mongo_retry = []
+        # Sightings already in the file that the writer thread still has to send to MongoDB
+        self._mongo_queue = []
+        self.dropped = 0
+
+    def _should_log(self, key, name, now):
+        previous = self._last_logged.get(key)
+        if previous is not None and previous[0] == name and now - previous[1] < self.dedup_window:
+            return False
+        self._last_logged[key] = (name, now)
+        return True
+
+    def _prune(self, now):
+        if now - self._last_pruned < self.dedup_window:
+            return
+        self._last_logged = {key: value for key, value in self._last_logged.items()
+                             if now - value[1] < self.dedup_window}
+        self._last_pruned = now
+
+    def record(self, result, camera=None):
+        """
+        Queue the faces of one RecognitionResult as sightings (non-blocking).
+
+        Args:
+            result: RecognitionResult, optionally with track_ids from FaceTracker
+            camera: Camera/stream name (defaults to the log's camera)
+
+        Returns:
+            Number of sightings queued after deduplication
+        """
+        if result is None or len(result) == 0:
+            return 0
+
+        camera = camera or self.camera
+        now = time.monotonic()
+        timestamp = datetime.now(timezone.utc).isoformat()
+        track_ids = getattr(result, "track_ids", None) or [None] * len(result)
+
+        queued = 0
+        with self._lock:
+            self._prune(now)
+            for name, score, level, track_id in zip(result.face_names, result.confidence_scores,
+                                                    result.confidence_levels, track_ids):
+                key = (camera, "track", track_id) if track_id is not None else (camera, "name", name)
+                if not self._should_log(key, name, now):
+                    continue
+                if len(self._pending) == self._pending.maxlen:
+                    self.dropped += 1
+                    metrics.increment("sightings_dropped")
+                self._pending.append({
+                    "name": name,
+                    "confidence": round(float(score), 1),
+                    "level": level,
+                    "timestamp": timestamp,
+                    "camera": camera,
+                    "track_id": track_id,
+                })
+                queued += 1
+            backlog = len(self._pending)
+
+        if queued:
+            metrics.increment("sightings_logged", queued)
+        if backlog >= self.batch_size:
+            self._wake.set()
+        return queued
+
+    def _drain(self):
+        with self._lock:
+            batch = list(self._pending)
+            self._pending.clear()
+        return batch
+
+    def _write_mongo(self, batch):
+        # Client-side _ids make retries idempotent: re-sent documents fail as duplicates
+        docs = self._mongo_retry + [
+            dict(record, _id=ObjectId(), timestamp=datetime.fromisoformat(record["timestamp"]))
+            for record in batch
+        ]
+        if not docs:
+            return
+        try:
+            self.collection.insert_many(docs, ordered=False)
+            failed = []
+        except BulkWriteError as e:
+            failed = [docs[error["index"]] for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+        except PyMongoError:
+            failed = docs
+        if failed:
+            # Keep a bounded backlog for the next flush; the local file already has everything
+            logger.warning(f"Writing {len(failed)} sightings to MongoDB failed; retrying on the next flush")
+        self._mongo_retry = failed[-self._pending.maxlen:]
+
+    def flush(self, file_only=False):
+        """
+        Write everything buffered so far (called by the writer thread, before exports and on stop).
+
+        With `file_only` the buffer only goes to the local file and the MongoDB
+        insert is left to the writer thread, so callers on the UI thread never
+        wait on the database.
+        """
+        if file_only:
+            batch = self._write_file()
+            if batch and self.collection is not None:
+                with self._lock:
+                    self._mongo_queue.extend(batch)
+                self._wake.set()
+            return len(batch)
+
+        with self._flush_lock:
+            if not self._pending and not self._mongo_queue and not self._mongo_retry:
+                return 0
+            with metrics.timer("sighting_flush"):
+                batch, queued = self._write_file(), self._take_mongo_queue()
+                if self.collection is not None:
+                    self._write_mongo(queued + batch)
+        return len(batch)
+
+    def _take_mongo_queue(self):
+        with self._lock:
+            queued, self._mongo_queue = self._mongo_queue, []
+        return queued
+
+    def _write_file(self):
+        # Drain under the file lock so records reach the file in the order they were queued
+        with self._file_lock:
+            batch = self._drain()
+            if batch and self.file is not None:
+                try:
+                    self.file.append(batch)
+                except OSError as e:
+                    logger.error(f"Writing sightings to {self.file.path} failed: {e}")
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sighting-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def iter_records(self):
+        """Stream every sighting persisted to the local log, oldest first."""
+        if self.file is None:
+            return iter(())
+        return iter_ndjson(self.file.files())
+
+
+def iter_collection(collection, query=None, chunk_size=1000):
+    """Stream sightings from MongoDB in server-side batches of `chunk_size`, oldest first."""
+    cursor = collection.find(query or {}, {"_id": 0}).sort("timestamp", 1).batch_size(chunk_size)
+    for doc in cursor:
+        if isinstance(doc.get("timestamp"), datetime):
+            doc["timestamp"] = doc["timestamp"].isoformat()
+        yield doc
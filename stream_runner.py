@@ -0,0 +1,419 @@
+# stream_runner.py
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import cv2
+from confidence_recognition import ConfidenceRecognition
+from encoding_engine import EncodingEngine
+from face_gallery import FaceGallery
+from face_tracker import FaceTracker
+from motion_gate import MotionGate, MotionGatedRecognizer
+from match_service import MatchClient
+from pipeline import DropOldestQueue, FramePacket, RateMeter
+
+logger = logging.getLogger(__name__)
+
+
+def open_source(source):
+    """cv2.VideoCapture for a camera index ("0"), RTSP/HTTP URL or video file path."""
+    if isinstance(source, str) and source.isdigit():
+        return cv2.VideoCapture(int(source))
+    return cv2.VideoCapture(source)
+
+
+class EventWriter:
+    """Thread-safe newline-delimited JSON event sink."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def result_event(stream_name, packet, result):
+    """Structured recognition event for one processed frame."""
+    track_ids = getattr(result, "track_ids", None) or [None] * len(result)
+    return {
+        "type": "recognition",
+        "stream": stream_name,
+        "frame": packet.frame_id,
+        "timestamp": time.time(),
+        "latency_ms": round((time.monotonic() - packet.timestamp) * 1000, 1),
+        "faces": [
+            {
+                "name": name,
+                "confidence": round(float(score), 1),
+                "level": level,
+                "box": [int(v) for v in box],
+                "track_id": track_id,
+            }
+            for box, name, score, level, track_id in zip(
+                result.face_locations, result.face_names, result.confidence_scores,
+                result.confidence_levels, track_ids)
+        ],
+    }
+
+
+class StreamState:
+    """One input stream: its capture thread, newest-frame slot and recognizer."""
+
+    def __init__(self, name, source, recognizer, frame_size=None):
+        self.name = name
+        self.source = source
+        self.recognizer = recognizer
+        self.frame_size = frame_size
+        self.latest = DropOldestQueue(1)
+        self.capture_rate = RateMeter()
+        self.inference_rate = RateMeter()
+        self.frames_processed = 0
+        self.frames_gated = 0
+        self.last_result = None
+        self.ended = False
+        self.busy = False
+
+    def capture_loop(self, stop_event, wake):
+        frame_id = 0
+        while not stop_event.is_set():
+            ret, frame = self.source.read()
+            if not ret:
+                break
+            if self.frame_size:
+                frame = cv2.resize(frame, self.frame_size)
+            self.latest.put(FramePacket(frame_id, frame, time.monotonic()))
+            self.capture_rate.tick()
+            frame_id += 1
+            wake()
+        self.ended = True
+        wake()
+
+
+class MultiStreamRunner:
+    """
+    Headless recognition over several sources sharing one in-memory gallery.
+
+    Every stream has its own capture thread that keeps only its newest frame, and
+    its own recognizer (so per-stream state such as tracks and the adaptive
+    detection scale stays separate), while all recognizers match against the
+    same FaceGallery. A pool of inference workers serves the streams round-robin,
+    and a stream is only ever processed by one worker at a time, so a slow
+    stream cannot starve the others.
+    """
+
+    def __init__(self, sources, gallery, workers=None, event_sink=None, track=False,
+                 frame_size=None, adaptive_detection_ms=None, stats_interval=10.0,
+                 motion_sensitivity=None, heartbeat_s=5.0, match_service=None, encoding_processes=None):
+        self.gallery = gallery
+        self.workers = workers or os.cpu_count() or 1
+        self.event_sink = event_sink or EventWriter()
+        self.stats_interval = stats_interval
+
+        # One client (one connection per worker thread) shared by every stream
+        match_client = MatchClient(match_service) if match_service else None
+        # Likewise one encoding pool; each inference thread gets its own shared-memory segment
+        self.encoding_engine = EncodingEngine(encoding_processes) if encoding_processes else None
+
+        self.streams = []
+        for i, source in enumerate(sources):
+            name, capture = source if isinstance(source, tuple) else (str(source), open_source(source))
+            recognizer = ConfidenceRecognition(None, None, gallery=gallery)
+            if match_client is not None:
+                recognizer.use_match_service(match_client)
+            if self.encoding_engine is not None:
+                recognizer.use_encoding_engine(self.encoding_engine)
+            if adaptive_detection_ms:
+                recognizer.enable_adaptive_detection(target_ms=adaptive_detection_ms)
+            if track:
+                recognizer = FaceTracker(recognizer)
+            if motion_sensitivity is not None:
+                recognizer = MotionGatedRecognizer(recognizer, MotionGate(motion_sensitivity), heartbeat_s)
+            self.streams.append(StreamState(name, capture, recognizer, frame_size))
+
+        self._stop_event = threading.Event()
+        self._condition = threading.Condition()
+        self._next_stream = 0
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def _acquire_stream(self):
+        """Next stream (round-robin) with a fresh frame that no worker is processing."""
+        with self._condition:
+            while not self._stop_event.is_set():
+                count = len(self.streams)
+                for offset in range(count):
+                    index = (self._next_stream + offset) % count
+                    stream = self.streams[index]
+                    if not stream.busy and len(stream.latest):
+                        stream.busy = True
+                        self._next_stream = (index + 1) % count
+                        return stream
+                if all(stream.ended and not len(stream.latest) for stream in self.streams):
+                    return None
+                self._condition.wait(0.5)
+            return None
+
+    def _release_stream(self, stream):
+        with self._condition:
+            stream.busy = False
+            self._condition.notify_all()
+
+    def _worker_loop(self):
+        while True:
+            stream = self._acquire_stream()
+            if stream is None:
+                return
+            try:
+                packet = stream.latest.get_latest(timeout=0)
+                if packet is None:
+                    continue
+                result = stream.recognizer.analyze_frame(packet.frame)
+                stream.frames_processed += 1
+                if result is stream.last_result:
+                    # Motion gate reused the previous result; nothing new to report
+                    stream.frames_gated += 1
+                    continue
+                stream.last_result = result
+                stream.inference_rate.tick()
+                self.event_sink(result_event(stream.name, packet, result))
+            except Exception as e:
+                logger.error(f"Recognition failed on stream {stream.name}: {e}")
+            finally:
+                self._release_stream(stream)
+
+    def stats(self):
+        return {
+            "type": "stats",
+            "timestamp": time.time(),
+            "gallery_size": len(self.gallery),
+            "streams": {
+                stream.name: {
+                    "capture_fps": round(stream.capture_rate.rate, 2),
+                    "inference_fps": round(stream.inference_rate.rate, 2),
+                    "frames_processed": stream.frames_processed,
+                    "frames_gated": stream.frames_gated,
+                    "frames_dropped": stream.latest.dropped,
+                    "ended": stream.ended,
+                }
+                for stream in self.streams
+            },
+        }
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake()
+
+    def run(self, duration=None):
+        """Process all streams until they end, stop() is called or `duration` seconds pass."""
+        self._stop_event.clear()
+        if self.encoding_engine is not None:
+            self.encoding_engine.start()
+        for stream in self.streams:
+            self.event_sink({"type": "stream_started", "stream": stream.name, "timestamp": time.time()})
+
+        capture_threads = [
+            threading.Thread(target=stream.capture_loop, args=(self._stop_event, self._wake),
+                             name=f"capture-{stream.name}", daemon=True)
+            for stream in self.streams
+        ]
+        worker_threads = [
+            threading.Thread(target=self._worker_loop, name=f"inference-{i}", daemon=True)
+            for i in range(min(self.workers, len(self.streams)) or 1)
+        ]
+        for thread in capture_threads + worker_threads:
+            thread.start()
+
+        started = time.monotonic()
+        last_stats = started
+        try:
+            while any(thread.is_alive() for thread in worker_threads):
+                for thread in worker_threads:
+                    thread.join(0.5)
+                now = time.monotonic()
+                if duration is not None and now - started >= duration:
+                    break
+                if self.stats_interval and now - last_stats >= self.stats_interval:
+                    self.event_sink(self.stats())
+                    last_stats = now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            for thread in capture_threads + worker_threads:
+                thread.join(2.0)
+            for stream in self.streams:
+                stream.source.release()
+                self.event_sink({"type": "stream_ended", "stream": stream.name, "timestamp": time.time()})
+            if self.encoding_engine is not None:
+                self.encoding_engine.close()
+            self.event_sink(self.stats())
+
+
+def load_gallery(mongo_uri=None, snapshot_dir=None, collection=None, sync=True):
+    """
+    Build the shared gallery from the local snapshot and/or MongoDB.
+
+    With `sync=False` the gallery is a one-off copy: it is fully reconciled
+    with MongoDB before returning and not updated afterwards.
+
+    Returns:
+        (gallery, GallerySync or None)
+    """
+    gallery = FaceGallery()
+    if collection is None and mongo_uri:
+        from pymongo import MongoClient
+        collection = MongoClient(mongo_uri)["face_db"]["known_faces"]
+
+    if collection is None:
+        if snapshot_dir:
+            from gallery_snapshot import GallerySnapshot
+            GallerySnapshot(snapshot_dir).load_into(gallery)
+        return gallery, None
+
+    from gallery_sync import GallerySync
+    from gallery_snapshot import GallerySnapshot
+    gallery_sync = GallerySync(collection, gallery)
+    if not (snapshot_dir and gallery_sync.load_snapshot(GallerySnapshot(snapshot_dir))):
+        gallery_sync.load_full()
+    if sync:
+        gallery_sync.start()
+    elif gallery_sync.reconcile_pending:
+        # Nothing will sync later, so apply deletions and renames since the snapshot now
+        gallery_sync.reconcile()
+    return gallery, gallery_sync
+
+
+def _run_partition(sources, options, event_queue):
+    """Child-process entry point: run a subset of the streams and forward events."""
+    gallery_sync = None
+    try:
+        # Inside the try, so the parent hears back even if MongoDB is unreachable
+        gallery, gallery_sync = load_gallery(options["mongo_uri"], options["snapshot_dir"])
+        runner = MultiStreamRunner(sources, gallery, workers=options["workers"], event_sink=event_queue.put,
+                                   track=options["track"], frame_size=options["frame_size"],
+                                   adaptive_detection_ms=options["adaptive_detection_ms"],
+                                   stats_interval=options["stats_interval"],
+                                   motion_sensitivity=options["motion_sensitivity"],
+                                   heartbeat_s=options["heartbeat"], match_service=options["match_service"],
+                                   encoding_processes=options["encoding_processes"])
+        runner.run(options["duration"])
+    finally:
+        if gallery_sync is not None:
+            gallery_sync.stop()
+        event_queue.put(None)
+
+
+def run_partitioned(sources, processes, options, event_sink):
+    """
+    Spread streams over several processes, one shared gallery per process.
+
+    dlib's HOG detector and encoder hold the GIL, so threads alone cannot use
+    every core. Each process maps the same read-only gallery snapshot (see
+    gallery_snapshot.py) when one is configured, so its pages are shared.
+    """
+    context = multiprocessing.get_context("spawn")
+    event_queue = context.Queue()
+    partitions = [sources[i::processes] for i in range(processes) if sources[i::processes]]
+    children = [context.Process(target=_run_partition, args=(part, options, event_queue), daemon=True)
+                for part in partitions]
+    for child in children:
+        child.start()
+
+    finished = 0
+    try:
+        while finished < len(children):
+            try:
+                event = event_queue.get(timeout=1.0)
+            except queue.Empty:
+                # A child killed before it could say it was done must not hang the run
+                if not any(child.is_alive() for child in children):
+                    break
+                continue
+            if event is None:
+                finished += 1
+            else:
+                event_sink(event)
+    finally:
+        for child in children:
+            child.join(5.0)
+            if child.exitcode:
+                logger.error(f"Stream partition {child.name} exited with code {child.exitcode}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-stream face recognition")
+    parser.add_argument("sources", nargs="+", help="camera indexes, RTSP/HTTP URLs or video files")
+    parser.add_argument("--workers", type=int, default=None, help="inference threads per process (default: cores)")
+    parser.add_argument("--processes", type=int, default=1, help="spread streams over this many processes")
+    parser.add_argument("--events", help="write NDJSON events to this file instead of stdout")
+    parser.add_argument("--snapshot-dir", default="gallery_snapshot")
+    parser.add_argument("--no-mongo", action="store_true", help="use only the local gallery snapshot")
+    parser.add_argument("--track", action="store_true", help="track faces across frames")
+    parser.add_argument("--adaptive-ms", type=float, default=None, help="adaptive detection latency target")
+    parser.add_argument("--motion-gate", type=float, default=None, metavar="SENSITIVITY",
+                        help="skip recognition on static scenes (sensitivity 0-1, e.g. 0.5)")
+    parser.add_argument("--heartbeat", type=float, default=5.0, help="seconds between checks of a static scene")
+    parser.add_argument("--match-service", default=None,
+                        help="match through a shared match_service.py (http://host:port or unix:/path)")
+    parser.add_argument("--encoding-processes", type=int, default=None,
+                        help="encode crowded frames on a pool of this many processes")
+    parser.add_argument("--width", type=int, default=None)
+    parser.add_argument("--height", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--stats-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    mongo_uri = None
+    if not args.no_mongo:
+        from dotenv import load_dotenv
+        load_dotenv()
+        mongo_uri = (os.getenv("MONGO_URI") or "").strip('"') or None
+        if mongo_uri is None:
+            print("Error: MONGO_URI is not set (use --no-mongo to run from the local snapshot).")
+            raise SystemExit(1)
+
+    frame_size = (args.width, args.height) if args.width and args.height else None
+    out = open(args.events, "a") if args.events else sys.stdout
+    event_sink = EventWriter(out)
+
+    try:
+        if args.processes > 1:
+            options = {
+                "mongo_uri": mongo_uri, "snapshot_dir": args.snapshot_dir, "workers": args.workers,
+                "track": args.track, "frame_size": frame_size, "adaptive_detection_ms": args.adaptive_ms,
+                "stats_interval": args.stats_interval, "duration": args.duration,
+                "motion_sensitivity": args.motion_gate, "heartbeat": args.heartbeat,
+                "match_service": args.match_service, "encoding_processes": args.encoding_processes,
+            }
+            run_partitioned(args.sources, args.processes, options, event_sink)
+        else:
+            gallery, gallery_sync = load_gallery(mongo_uri, args.snapshot_dir)
+            runner = MultiStreamRunner(args.sources, gallery, workers=args.workers, event_sink=event_sink,
+                                       track=args.track, frame_size=frame_size,
+                                       adaptive_detection_ms=args.adaptive_ms,
+                                       stats_interval=args.stats_interval,
+                                       motion_sensitivity=args.motion_gate, heartbeat_s=args.heartbeat,
+                                       match_service=args.match_service,
+                                       encoding_processes=args.encoding_processes)
+            runner.run(args.duration)
+            if gallery_sync is not None:
+                gallery_sync.stop()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient()["face_db"]["known_faces"]
+
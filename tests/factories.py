@@ -0,0 +1,18 @@
+# Test data for the `known_faces` collection
+
+from datetime import datetime, timedelta
+import numpy as np
+from bson import ObjectId
+from encoding_codec import encoding_to_binary
+
+
+def random_encoding(seed):
+    return np.random.default_rng(seed).normal(size=128).astype(np.float32)
+
+
+def face_document(name, seed, age_s=0):
+    """A `known_faces` document whose ObjectId is `age_s` seconds old."""
+    created = datetime.utcnow() - timedelta(seconds=age_s)
+    # Backdated timestamp, unique remainder
+    doc_id = ObjectId(ObjectId.from_datetime(created).binary[:4] + ObjectId().binary[4:])
+    return {"_id": doc_id, "name": name, "encoding": encoding_to_binary(random_encoding(seed)), "timestamp": created}
@@ -0,0 +1,36 @@
+from facial_recognition import AdaptiveDetectionScale
+
+FACE = [(0, 200, 200, 0)]
+
+
+def settle(scale, elapsed_ms, frames=20, faces=FACE):
+    for _ in range(frames):
+        scale.observe_detections(faces)
+        scale.observe_latency(elapsed_ms)
+    return scale.scale
+
+
+def test_scale_shrinks_when_slow_and_grows_back_with_headroom():
+    scale = AdaptiveDetectionScale(target_ms=60.0, min_scale=0.25)
+    assert settle(scale, 200.0) == 0.25
+    assert settle(scale, 10.0) == 1.0
+
+
+def test_scale_holds_inside_the_target_band():
+    scale = AdaptiveDetectionScale(target_ms=60.0)
+    scale.scale = 0.5
+    assert settle(scale, 50.0) == 0.5
+
+
+def test_scale_grows_when_nothing_is_found():
+    scale = AdaptiveDetectionScale(target_ms=60.0, step=0.1)
+    scale.scale = 0.5
+    scale.observe_detections([])
+    assert abs(scale.observe_latency(500.0) - 0.6) < 1e-9
+
+
+def test_small_faces_keep_enough_pixels():
+    scale = AdaptiveDetectionScale(target_ms=60.0, min_face_pixels=60)
+    scale.scale = 0.25
+    scale.observe_detections([(0, 100, 100, 0)])
+    assert scale.observe_latency(500.0) >= 0.6
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect
+from factories import face_document, random_encoding
+from enrollment_queue import EnrollmentQueue
+from face_gallery import FaceGallery
+from gallery_sync import GallerySync
+
+
+class Recognition:
+    """Only used when a job has no encoding; these tests always pass one."""
+
+    def get_face_encoding_from_image(self, frame):
+        return None
+
+
+@pytest.fixture
+def offline(collection, monkeypatch):
+    """Make inserts fail until the returned callable is called."""
+    real_insert = collection.insert_one
+
+    def fail(*args, **kwargs):
+        raise AutoReconnect("connection refused")
+
+    monkeypatch.setattr(collection, "insert_one", fail)
+    return lambda: monkeypatch.setattr(collection, "insert_one", real_insert)
+
+
+def make_queue(collection, sync, tmp_path):
+    return EnrollmentQueue(collection, sync, Recognition(), image_dir=str(tmp_path / "images"),
+                           backlog_path=str(tmp_path / "backlog.ndjson"), retries=1, retry_delay=0)
+
+
+def enroll(queue, name, seed, age_s=0):
+    """Run one enrollment through the worker; `age_s` backdates the id minted at submit time."""
+    job = queue.submit(name, np.zeros((48, 48, 3), dtype=np.uint8), random_encoding(seed))
+    if age_s:
+        job.doc_id = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=age_s))
+    queue.start()
+    queue.stop()
+    return job
+
+
+def test_buffered_enrollment_survives_reconcile(collection, offline, tmp_path):
+    # No lookback window, so only the backlog keeps the face
+    sync = GallerySync(collection, FaceGallery(), watermark_overlap=0)
+    queue = make_queue(collection, sync, tmp_path)
+
+    job = enroll(queue, "alice", 1)
+    assert job.status == "buffered"
+    assert sync.gallery.names == ["alice"]
+    assert sync.reconcile() == (0, 0, 0)
+    assert sync.gallery.names == ["alice"]
+
+
+def test_replay_uses_a_fresh_id_that_other_nodes_poll(collection, offline, tmp_path):
+    other = GallerySync(collection, FaceGallery())
+    sync = GallerySync(collection, FaceGallery())
+    queue = make_queue(collection, sync, tmp_path)
+
+    # Enrolled at the start of a long outage; other nodes' watermarks have moved on since
+    job = enroll(queue, "alice", 1, age_s=3600)
+    collection.insert_many([face_document("bob", 2)])
+    other.load_full()
+
+    offline()
+    assert queue.replay_backlog() == 1
+
+    doc = collection.find_one({"name": "alice"})
+    assert doc["_id"] != job.doc_id and doc["enrollment_id"] == job.doc_id
+    assert sync.gallery.ids == [doc["_id"]]
+    assert other.poll_new() == 1
+    assert sorted(other.gallery.names) == ["alice", "bob"]
+
+
+def test_replay_is_idempotent(collection, offline, tmp_path):
+    sync = GallerySync(collection, FaceGallery())
+    queue = make_queue(collection, sync, tmp_path)
+    enroll(queue, "alice", 1)
+    backlog = (tmp_path / "backlog.ndjson").read_text()
+
+    offline()
+    assert queue.replay_backlog() == 1
+    # Crash before the backlog was rewritten: the same records are replayed again
+    (tmp_path / "backlog.ndjson").write_text(backlog)
+    assert queue.replay_backlog() == 1
+
+    assert collection.count_documents({"name": "alice"}) == 1
+    assert sync.gallery.names == ["alice"]
+    assert (tmp_path / "backlog.ndjson").read_text() == ""
+
+
+def test_backlog_is_pending_after_restart(collection, offline, tmp_path):
+    queue = make_queue(collection, GallerySync(collection, FaceGallery()), tmp_path)
+    enroll(queue, "alice", 1)
+
+    restarted = GallerySync(collection, FaceGallery(), watermark_overlap=0)
+    assert make_queue(collection, restarted, tmp_path).load_backlog() == 1
+    assert restarted.reconcile() == (0, 0, 0)
+    assert restarted.gallery.names == ["alice"]
@@ -0,0 +1,85 @@
+import numpy as np
+from ann_index import IVFIndex
+from face_gallery import FaceGallery
+from factories import random_encoding
+
+
+def filled_gallery(size, index=None):
+    gallery = FaceGallery(capacity=4)
+    if index is not None:
+        gallery.set_index(index)
+    gallery.add_many([random_encoding(i) for i in range(size)], [f"person{i}" for i in range(size)],
+                     [f"id{i}" for i in range(size)])
+    assert gallery.wait_for_index(10)
+    return gallery
+
+
+def assert_finds_everyone(gallery):
+    for row, face_id in enumerate(gallery.ids):
+        indices, distances = gallery.match(gallery.encodings[row])
+        assert gallery.ids_at(indices[0]) == [face_id]
+        assert distances[0, 0] < 0.02
+
+
+def test_remove_moves_the_last_row_into_the_gap():
+    gallery = filled_gallery(5)
+    assert gallery.remove("id1")
+    assert gallery.ids == ["id0", "id4", "id2", "id3"]
+    assert gallery.row_of("id4") == 1
+    np.testing.assert_array_equal(gallery.encodings[1], random_encoding(4))
+    assert not gallery.remove("id1")
+
+
+def test_remove_and_upsert_keep_the_index_in_step():
+    gallery = filled_gallery(64, IVFIndex(n_lists=4, n_probe=4, min_train_size=32))
+    assert gallery.uses_index
+
+    for face_id in ("id0", "id10", "id63"):
+        gallery.remove(face_id)
+    gallery.upsert("id5", random_encoding(1000), "renamed")
+    gallery.upsert("new", random_encoding(1001), "newcomer")
+
+    assert len(gallery) == 62
+    indexed = np.sort(np.concatenate(gallery.index._lists))
+    np.testing.assert_array_equal(indexed, np.arange(len(gallery)))
+    assert_finds_everyone(gallery)
+    assert gallery.top_k(random_encoding(1000), k=1)[0][0][:2] == ("renamed", "id5")
+
+
+def test_adopted_read_only_arrays_are_copied_on_first_write():
+    source = filled_gallery(3)
+    encodings, sq_norms = source.encodings.copy(), source.sq_norms.copy()
+    encodings.flags.writeable = False
+    sq_norms.flags.writeable = False
+
+    gallery = FaceGallery()
+    gallery.adopt(encodings, sq_norms, source.names, source.ids)
+    assert not gallery.encodings.flags.writeable
+
+    gallery.remove("id0")
+    gallery.add(random_encoding(99), "person99", "id99")
+    assert gallery.encodings.flags.writeable
+    assert gallery.ids == ["id2", "id1", "id99"]
+    # The shared arrays are untouched
+    np.testing.assert_array_equal(encodings, source.encodings)
+    assert_finds_everyone(gallery)
+
+
+def test_ivf_index_remove_rows_and_move_row():
+    encodings = np.stack([random_encoding(i) for i in range(40)])
+    index = IVFIndex(n_lists=4, n_probe=4, pq_subvectors=4, rerank=8, min_train_size=1)
+    index.train(encodings)
+    sq_norms = np.einsum("ij,ij->i", encodings, encodings)
+
+    index.remove_rows([3, 7])
+    indexed = np.concatenate(index._lists)
+    assert 3 not in indexed and 7 not in indexed
+    assert len(indexed) == 38
+
+    # Compaction as FaceGallery.remove does it: the last row takes over row 3
+    encodings[3], sq_norms[3] = encodings[39], sq_norms[39]
+    index.move_row(39, 3)
+    np.testing.assert_array_equal(index._codes[3], index._codes[39])
+    indices, distances = index.search(encodings[3], encodings[:39], sq_norms[:39])
+    assert indices[0, 0] == 3
+    assert distances[0, 0] < 0.02
@@ -0,0 +1,82 @@
+import numpy as np
+from face_gallery import FaceGallery
+from face_tracker import FaceTracker, Track, box_iou
+from facial_recognition import RecognitionResult
+
+BOX = (40, 120, 120, 40)
+
+
+def observe(track, name, confidence, frame_index):
+    track.observe(name, confidence, np.zeros(128), 0, 0.4, frame_index, smoothing=0.7, history=5,
+                  forget_below=50.0)
+
+
+def test_one_outlier_does_not_flip_a_track():
+    track = Track(0, BOX, 0)
+    for i in range(10):
+        observe(track, "alice", 80.0, i)
+    observe(track, "bob", 75.0, 10)
+    assert track.name == "alice"
+
+
+def test_a_consistent_new_name_takes_over():
+    track = Track(0, BOX, 0)
+    for i in range(10):
+        observe(track, "alice", 80.0, i)
+    for i in range(10, 14):
+        observe(track, "bob", 80.0, i)
+    assert track.name == "bob"
+    assert "alice" not in track.name_scores
+
+
+def test_box_iou():
+    assert box_iou(BOX, BOX) == 1.0
+    assert box_iou(BOX, (200, 300, 300, 200)) == 0.0
+
+
+class ScriptedRecognition:
+    """Detects one fixed box and recognizes it as the next name of a script."""
+
+    medium_confidence_threshold = 0.5
+
+    def __init__(self, names):
+        self.gallery = FaceGallery()
+        self.names = list(names)
+        self.encoded = 0
+
+    def detect_faces(self, rgb_frame):
+        return [BOX]
+
+    def encode_faces(self, rgb_frame, locations):
+        self.encoded += len(locations)
+        return [np.zeros(128) for _ in locations]
+
+    def build_result(self, frame, locations, encodings):
+        names = [self.names.pop(0) for _ in locations]
+        result = RecognitionResult(locations, np.asarray(encodings), None, np.zeros(len(names), dtype=np.intp),
+                                   np.full(len(names), 0.4), names)
+        result.confidence_scores = [80.0] * len(names)
+        return result
+
+    def report_frame_latency(self, elapsed_ms):
+        pass
+
+
+def test_tracker_stops_encoding_confirmed_faces():
+    recognition = ScriptedRecognition(["alice"] * 20)
+    tracker = FaceTracker(recognition, detect_every=1, confirm_hits=3, reencode_every=100, use_optical_flow=False)
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+
+    names = [tracker.analyze_frame(frame).face_names for _ in range(10)]
+    assert all(frame_names == ["alice"] for frame_names in names)
+    assert recognition.encoded == 3
+    assert len(tracker.tracks) == 1
+
+
+def test_tracker_keeps_the_name_through_an_outlier_reencode():
+    recognition = ScriptedRecognition(["alice"] * 3 + ["bob"] + ["alice"] * 20)
+    tracker = FaceTracker(recognition, detect_every=1, confirm_hits=3, reencode_every=4, use_optical_flow=False)
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+
+    names = [tracker.analyze_frame(frame).face_names for _ in range(12)]
+    assert all(frame_names == ["alice"] for frame_names in names)
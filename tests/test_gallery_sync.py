@@ -0,0 +1,101 @@
+import time
+import numpy as np
+from pymongo.errors import AutoReconnect
+from factories import face_document, random_encoding
+from face_gallery import FaceGallery
+from gallery_sync import GallerySync
+
+
+def test_poll_new_picks_up_recent_inserts(collection):
+    collection.insert_one(face_document("alice", 1))
+    sync = GallerySync(collection, FaceGallery())
+    sync.load_full()
+
+    collection.insert_one(face_document("bob", 2))
+    assert sync.poll_new() == 1
+    assert sorted(sync.gallery.names) == ["alice", "bob"]
+
+
+def test_reconcile_adds_inserts_older_than_the_watermark(collection):
+    collection.insert_one(face_document("alice", 1))
+    sync = GallerySync(collection, FaceGallery())
+    sync.load_full()
+
+    # An id minted long before the watermark (clock skew, replayed backlog) is invisible to the poll
+    old = face_document("legacy", 2, age_s=3600)
+    collection.insert_one(old)
+    assert sync.poll_new() == 0
+
+    assert sync.reconcile() == (1, 0, 0)
+    assert sorted(sync.gallery.names) == ["alice", "legacy"]
+    row = sync.gallery.row_of(old["_id"])
+    np.testing.assert_allclose(sync.gallery.encodings[row], random_encoding(2))
+
+
+def test_reconcile_applies_deletions_and_renames(collection):
+    alice, bob = face_document("alice", 1), face_document("bob", 2)
+    collection.insert_many([alice, bob])
+    sync = GallerySync(collection, FaceGallery())
+    sync.load_full()
+
+    collection.delete_one({"_id": alice["_id"]})
+    collection.update_one({"_id": bob["_id"]}, {"$set": {"name": "robert"}})
+    assert sync.reconcile() == (0, 1, 1)
+    assert sync.gallery.names == ["robert"]
+
+
+class BrokenStream:
+    """Change stream whose connection drops on the first read."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def try_next(self):
+        raise AutoReconnect("connection reset")
+
+
+def test_sync_thread_survives_an_outage_after_the_change_stream_fails(collection, monkeypatch):
+    collection.insert_one(face_document("alice", 1))
+    sync = GallerySync(collection, FaceGallery(), poll_interval=0.05)
+    sync.load_full()
+
+    real_find = collection.find
+
+    def unreachable(*args, **kwargs):
+        raise AutoReconnect("server selection timeout")
+
+    monkeypatch.setattr(collection, "watch", lambda **kwargs: BrokenStream(), raising=False)
+    monkeypatch.setattr(collection, "find", unreachable)
+    sync.start()
+    try:
+        time.sleep(0.3)
+        assert sync._thread.is_alive()
+
+        # Back online: the polling fallback catches up, including faces with an old id
+        collection.insert_one(face_document("bob", 2, age_s=3600))
+        monkeypatch.setattr(collection, "find", real_find)
+        deadline = time.monotonic() + 5
+        while sorted(sync.gallery.names) != ["alice", "bob"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert sorted(sync.gallery.names) == ["alice", "bob"]
+    finally:
+        sync.stop()
+
+
+def test_one_off_load_from_a_snapshot_applies_deletions_and_renames(collection, tmp_path):
+    from gallery_snapshot import GallerySnapshot
+    from stream_runner import load_gallery
+
+    alice, bob = face_document("alice", 1), face_document("bob", 2)
+    collection.insert_many([alice, bob])
+    sync = GallerySync(collection, FaceGallery())
+    sync.load_full()
+    GallerySnapshot(str(tmp_path)).save(sync.gallery, sync.watermark)
+
+    collection.delete_one({"_id": alice["_id"]})
+    collection.update_one({"_id": bob["_id"]}, {"$set": {"name": "robert"}})
+    gallery, _ = load_gallery(snapshot_dir=str(tmp_path), collection=collection, sync=False)
+    assert gallery.names == ["robert"]
@@ -0,0 +1,64 @@
+import mongomock
+import numpy as np
+import pytest
+from factories import face_document, random_encoding
+from face_gallery import FaceGallery
+from gallery_snapshot import GallerySnapshot
+from gallery_sync import GallerySync
+from gallery_transfer import export_matrix, export_ndjson, import_records, read_export
+
+
+@pytest.fixture
+def source():
+    """Another site's gallery, enrolled long before the target node started."""
+    collection = mongomock.MongoClient()["face_db"]["known_faces"]
+    collection.insert_many([face_document(name, seed, age_s=86400) for seed, name in enumerate(["ann", "ben"])])
+    return collection
+
+
+@pytest.fixture(params=["ndjson", "matrix"])
+def exported(request, source, tmp_path):
+    if request.param == "matrix":
+        path = tmp_path / "gallery_matrix"
+        assert export_matrix(source, str(path)) == 2
+    else:
+        path = tmp_path / "gallery.ndjson.gz"
+        assert export_ndjson(source, str(path)) == 2
+    return str(path)
+
+
+def test_round_trip_reaches_a_running_node(collection, exported, tmp_path):
+    collection.insert_one(face_document("local", 10))
+    node = GallerySync(collection, FaceGallery())
+    node.load_full()
+    snapshot = GallerySnapshot(str(tmp_path / "snapshot"))
+    snapshot.save(node.gallery, node.watermark)
+
+    assert import_records(read_export(exported), collection) == 2
+
+    # Fresh ids are newer than the node's watermark
+    assert node.poll_new() == 2
+    assert sorted(node.gallery.names) == ["ann", "ben", "local"]
+    for doc in collection.find({"source_id": {"$exists": True}}):
+        row = node.gallery.row_of(doc["_id"])
+        np.testing.assert_allclose(node.gallery.encodings[row], random_encoding(["ann", "ben"].index(doc["name"])))
+
+    # A node restarting from the old snapshot gets them with its delta load
+    restarted = GallerySync(collection, FaceGallery())
+    assert restarted.load_snapshot(snapshot)
+    assert sorted(restarted.gallery.names) == ["ann", "ben", "local"]
+
+
+def test_reimport_is_idempotent(collection, exported):
+    gallery = FaceGallery()
+    import_records(read_export(exported), collection, gallery)
+    import_records(read_export(exported), collection, gallery)
+
+    assert collection.count_documents({}) == 2
+    assert sorted(gallery.names) == ["ann", "ben"]
+    assert sorted(gallery.ids) == sorted(doc["_id"] for doc in collection.find())
+
+
+def test_import_into_the_source_adds_nothing(source, exported):
+    import_records(read_export(exported), source)
+    assert source.count_documents({}) == 2
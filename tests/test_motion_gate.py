@@ -0,0 +1,64 @@
+import numpy as np
+from motion_gate import MotionGate, MotionGatedRecognizer
+
+
+def scene(brightness=100, person=False):
+    frame = np.full((240, 320, 3), brightness, dtype=np.uint8)
+    if person:
+        frame[60:200, 120:200] = 230
+    return frame
+
+
+def test_first_frame_counts_as_motion_and_a_static_scene_does_not():
+    gate = MotionGate()
+    assert gate.update(scene())
+    assert not any(gate.update(scene()) for _ in range(5))
+
+
+def test_someone_walking_in_is_motion():
+    gate = MotionGate()
+    gate.update(scene())
+    assert gate.update(scene(person=True))
+    assert gate.last_score > 0.1
+
+
+def test_gradual_lighting_changes_are_absorbed():
+    gate = MotionGate()
+    gate.update(scene(100))
+    assert not any(gate.update(scene(100 + step)) for step in range(1, 30))
+
+
+class CountingRecognizer:
+    gallery = None
+
+    def __init__(self):
+        self.calls = 0
+
+    def analyze_frame(self, frame):
+        self.calls += 1
+        return self.calls
+
+
+def test_static_frames_reuse_the_last_result(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("motion_gate.time.monotonic", lambda: clock[0])
+    recognizer = CountingRecognizer()
+    # Instant background, so a person standing still stops counting as motion right away
+    gated = MotionGatedRecognizer(recognizer, MotionGate(background_rate=1.0), heartbeat_s=5.0, hold_s=1.0)
+
+    assert gated.analyze_frame(scene()) == 1
+    clock[0] += 2.0
+    assert gated.analyze_frame(scene()) == 1
+    assert gated.frames_gated == 1
+
+    clock[0] += 0.1
+    assert gated.analyze_frame(scene(person=True)) == 2
+    # Still refreshed while the person stands still, until hold_s runs out
+    clock[0] += 0.5
+    assert gated.analyze_frame(scene(person=True)) == 3
+    clock[0] += 1.0
+    assert gated.analyze_frame(scene(person=True)) == 3
+
+    # Heartbeat
+    clock[0] += 5.0
+    assert gated.analyze_frame(scene(person=True)) == 4
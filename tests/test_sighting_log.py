@@ -0,0 +1,94 @@
+import threading
+import numpy as np
+from facial_recognition import RecognitionResult
+from sighting_log import SightingLog
+
+
+def recognized(*names, track_ids=None):
+    result = RecognitionResult([(0, 10, 10, 0)] * len(names), np.zeros((len(names), 128)), None,
+                               np.zeros(len(names), dtype=np.intp), np.zeros(len(names)), list(names))
+    result.confidence_scores = [90.0] * len(names)
+    result.confidence_levels = ["HIGH"] * len(names)
+    if track_ids is not None:
+        result.track_ids = track_ids
+    return result
+
+
+class BlockingCollection:
+    """Stands in for a MongoDB collection whose inserts hang until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.inserting = threading.Event()
+        self.docs = []
+
+    def insert_many(self, docs, ordered=True):
+        self.inserting.set()
+        self.release.wait(5)
+        self.docs.extend(docs)
+
+
+def test_file_only_flush_does_not_wait_for_mongodb(tmp_path):
+    collection = BlockingCollection()
+    log = SightingLog(str(tmp_path / "sightings.ndjson"), collection=collection)
+    log.record(recognized("alice"))
+    writer = threading.Thread(target=log.flush)
+    writer.start()
+    assert collection.inserting.wait(5)
+
+    # The writer is stuck in insert_many; an export still sees the newest sightings
+    log.record(recognized("bob"))
+    assert log.flush(file_only=True) == 1
+    assert [record["name"] for record in log.iter_records()] == ["alice", "bob"]
+
+    collection.release.set()
+    writer.join(5)
+    log.flush()
+    assert [doc["name"] for doc in collection.docs] == ["alice", "bob"]
+
+
+def test_a_face_is_logged_again_only_when_its_name_changes_or_the_window_expires(tmp_path, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("sighting_log.time.monotonic", lambda: clock[0])
+    log = SightingLog(str(tmp_path / "sightings.ndjson"), dedup_window=30.0)
+
+    assert log.record(recognized("alice", "bob", track_ids=[1, 2])) == 2
+    assert log.record(recognized("alice", "bob", track_ids=[1, 2])) == 0
+    # Same name on a new track, and a renamed track
+    assert log.record(recognized("alice", "carol", track_ids=[3, 2])) == 2
+    clock[0] += 31.0
+    assert log.record(recognized("alice", track_ids=[1])) == 1
+    # Without tracking, faces are deduplicated by name per camera
+    assert log.record(recognized("dave")) == 1
+    assert log.record(recognized("dave")) == 0
+    assert log.record(recognized("dave"), camera="door") == 1
+
+    log.flush()
+    assert [(r["name"], r["track_id"]) for r in log.iter_records()] == [
+        ("alice", 1), ("bob", 2), ("alice", 3), ("carol", 2), ("alice", 1), ("dave", None), ("dave", None)]
+
+
+def test_the_log_rotates_and_is_read_back_oldest_first(tmp_path, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("sighting_log.time.monotonic", lambda: clock[0])
+    path = tmp_path / "sightings.ndjson"
+    log = SightingLog(str(path), max_bytes=300, backups=2)
+
+    for i in range(12):
+        log.record(recognized(f"person{i}"))
+        log.flush()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["sightings.ndjson", "sightings.ndjson.1",
+                                                          "sightings.ndjson.2"]
+    names = [record["name"] for record in log.iter_records()]
+    # The oldest file fell off the end; what is left is contiguous and in order
+    assert names == [f"person{i}" for i in range(12 - len(names), 12)]
+    assert len(names) < 12
+
+
+def test_a_full_buffer_drops_the_oldest_sightings(tmp_path):
+    log = SightingLog(str(tmp_path / "sightings.ndjson"), max_pending=2)
+    log.record(recognized("alice", "bob", "carol"))
+    assert log.dropped == 1
+    log.flush()
+    assert [record["name"] for record in log.iter_records()] == ["bob", "carol"]
@@ -1,12 +1,26 @@
+import time
+# Startup timings are measured from here, before any heavy import
+STARTUP_T0 = time.perf_counter()
+
 from random import choices
 import tkinter as tk
 import cv2
 from tkinter import messagebox, ttk
 from PIL import Image, ImageTk
+import numpy as np
 from mongo_storage import MongoStorage 
 from export_storage import ExportStorage
 from confidence_recognition import ConfidenceRecognition
-import time
+from pipeline import RecognitionPipeline, draw_recognition_overlay
+from face_tracker import FaceTracker
+from metrics import metrics, start_exporters
+from sighting_log import SightingLog
+from motion_gate import MotionGate, MotionGatedRecognizer
+from facial_recognition import load_face_models
+from encoding_engine import EncodingEngine
+from match_service import MatchClient
+import logging
+import threading
 import os
 from dotenv import load_dotenv
 
@@ -25,6 +39,20 @@ if not MONGO_URI:
 
 print(f"[DEBUG] Loaded MONGO_URI: {repr(MONGO_URI)}")
 
+# Motion gate: 0 disables it; otherwise 0-1, higher reacts to smaller changes
+MOTION_SENSITIVITY = float(os.getenv("MOTION_SENSITIVITY", "0.5"))
+MOTION_HEARTBEAT_S = float(os.getenv("MOTION_HEARTBEAT_S", "5"))
+
+# Optional shared matching service (see match_service.py); local matching is the fallback
+MATCH_SERVICE = os.getenv("MATCH_SERVICE")
+
+# Encode crowded frames on this many worker processes (see encoding_engine.py); 0 keeps encoding in-process
+ENCODING_PROCESSES = int(os.getenv("ENCODING_PROCESSES", "0"))
+
+# Rendering limits for the Tk thread
+RENDER_MAX_FPS = 30
+PANEL_MIN_INTERVAL_S = 0.25
+
 
 
 class CameraApp:
@@ -36,6 +64,10 @@ class CameraApp:
         
 
         # UI Elements
+        self.show_metrics_var = tk.BooleanVar()
+        self.check_show_metrics = tk.Checkbutton(self.root, text="Show Metrics", variable=self.show_metrics_var)
+        self.check_show_metrics.place(x=1030, y=725)
+
         self.dark_mode_var = tk.BooleanVar()
         self.check_dark_mode = tk.Checkbutton(self.root, text="Dark Mode", variable=self.dark_mode_var, command=self.dark_mode)
         self.check_dark_mode.place(x=1150, y=725)
@@ -68,6 +100,10 @@ class CameraApp:
         self.name_cap.place(x=320, y=625)
         self.name_label = tk.Label(self.root, text="Enter name of User:")
         self.name_label.place(x=321, y=605)
+        self.startup_label = tk.Label(self.root, text="Starting...")
+        self.startup_label.place(x=75, y=475)
+        self.enroll_status_label = tk.Label(self.root, text="")
+        self.enroll_status_label.place(x=321, y=670)
 
         self.refresh_button = tk.Button(self.root, text="Refresh List", width=10, height=2, command=self.refresh)
         self.refresh_button.place(x=925, y=615)
@@ -85,6 +121,14 @@ class CameraApp:
         self.vid_frame.place(x=50, y=75)
         self.feed_widget = tk.Label(self.root)
         self.feed_widget.place(x=75, y=90)
+        # Reused across frames by show_frame()
+        self._draw_buffer = None
+        self._rgb_buffer = None
+        self._photo_image = None
+        self._photo_shown = False
+        self._last_render = 0.0
+        self._panel_key = None
+        self._last_panel_update = 0.0
 
         # Camera setup
         self.cap = cv2.VideoCapture(0)
@@ -92,7 +136,6 @@ class CameraApp:
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
         self.cap.set(cv2.CAP_PROP_FPS, 30)  # NEW: Request 30 FPS
-        self.last_frame_time = time.time()  # For FPS tracking
 
 
         if not self.cap.isOpened():
@@ -102,110 +145,217 @@ class CameraApp:
 
         self.feed_active = False
         self.recognition = ConfidenceRecognition(self.cap, self.name_cap)
-        self.storage = MongoStorage(MONGO_URI, self.cap, self.name_cap, self.recognition)
+        # Detect on a downscaled copy sized to keep recognition near 60 ms per frame
+        self.recognition.enable_adaptive_detection(target_ms=60)
+        if MATCH_SERVICE:
+            self.recognition.use_match_service(MatchClient(MATCH_SERVICE))
+        self.encoding_engine = None
+        if ENCODING_PROCESSES > 0:
+            # Workers load the models in the background; encoding stays in-process until they are ready
+            self.encoding_engine = EncodingEngine(ENCODING_PROCESSES).start()
+            self.recognition.use_encoding_engine(self.encoding_engine)
+        # Track faces across frames so known faces are not re-encoded every frame
+        self.tracker = FaceTracker(self.recognition)
+        # Skip detection entirely while the scene is static, re-checking every few seconds
+        self.recognizer = self.tracker
+        if MOTION_SENSITIVITY > 0:
+            self.recognizer = MotionGatedRecognizer(self.tracker, MotionGate(MOTION_SENSITIVITY), MOTION_HEARTBEAT_S)
+        # Capture and recognition run on worker threads; Tk only renders.
+        # Video starts right away; recognition is attached once the backend has loaded.
+        self.pipeline = RecognitionPipeline(None, frame_size=(self.width, self.height))
+        self.storage = None
+        self.sightings = None
+        self.startup_times = {}
+        self._startup_status = "Loading face models..."
+        self._startup_error = None
+        self._backend_ready = threading.Event()
+        self.cap_image_button.config(state=tk.DISABLED)
+        self.export_button.config(state=tk.DISABLED)
+
+        # Optional local metrics endpoint / JSON file (METRICS_PORT, METRICS_FILE)
+        self.metrics_exporters = start_exporters()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.start_stop_feed()
 
+        # Models, MongoDB connect and gallery load run off the Tk thread
+        threading.Thread(target=self.load_backend, name="startup", daemon=True).start()
+        self.check_startup()
+
+    def mark_startup(self, stage):
+        """Record seconds since launch for a startup milestone (printed and exported as a gauge)."""
+        if stage in self.startup_times:
+            return
+        elapsed = time.perf_counter() - STARTUP_T0
+        self.startup_times[stage] = elapsed
+        metrics.set_gauge(f"startup_{stage}_s", round(elapsed, 3))
+        print(f"[INFO] Startup: {stage} after {elapsed:.2f}s")
+
+    def load_backend(self):
+        """Background startup stage: face models, MongoDB and the gallery. No Tk calls here."""
+        try:
+            load_face_models()
+            self.mark_startup("models_loaded")
+
+            self._startup_status = "Connecting to MongoDB and loading faces..."
+            # Enrollment reads the newest frame from the pipeline instead of the camera directly
+            self.storage = MongoStorage(MONGO_URI, self.pipeline, self.name_cap, self.recognition)
+            self.storage.start_sync()
+            # Every sighting is buffered and written to disk/MongoDB in batches by a background thread
+            self.sightings = SightingLog(collection=self.storage.db["sightings"])
+            self.sightings.start()
+            self.mark_startup("gallery_loaded")
+        except Exception as e:
+            logging.exception("Startup failed")
+            self._startup_error = str(e)
+        finally:
+            self._backend_ready.set()
+
+    def check_startup(self):
+        """Poll the background startup from the Tk thread and switch recognition on when it is done."""
+        if not self._backend_ready.is_set():
+            self.startup_label.config(text=self._startup_status)
+            self.root.after(100, self.check_startup)
+            return
+
+        if self._startup_error is not None:
+            self.startup_label.config(text=f"Startup failed: {self._startup_error}")
+            messagebox.showerror("Startup Error", self._startup_error)
+            return
+
+        self.pipeline.on_result = self.sightings.record
+        self.pipeline.recognition = self.recognizer
+        self.cap_image_button.config(state=tk.NORMAL)
+        self.export_button.config(state=tk.NORMAL)
+        self.startup_label.config(text=f"Ready ({len(self.recognition.gallery)} known faces)")
+        self.poll_enrollments()
+
     def capture_image(self):
-        # Call MongoDB-based image capture and storage
-        uid, _ = self.storage.take_picture()
-        
-        if uid:
-            # Reload the known face encodings from MongoDB after adding a new one
-            self.storage.load_known_faces()
-        
+        # Enrollment is queued; encoding, image write and the MongoDB insert happen in the background
+        job = self.storage.take_picture()
+        if job is not None:
+            self.enroll_status_label.config(text=f"Enrolling {job.name}...")
+
         # Clear the name entry box
         self.name_cap.delete("0.0", tk.END)
 
+    def poll_enrollments(self):
+        messages = {
+            "saved": "Saved {name}",
+            "buffered": "Saved {name} locally (MongoDB offline, will retry)",
+            "no_face": "No face found for {name}",
+            "failed": "Enrolling {name} failed",
+        }
+        for job in self.storage.enrollment.completed():
+            print(f"[INFO] Enrollment of {job.name}: {job.status}")
+            self.enroll_status_label.config(text=messages[job.status].format(name=job.name))
+        self.root.after(250, self.poll_enrollments)
+
 
     def handle_export(self):
         export_type = self.export_dropdown.get()
         self.export_list(export_type)
 
     def export_list(self, choice):
-        exporter = ExportStorage(self.recognition, choice)
-        if choice == "txt":
-            exporter.export_to_txt()
-        elif choice == "csv":
-            exporter.export_to_csv()
-        elif choice == "json":
-            exporter.export_to_json()
-        else:
+        # Make sure the newest sightings are on disk before streaming the log; MongoDB is left to the writer
+        self.sightings.flush(file_only=True)
+        exporter = ExportStorage(self.sightings.iter_records(), choice)
+        if exporter.export() is None:
             print("Error: Invalid export type.")
             messagebox.showerror("Export Error", "Invalid export type.")
 
     def open_camera(self):
-        if self.feed_active:
-            ret, frame = self.cap.read()
-
-            # Only process every Nth frame (skip every other for speed)
-            if hasattr(self, "frame_count"):
-                self.frame_count += 1
-            else:
-                self.frame_count = 1
-
-            if self.frame_count % 2 != 0:
-                self.feed_widget.after(10, self.open_camera)
-                return
-
-            if ret:
-                frame = cv2.resize(frame, (self.width, self.height))
-
-                # Optional: show FPS overlay
-                now = time.time()
-                fps = 1 / (now - self.last_frame_time)
-                self.last_frame_time = now
-                cv2.putText(frame, f"FPS: {fps:.2f}", (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 0, 0), 2)
-
-                # Face recognition
-                face_locations, face_names = self.recognition.recognize_faces(frame)
-                confidence_scores = self.recognition.get_last_confidence_scores()
-
-                for (top, right, bottom, left), name, score in zip(face_locations, face_names, confidence_scores):
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                    cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
-
-                    if score >= 70:
-                        conf_color = (0, 255, 0)
-                    elif score >= 50:
-                        conf_color = (0, 255, 255)
-                    else:
-                        conf_color = (0, 0, 255)
-
-                    confidence_text = f"{score:.1f}%"
-                    cv2.putText(frame, confidence_text, (left, top - 30), cv2.FONT_HERSHEY_SIMPLEX, 0.75, conf_color, 2)
-
-                self.detected_people_text.delete(1.0, tk.END)
-                # Get unique names and highest confidence per person
-                name_conf_map = {}
-                for name, score in zip(face_names, confidence_scores):
-                    if name not in name_conf_map or score > name_conf_map[name]:
-                        name_conf_map[name] = score
-
-                # Write unique names and their best confidence
-                for name, score in name_conf_map.items():
-                    confidence_level = "HIGH" if score >= 70 else "MEDIUM" if score >= 50 else "LOW"
-                    self.detected_people_text.insert(tk.END, f"{name}\n")
-                    self.detected_people_text.insert(tk.END, f"Confidence: {score:.1f}% ({confidence_level})\n\n")
-
-
-                opencv_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
-                captured_image = Image.fromarray(opencv_image)
-                photo_image = ImageTk.PhotoImage(image=captured_image)
-
-                self.feed_widget.photo_image = photo_image
-                self.feed_widget.configure(image=photo_image)
-                self.feed_widget.after(10, self.open_camera)
-
-            else:
-                print("Failed to capture frame. Stopping feed.")
-                self.feed_active = False
-                self.feed_label.config(text="Feed Off")
-                self.start_button.config(text="Start Feed")
-                if self.cap.isOpened():
-                    self.cap.release()
-                cv2.destroyAllWindows()
-                self.feed_widget.config(image='')
+        if not self.feed_active:
+            return
+
+        now = time.perf_counter()
+        # Never render faster than RENDER_MAX_FPS; the camera usually delivers ~30 FPS anyway
+        wait_s = self._last_render + 1.0 / RENDER_MAX_FPS - now
+        packet, result = (None, None) if wait_s > 0 else self.pipeline.next_frame()
+        if packet is not None:
+            self._last_render = now
+            draw_start = time.perf_counter()
+            frame = self._frame_buffer(packet.frame)
+
+            stats = self.pipeline.stats()
+            cv2.putText(frame, f"FPS: {stats['render_fps']:.2f}  Rec: {stats['inference_fps']:.2f}", (10, 25),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 0, 0), 2)
+
+            # Overlays come from the newest finished recognition, which may lag the frame slightly
+            draw_recognition_overlay(frame, result)
+
+            if self.show_metrics_var.get():
+                for i, line in enumerate(metrics.overlay_lines()):
+                    cv2.putText(frame, line, (10, 50 + 16 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 0), 1)
+            metrics.record_time("drawing", (time.perf_counter() - draw_start) * 1000)
+
+            self.update_people_panel(result)
+
+            with metrics.timer("tk_render"):
+                self.show_frame(frame)
+            metrics.increment("frames_rendered")
+            self.mark_startup("first_frame")
+            if result is not None:
+                self.mark_startup("first_recognition")
+
+        elif self.pipeline.source_failed:
+            print("Failed to capture frame. Stopping feed.")
+            self.start_stop_feed()
+            return
+
+        delay_ms = max(1, int(wait_s * 1000)) if wait_s > 0 else 5
+        self.feed_widget.after(delay_ms, self.open_camera)
+
+    def _frame_buffer(self, frame):
+        """Copy the frame into a reused BGR buffer that overlays can be drawn on."""
+        if self._draw_buffer is None or self._draw_buffer.shape != frame.shape:
+            self._draw_buffer = np.empty_like(frame)
+            self._rgb_buffer = np.empty_like(frame)
+        np.copyto(self._draw_buffer, frame)
+        return self._draw_buffer
+
+    def show_frame(self, frame):
+        """
+        Push a BGR frame to the feed widget.
+
+        Converts into a reused RGB buffer and pastes into one persistent
+        PhotoImage, instead of allocating an RGBA copy, a PIL image and a new
+        PhotoImage every frame.
+        """
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb_buffer)
+        height, width = self._rgb_buffer.shape[:2]
+        image = Image.frombuffer("RGB", (width, height), self._rgb_buffer, "raw", "RGB", 0, 1)
+        if self._photo_image is None or (self._photo_image.width(), self._photo_image.height()) != (width, height):
+            self._photo_image = ImageTk.PhotoImage(image=image)
+            self._photo_shown = False
+        else:
+            self._photo_image.paste(image)
+        if not self._photo_shown:
+            self.feed_widget.configure(image=self._photo_image)
+            self._photo_shown = True
+
+    def update_people_panel(self, result):
+        """Rewrite the detected-people list only when the names or confidence levels change."""
+        # Get unique names and highest confidence per person
+        name_conf_map = {}
+        if result is not None:
+            for name, score in zip(result.face_names, result.confidence_scores):
+                if name not in name_conf_map or score > name_conf_map[name]:
+                    name_conf_map[name] = score
+
+        levels = {name: "HIGH" if score >= 70 else "MEDIUM" if score >= 50 else "LOW"
+                  for name, score in name_conf_map.items()}
+        key = tuple(levels.items())
+        now = time.perf_counter()
+        if key == self._panel_key or now - self._last_panel_update < PANEL_MIN_INTERVAL_S:
+            return
+        self._panel_key = key
+        self._last_panel_update = now
 
+        # Write unique names and their best confidence
+        lines = [f"{name}\nConfidence: {name_conf_map[name]:.1f}% ({level})\n\n" for name, level in levels.items()]
+        self.detected_people_text.delete(1.0, tk.END)
+        self.detected_people_text.insert(tk.END, "".join(lines))
+        metrics.increment("people_panel_updates")
 
     def start_stop_feed(self):
         if not self.feed_active:
@@ -216,18 +366,35 @@ class CameraApp:
             self.feed_active = True
             self.feed_label.config(text="Feed On")
             self.start_button.config(text="Stop Feed")
+            self.pipeline.start(self.cap)
             self.open_camera()
         else:
             self.feed_active = False
             self.feed_label.config(text="Feed Off")
             self.start_button.config(text="Start Feed")
+            self.pipeline.stop()
             if self.cap.isOpened():
                 self.cap.release()
             cv2.destroyAllWindows()
             self.feed_widget.config(image='')
+            self._photo_shown = False
+
+    def on_close(self):
+        self.pipeline.stop()
+        for exporter in self.metrics_exporters:
+            exporter.stop()
+        if self._backend_ready.is_set() and self.storage is not None:
+            if self.sightings is not None:
+                self.sightings.stop()
+            # Finish queued enrollments and persist the gallery snapshot so the next launch starts instantly
+            self.storage.close()
+        if self.encoding_engine is not None:
+            self.encoding_engine.close()
+        self.root.destroy()
 
     def refresh(self):
         self.detected_people_text.delete("0.0", tk.END)
+        self._panel_key = None
 
     def dark_mode(self):
         if self.dark_mode_var.get():
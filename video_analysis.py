@@ -0,0 +1,253 @@
+# video_analysis.py
+
+import argparse
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Per-process recognizer, created once by _init_worker
+_worker_recognition = None
+
+
+def read_frames(path, stride=1, start_frame=0):
+    """
+    Stream (frame_index, timestamp_s, frame) from a video file.
+
+    Skipped frames are only grab()bed, not decoded into images, so a large
+    stride is cheap. Nothing is buffered beyond the current frame.
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video: {path}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    if start_frame:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    index = start_frame
+    try:
+        while True:
+            if (index - start_frame) % stride:
+                if not capture.grab():
+                    break
+            else:
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                yield index, index / fps, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def _init_worker(snapshot_dir, encodings, names, ids, tolerance):
+    global _worker_recognition
+    from confidence_recognition import ConfidenceRecognition
+
+    _worker_recognition = ConfidenceRecognition(None, None)
+    _worker_recognition.tolerance = tolerance
+    if snapshot_dir:
+        from gallery_snapshot import GallerySnapshot
+        # Every worker maps the same read-only pages
+        GallerySnapshot(snapshot_dir).load_into(_worker_recognition.gallery)
+    else:
+        _worker_recognition.set_known_faces(encodings, names, ids)
+
+
+def _analyze(job):
+    frame_index, timestamp, frame = job
+    result = _worker_recognition.analyze_frame(frame)
+    faces = [
+        {"name": name, "confidence": round(float(score), 1), "level": level, "box": [int(v) for v in box]}
+        for box, name, score, level in zip(result.face_locations, result.face_names,
+                                           result.confidence_scores, result.confidence_levels)
+    ]
+    return frame_index, timestamp, faces
+
+
+class Timeline:
+    """
+    Folds per-frame sightings into appearance segments and writes them as they close.
+
+    A segment for a name stays open while that name keeps being seen; once it has
+    not been seen for `gap_s` seconds it is written out and forgotten, so memory
+    only holds the currently visible people.
+    """
+
+    def __init__(self, sink, gap_s=2.0, include_unknown=False):
+        self.sink = sink
+        self.gap_s = gap_s
+        self.include_unknown = include_unknown
+        self.open_segments = {}
+        self.segments_written = 0
+
+    def add(self, timestamp, faces):
+        for face in faces:
+            name = face["name"]
+            if name == "Unknown" and not self.include_unknown:
+                continue
+            segment = self.open_segments.get(name)
+            if segment is None:
+                segment = self.open_segments[name] = {
+                    "name": name, "start_s": timestamp, "end_s": timestamp,
+                    "frames": 0, "max_confidence": 0.0, "confidence_sum": 0.0,
+                }
+            segment["end_s"] = timestamp
+            segment["frames"] += 1
+            segment["max_confidence"] = max(segment["max_confidence"], face["confidence"])
+            segment["confidence_sum"] += face["confidence"]
+        self._close_stale(timestamp)
+
+    def _write(self, segment):
+        segment = dict(segment)
+        segment["mean_confidence"] = round(segment.pop("confidence_sum") / segment["frames"], 1)
+        segment["start_s"] = round(segment["start_s"], 3)
+        segment["end_s"] = round(segment["end_s"], 3)
+        self.sink(segment)
+        self.segments_written += 1
+
+    def _close_stale(self, now):
+        for name in [n for n, s in self.open_segments.items() if now - s["end_s"] > self.gap_s]:
+            self._write(self.open_segments.pop(name))
+
+    def close(self):
+        for segment in sorted(self.open_segments.values(), key=lambda s: s["start_s"]):
+            self._write(segment)
+        self.open_segments = {}
+
+
+def analyze_video(path, gallery, stride=5, processes=None, snapshot_dir=None, tolerance=0.6,
+                  on_frame=None, on_segment=None, gap_s=2.0, report_every=10.0, max_in_flight=None):
+    """
+    Run recognition over a video file on a process pool, in order, with flat memory.
+
+    Frames are submitted lazily with at most `max_in_flight` outstanding, and
+    results are consumed strictly in frame order, so memory does not grow with
+    video length.
+
+    Args:
+        path: Video file
+        gallery: FaceGallery to match against (ignored when snapshot_dir is given)
+        stride: Analyze every `stride`-th frame
+        processes: Worker processes (default: all cores)
+        snapshot_dir: Let workers memory-map this gallery snapshot instead of copying `gallery`
+        on_frame: Callback(frame_index, timestamp_s, faces) for every analyzed frame
+        on_segment: Callback(segment dict) for every closed appearance segment
+
+    Returns:
+        Summary dict with frames analyzed, elapsed seconds and frames/second
+    """
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or processes * 4
+    timeline = Timeline(on_segment or (lambda segment: None), gap_s=gap_s)
+
+    if snapshot_dir:
+        init_args = (snapshot_dir, None, None, None, tolerance)
+    else:
+        with gallery.lock:
+            init_args = (None, gallery.encodings.copy(), gallery.names, gallery.ids, tolerance)
+
+    analyzed = 0
+    start = time.monotonic()
+    last_report = start
+    with multiprocessing.get_context("spawn").Pool(processes, _init_worker, init_args) as pool:
+        pending = collections.deque()
+        frames = read_frames(path, stride)
+
+        def collect():
+            frame_index, timestamp, faces = pending.popleft().get()
+            timeline.add(timestamp, faces)
+            if on_frame is not None:
+                on_frame(frame_index, timestamp, faces)
+
+        for job in frames:
+            pending.append(pool.apply_async(_analyze, (job,)))
+            if len(pending) >= max_in_flight:
+                collect()
+                analyzed += 1
+
+                now = time.monotonic()
+                if now - last_report >= report_every:
+                    logger.info(f"{analyzed} frames analyzed, {analyzed / (now - start):.1f} frames/s")
+                    last_report = now
+        while pending:
+            collect()
+            analyzed += 1
+
+    timeline.close()
+    elapsed = time.monotonic() - start
+    return {
+        "frames_analyzed": analyzed,
+        "segments": timeline.segments_written,
+        "elapsed_s": round(elapsed, 2),
+        "frames_per_s": round(analyzed / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+class NdjsonWriter:
+    """Append one JSON object per line, flushing as it goes."""
+
+    def __init__(self, path):
+        self._file = open(path, "w") if path else None
+
+    def __call__(self, record):
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Offline face recognition over recorded video")
+    parser.add_argument("video")
+    parser.add_argument("--stride", type=int, default=5, help="analyze every Nth frame")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--timeline", default="timeline.ndjson", help="appearance segments output")
+    parser.add_argument("--detections", default=None, help="optional per-frame detections output")
+    parser.add_argument("--gap", type=float, default=2.0, help="seconds unseen before a segment closes")
+    parser.add_argument("--snapshot-dir", default="gallery_snapshot")
+    parser.add_argument("--no-mongo", action="store_true", help="use only the local gallery snapshot")
+    args = parser.parse_args()
+
+    from gallery_snapshot import GallerySnapshot
+    from stream_runner import load_gallery
+
+    mongo_uri = None
+    if not args.no_mongo:
+        from dotenv import load_dotenv
+        load_dotenv()
+        mongo_uri = (os.getenv("MONGO_URI") or "").strip('"') or None
+
+    gallery, _ = load_gallery(mongo_uri, args.snapshot_dir, sync=False)
+    # Workers can share the snapshot's pages only if it is already current
+    use_snapshot = args.no_mongo and GallerySnapshot(args.snapshot_dir).read_manifest() is not None
+
+    timeline_writer = NdjsonWriter(args.timeline)
+    detection_writer = NdjsonWriter(args.detections)
+    try:
+        summary = analyze_video(
+            args.video, gallery, stride=args.stride, processes=args.processes,
+            snapshot_dir=args.snapshot_dir if use_snapshot else None,
+            on_frame=lambda i, t, faces: detection_writer({"frame": i, "time_s": round(t, 3), "faces": faces}),
+            on_segment=timeline_writer, gap_s=args.gap,
+        )
+    finally:
+        timeline_writer.close()
+        detection_writer.close()
+    json.dump(summary, sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()